@@ -1,32 +1,236 @@
 import socket
 import struct
 import time
+import utime
+import uasyncio as asyncio
 from machine import RTC
+import stats
+import wifi_manager
 
+NTP_DELTA = 2208988800  # PICO epoch time setting
+servers = ("0.pool.ntp.org", "1.pool.ntp.org", "2.pool.ntp.org")
+port = 123
+timeout_ms = 2000  # time allowed for each NTP server to respond
+good_delay_ms = 100  # stop querying servers once a reply is this quick
+max_delay_ms = 2000  # ignore replies with a longer round trip than this
+min_drift_interval = 6 * 3600  # shortest sync spacing used to measure drift
+max_sync_interval = 3 * 86400  # longest time between syncs once drift known
+correction_step_ms = 200  # smallest drift correction applied to the RTC
+edge_poll_ms = 5  # how often the RTC is polled for a new second
+max_edge_error_ms = 20  # how late a second may be seen for a drift baseline
+DRIFT_FILE = "ntp_drift.bin"
+# ticks_ms can only measure up to about 6 days, so the sub-second clock
+# falls back to the RTC after this long without a sync
+TICKS_VALID_MS = 5 * 86400000
 
-def set_ntp_time():
-    """Syncs the machine RTC time with an NTP server."""
+# Sub-second clock: the RTC is set on a whole second, when ticks_ms was
+# _edge_ticks, and time since then is measured with ticks_ms
+_edge_ticks = None
+_edge_ms = 0
+_last_sync_ms = None  # local clock (ms) at the last successful sync
+_baseline = False  # the last sync was timed to the ms, for measuring drift
+_corrected_ms = 0  # drift correction applied since the last sync
+_query = bytearray(48)
+
+drift_ppm = None  # RTC drift estimate, positive when the RTC runs slow
+syncs = 0
+failures = 0
+last_offset_ms = None
+last_delay_ms = None
+
+
+def _load_drift():
+    global drift_ppm
     try:
-        NTP_DELTA = 2208988800  # PICO epoch time setting
-        host = "pool.ntp.org"
-        NTP_QUERY = bytearray(48)
-        NTP_QUERY[0] = 0x1B
-        addr = socket.getaddrinfo(host, 123)[0][-1]
+        with open(DRIFT_FILE, "rb") as datafile:
+            drift_ppm = struct.unpack("<f", datafile.read(4))[0]
+    except (OSError, ValueError):
+        drift_ppm = None
+
+
+def _save_drift():
+    with open(DRIFT_FILE, "wb") as datafile:
+        datafile.write(struct.pack("<f", drift_ppm))
+
+
+def local_ms():
+    """The device's time in milliseconds since the epoch."""
+    if _edge_ticks is not None:
+        elapsed = utime.ticks_diff(utime.ticks_ms(), _edge_ticks)
+        if 0 <= elapsed < TICKS_VALID_MS:
+            return _edge_ms + elapsed
+    return utime.time() * 1000
+
+
+def _sub_second():
+    """True if local_ms() is using the sub-second clock."""
+    return _edge_ticks is not None and 0 <= utime.ticks_diff(
+        utime.ticks_ms(), _edge_ticks) < TICKS_VALID_MS
+
+
+async def _find_edge():
+    """Start the sub-second clock as the RTC passes a whole second, found
+    by polling it. Returns False if the second wasn't seen within
+    'max_edge_error_ms' (e.g. another task held things up), in which case
+    local_ms() may be out by up to a second."""
+    global _edge_ticks, _edge_ms
+    second = utime.time()
+    polled = utime.ticks_ms()
+    while utime.time() == second:
+        polled = utime.ticks_ms()
+        await asyncio.sleep_ms(edge_poll_ms)
+    _edge_ticks = utime.ticks_ms()
+    _edge_ms = utime.time() * 1000
+    return utime.ticks_diff(_edge_ticks, polled) <= max_edge_error_ms
+
+
+def _ntp_ms(msg, offset):
+    """Convert the NTP timestamp at msg[offset:offset + 8] to epoch ms."""
+    seconds, fraction = struct.unpack_from("!II", msg, offset)
+    return (seconds - NTP_DELTA) * 1000 + ((fraction * 1000) >> 32)
+
+
+async def query(server):
+    """Query one NTP server without blocking other tasks. Returns (offset,
+    delay) in milliseconds, where offset is the amount the device clock is
+    behind the server, worked out from all four NTP timestamps. Returns None
+    if the server didn't give a usable reply in time."""
+    _query[0] = 0x1B  # LI 0, version 3, client mode
+    try:
+        addr = wifi_manager.resolve(server, port)
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
-            s.settimeout(5)
-            s.sendto(NTP_QUERY, addr)
-            msg = s.recv(48)
+            s.setblocking(False)
+            t1 = local_ms()
+            s.sendto(_query, addr)
+            msg = None
+            waited = 0
+            while msg is None and waited < timeout_ms:
+                try:
+                    msg = s.recv(48)
+                except OSError:
+                    # EAGAIN - nothing received yet
+                    await asyncio.sleep_ms(10)
+                    waited += 10
+            t4 = local_ms()
         finally:
             s.close()
-        val = struct.unpack("!I", msg[40:44])[0]
-        t = val - NTP_DELTA
-        tm = time.gmtime(t)
-        # noinspection PyArgumentList
-        RTC().datetime(
-            (tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
-
     except OSError as exc:
-        if exc.args[0] == 110:  # ETIMEOUT
-            time.sleep(2)
-            pass
+        print('NTP query to ' + server + ' failed: ' + str(exc))
+        wifi_manager.forget(server, port)
+        return None
+    # Reject no reply, an unsynchronised server (LI 3) or kiss-o'-death
+    # (stratum 0). The pool name is looked up again next time, which may
+    # give a different server.
+    if msg is None or len(msg) < 48 or msg[0] >> 6 == 3 or msg[1] == 0:
+        print('No usable reply from ' + server)
+        wifi_manager.forget(server, port)
+        return None
+    t2 = _ntp_ms(msg, 32)  # server receive time
+    t3 = _ntp_ms(msg, 40)  # server transmit time
+    offset = ((t2 - t1) + (t3 - t4)) // 2
+    delay = (t4 - t1) - (t3 - t2)
+    if delay > max_delay_ms:
+        return None
+    return offset, delay
+
+
+async def _step_clock(offset):
+    """Move the RTC on by 'offset' ms. The RTC only holds whole seconds, so
+    it is set as the corrected time passes a whole second, and that moment
+    is remembered as the start of the sub-second clock."""
+    global _edge_ticks, _edge_ms
+    await asyncio.sleep_ms(1000 - (local_ms() + offset) % 1000)
+    now = (local_ms() + offset + 500) // 1000
+    tm = time.gmtime(now)
+    # noinspection PyArgumentList
+    RTC().datetime(
+        (tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+    _edge_ticks = utime.ticks_ms()
+    _edge_ms = now * 1000
+
+
+async def set_ntp_time():
+    """Syncs the machine RTC time with NTP. Servers are queried in turn
+    until one replies with a round trip of 'good_delay_ms' or less, and the
+    reply with the shortest round trip is used. The offsets measured at
+    successive syncs give an estimate of the RTC drift, which correct()
+    applies between syncs. Only syncs timed to the millisecond are used
+    for this. The UDP socket is non-blocking and polled so that
+    other tasks keep running while we wait for the servers to respond.
+    Returns True if the clock was set."""
+    global _last_sync_ms, _baseline, _corrected_ms, drift_ppm, syncs, \
+        failures, last_offset_ms, last_delay_ms
+    if _last_sync_ms is None and drift_ppm is None:
+        _load_drift()
+    # Before the first sync the RTC only gives whole seconds, and an error
+    # of up to a second would later be taken for drift
+    fine = _sub_second() or await _find_edge()
+    stats.ntp_sync.start()
+    best = None
+    for server in servers:
+        sample = await query(server)
+        if sample is not None and (best is None or sample[1] < best[1]):
+            best = sample
+        if best is not None and best[1] <= good_delay_ms:
+            break
+    stats.ntp_sync.stop()
+    if best is None:
+        failures += 1
+        print('NTP sync failed - no usable server replies')
+        return False
+    offset, delay = best
+    last_offset_ms, last_delay_ms = offset, delay
+    if _last_sync_ms is not None and _baseline and fine:
+        elapsed = local_ms() - _last_sync_ms
+        if elapsed >= min_drift_interval * 1000:
+            # Total drift since the last sync, including the corrections
+            # already made for it
+            rate = (offset + _corrected_ms) * 1000000 / elapsed
+            if drift_ppm is None:
+                drift_ppm = rate
+            else:
+                drift_ppm += (rate - drift_ppm) / 2
+            _save_drift()
+    await _step_clock(offset)
+    _last_sync_ms = local_ms()
+    _baseline = fine
+    _corrected_ms = 0
+    syncs += 1
+    print('NTP offset ' + str(offset) + 'ms, delay ' + str(delay) +
+          'ms, drift ' + str(drift_ppm) + 'ppm')
+    return True
+
+
+async def correct():
+    """Correct the RTC for the drift estimated since the last sync, once
+    the correction needed reaches 'correction_step_ms'."""
+    global _corrected_ms
+    if drift_ppm is None or _last_sync_ms is None:
+        return
+    elapsed = local_ms() - _last_sync_ms
+    step = int(drift_ppm * elapsed / 1000000) - _corrected_ms
+    if abs(step) >= correction_step_ms:
+        await _step_clock(step)
+        _corrected_ms += step
+
+
+def sync_due():
+    """True if the clock should be synced now: daily until the drift has
+    been measured, then every 'max_sync_interval' seconds, and straight
+    away after a failed sync."""
+    if _last_sync_ms is None or drift_ppm is None:
+        interval = 86400
+    else:
+        interval = max_sync_interval
+    return _last_sync_ms is None or \
+        local_ms() - _last_sync_ms >= interval * 1000
+
+
+async def maintain():
+    """Sync the clock if due and the WiFi is up, otherwise apply the drift
+    correction."""
+    if sync_due() and wifi_manager.ready():
+        await set_ntp_time()
+    else:
+        await correct()
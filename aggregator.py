@@ -0,0 +1,28 @@
+class Aggregator:
+    """Running mean, variance, maximum and minimum of the samples added since
+    the last reset(). Uses Welford's method, so memory use is the same
+    whatever the number of samples."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.max = None
+        self.min = None
+
+    def add(self, sample):
+        self.n += 1
+        delta = sample - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (sample - self.mean)
+        if self.max is None or sample > self.max:
+            self.max = sample
+        if self.min is None or sample < self.min:
+            self.min = sample
+
+    def variance(self):
+        """Sample variance, 0 for fewer than two samples."""
+        return self._m2 / (self.n - 1) if self.n > 1 else 0.0
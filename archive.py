@@ -0,0 +1,207 @@
+import struct
+import uos
+import utime
+import stats
+
+ARCHIVE_DIR = "archive"
+max_days = 120  # day files kept, the oldest being deleted to make room
+
+# Every 1-minute mean temperature of the main sensor is kept in a file per
+# UTC day, named YYYYMMDD.dat. Each file starts with a header: the time of
+# the first reading (epoch seconds), the number of readings, the length of
+# the data that follows, the minute of the day's last reading counted from
+# the first, and the day's min, max and last temperatures in tenths of a
+# degree. Each reading is then stored as the change in tenths from the one
+# before, zigzag and varint encoded: (zigzag(change) << 1 | gap) in 7-bit
+# groups, low first. 'gap' is set when the reading isn't the minute after
+# the last, and the number of minutes since the last follows as a varint.
+# A reading usually takes 1 byte, so a day takes about 1.5kB.
+HEADER_FORMAT = "<IHHHhhh"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+_header = bytearray(HEADER_SIZE)
+_entry = bytearray(10)
+# Views of the first n bytes of _entry, so writing one doesn't allocate
+_entry_views = tuple(memoryview(_entry)[:n] for n in range(len(_entry) + 1))
+_file = None  # Open handle on the current day's file
+_day = None  # Day (days since the epoch) of _file
+# The current day's header fields
+_start = 0
+_count = 0
+_length = 0
+_offset = 0
+_min = 0
+_max = 0
+_last = 0
+
+
+def _name(day):
+    tm = utime.gmtime(day * 86400)
+    return '{}/{:04d}{:02d}{:02d}.dat'.format(ARCHIVE_DIR, tm[0], tm[1],
+                                              tm[2])
+
+
+def _files():
+    """Names of the day files, oldest first."""
+    try:
+        names = uos.listdir(ARCHIVE_DIR)
+    except OSError:
+        uos.mkdir(ARCHIVE_DIR)
+        return []
+    return sorted(name for name in names if name.endswith('.dat'))
+
+
+def _prune():
+    """Delete the oldest day files to leave room for a new one."""
+    names = _files()
+    while len(names) >= max_days:
+        uos.remove(ARCHIVE_DIR + '/' + names.pop(0))
+
+
+def _open(day):
+    """Open the file for 'day', creating it if needed, and load its
+    header."""
+    global _file, _day, _start, _count, _length, _offset, _min, _max, _last
+    if _file is not None:
+        _file.close()
+        _file = None
+    name = _name(day)
+    try:
+        _file = open(name, "r+b")
+        _file.readinto(_header)
+        _start, _count, _length, _offset, _min, _max, _last = \
+            struct.unpack(HEADER_FORMAT, _header)
+    except OSError:
+        _prune()
+        with open(name, "wb") as datafile:
+            datafile.write(bytes(HEADER_SIZE))
+        _file = open(name, "r+b")
+        _start = _count = _length = _offset = _min = _max = _last = 0
+    _day = day
+
+
+def _put_varint(pos, value):
+    while value >= 0x80:
+        _entry[pos] = (value & 0x7F) | 0x80
+        value >>= 7
+        pos += 1
+    _entry[pos] = value
+    return pos + 1
+
+
+def _get_varint(data, pos):
+    """The varint at data[pos] and the position after it."""
+    value = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        value |= (b & 0x7F) << shift
+        shift += 7
+        if b < 0x80:
+            return value, pos
+
+
+def append(obs_time, temp):
+    """Add the 1-minute mean 'temp' for the minute ending at 'obs_time'
+    (epoch seconds) to the archive. Only the new reading's bytes and the
+    header are written. Readings not after the last one are ignored."""
+    global _start, _count, _length, _offset, _min, _max, _last
+    stats.archive.start()
+    day = obs_time // 86400
+    if day != _day:
+        _open(day)
+    tenths = int(temp * 10 + (0.5 if temp >= 0 else -0.5))
+    if _count:
+        offset = (obs_time - _start) // 60
+        gap = offset - _offset
+        if gap <= 0:
+            stats.archive.stop()
+            return
+    else:
+        _start = obs_time
+        offset = 0
+        gap = 1
+        _last = 0
+        _min = _max = tenths
+    change = tenths - _last
+    zigzag = change << 1 if change >= 0 else ((-change) << 1) - 1
+    if gap == 1:
+        pos = _put_varint(0, zigzag << 1)
+    else:
+        pos = _put_varint(_put_varint(0, (zigzag << 1) | 1), gap)
+    # The data is written at the length in the header, so anything left
+    # after it by a power cut before the header was updated is overwritten
+    _file.seek(HEADER_SIZE + _length)
+    _file.write(_entry_views[pos])
+    _count += 1
+    _length += pos
+    _offset = offset
+    _last = tenths
+    if tenths < _min:
+        _min = tenths
+    if tenths > _max:
+        _max = tenths
+    struct.pack_into(HEADER_FORMAT, _header, 0, _start, _count, _length,
+                     _offset, _min, _max, _last)
+    _file.seek(0)
+    _file.write(_header)
+    _file.flush()
+    stats.archive.stop()
+
+
+def _read_header(datafile):
+    header = datafile.read(HEADER_SIZE)
+    if len(header) != HEADER_SIZE:
+        return None
+    return struct.unpack(HEADER_FORMAT, header)
+
+
+def days(start=None, end=None):
+    """Generator of the index of the days with readings from 'start' to
+    'end' (epoch seconds, None for no limit), oldest first, as (first
+    reading time, last reading time, count, min temp, max temp). Only the
+    headers are read."""
+    for name in _files():
+        with open(ARCHIVE_DIR + '/' + name, "rb") as datafile:
+            header = _read_header(datafile)
+        if header is None or not header[1]:
+            continue
+        first = header[0]
+        last = first + header[3] * 60
+        if (start is None or last >= start) and \
+                (end is None or first <= end):
+            yield first, last, header[1], header[4] / 10, header[5] / 10
+
+
+def readings(start=None, end=None):
+    """Generator of the archived (time, temp) readings from 'start' to
+    'end' (epoch seconds, None for no limit), oldest first. Days outside
+    the range are skipped using their headers, and one day's data is read
+    at a time."""
+    for name in _files():
+        with open(ARCHIVE_DIR + '/' + name, "rb") as datafile:
+            header = _read_header(datafile)
+            if header is None or not header[1]:
+                continue
+            first, count, length, last_offset = header[:4]
+            if (start is not None and first + last_offset * 60 < start) or \
+                    (end is not None and first > end):
+                continue
+            data = datafile.read(length)
+        pos = 0
+        offset = -1
+        tenths = 0
+        for _ in range(count):
+            code, pos = _get_varint(data, pos)
+            zigzag = code >> 1
+            tenths += -((zigzag + 1) >> 1) if zigzag & 1 else zigzag >> 1
+            if code & 1:
+                gap, pos = _get_varint(data, pos)
+                offset += gap
+            else:
+                offset += 1
+            obs_time = first + offset * 60
+            if end is not None and obs_time > end:
+                return
+            if start is None or obs_time >= start:
+                yield obs_time, tenths / 10
@@ -0,0 +1,76 @@
+import machine
+import struct
+import ujson
+import uos
+import utime
+
+TIMELINE_FILE = "boot_timeline.json"
+WARM_FILE = "warm_state.bin"  # RTC time (epoch seconds) saved by reset()
+RESET_LATENCY = 2  # seconds from reset() until start() on the next boot
+
+stages = []  # (stage, ticks_ms since the device started)
+cause = None  # machine.reset_cause() for this boot
+warm = False  # restarted by the watchdog or reset(), not powered on
+resumed = False  # the previous boot ended with reset()
+_saved_time = None
+
+
+def mark(stage):
+    """Record that 'stage' of the boot has finished."""
+    ms = utime.ticks_ms()
+    stages.append((stage, ms))
+    print('Boot: ' + stage + ' at ' + str(ms) + 'ms')
+
+
+def start():
+    """Start the timeline and find out how the device was restarted.
+    Returns True for a warm restart."""
+    global cause, warm, resumed, _saved_time
+    cause = machine.reset_cause()
+    try:
+        with open(WARM_FILE, "rb") as datafile:
+            _saved_time = struct.unpack("<I", datafile.read(4))[0]
+        uos.remove(WARM_FILE)
+        resumed = True
+    except (OSError, ValueError):
+        _saved_time = None
+    warm = resumed or cause != machine.PWRON_RESET
+    mark('start')
+    return warm
+
+
+def restore_clock():
+    """After reset() the RTC may have been reset along with the rest of
+    the device. Set it to the time saved by reset() plus the time since,
+    unless it's already later. Returns True if there was a saved time, so
+    the RTC can be trusted. After a power cut or a watchdog reset only NTP
+    can set it."""
+    if _saved_time is None:
+        return False
+    now = _saved_time + RESET_LATENCY + utime.ticks_diff(
+        utime.ticks_ms(), stages[0][1]) // 1000
+    if utime.time() < now:
+        tm = utime.gmtime(now)
+        # noinspection PyArgumentList
+        machine.RTC().datetime(
+            (tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+        mark('clock restored')
+    return True
+
+
+def save():
+    """Save the timeline to TIMELINE_FILE as JSON."""
+    data = {'cause': cause, 'warm': warm, 'resumed': resumed,
+            'stages': [list(stage) for stage in stages]}
+    with open(TIMELINE_FILE, "w") as datafile:
+        ujson.dump(data, datafile)
+
+
+def reset():
+    """Save the time and the timeline and reset the device. The next boot
+    is a warm restart that resumes sampling straight away."""
+    with open(WARM_FILE, "wb") as datafile:
+        datafile.write(struct.pack("<I", utime.time()))
+    mark('reset')
+    save()
+    machine.reset()
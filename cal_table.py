@@ -0,0 +1,67 @@
+from array import array
+
+
+def load(corrections):
+    """
+    Build a calibration table from a sensor's corrections dictionary as held
+    in config.json, e.g. {'CORR-30': 0.1, ..., 'CORR+50': -0.2}. The
+    certificate temperatures are taken from the keys, so any set of points
+    can be used.
+    :param corrections: Dictionary of 'CORR<temp>': correction (numbers or
+    numeric strings)
+    :return: Table of (temperatures, corrections, slopes) arrays sorted by
+    temperature, where slopes[i] is the change in correction per degree C
+    between temperatures[i] and temperatures[i + 1].
+    """
+    points = sorted((float(key[4:]), float(value))
+                    for key, value in corrections.items())
+    temps = array('f', (point[0] for point in points))
+    corrs = array('f', (point[1] for point in points))
+    slopes = array('f', (0.0 for _ in points))
+    for i in range(len(points) - 1):
+        slopes[i] = (corrs[i + 1] - corrs[i]) / (temps[i + 1] - temps[i])
+    return temps, corrs, slopes
+
+
+def apply(table, temp):
+    """
+    Apply the instrument calibration to an 'as read' temperature. The
+    correction is linearly interpolated between the two nearest certificate
+    temperatures, found by binary search. Outside the certificate range the
+    correction at the nearest end is used.
+    :param table: Calibration table from load()
+    :param temp: The 'as read' temperature in degrees C
+    :return: The calibrated temperature in degrees C
+    """
+    temps, corrs, slopes = table
+    last = len(temps) - 1
+    if temp <= temps[0]:
+        return temp + corrs[0]
+    if temp >= temps[last]:
+        return temp + corrs[last]
+    lo = 0
+    hi = last
+    while hi - lo > 1:
+        mid = (lo + hi) >> 1
+        if temps[mid] <= temp:
+            lo = mid
+        else:
+            hi = mid
+    return temp + corrs[lo] + slopes[lo] * (temp - temps[lo])
+
+
+def apply_batch(table, readings, n=None):
+    """
+    Calibrate the first 'n' (default all) 'as read' temperatures in
+    'readings' in place, e.g. an array('f') of recorded raw readings when a
+    new calibration certificate arrives.
+    :param table: Calibration table from load()
+    :param readings: Mutable sequence of temperatures in degrees C
+    :param n: Number of readings to calibrate
+    :return: readings
+    """
+    if n is None:
+        n = len(readings)
+    for i in range(n):
+        readings[i] = apply(table, readings[i])
+    return readings
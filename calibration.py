@@ -1,11 +0,0 @@
-CORRECTIONS = {
-                'CORR-30': '0.0',
-                'CORR-20': '0.0',
-                'CORR-10': '0.0',
-                'CORR+0': '0.0',
-                'CORR+10': '0.0',
-                'CORR+20': '0.0',
-                'CORR+30': '0.0',
-                'CORR+40': '0.0',
-                'CORR+50': '0.0'
-            }
@@ -0,0 +1,196 @@
+import ujson
+import uos
+
+CONFIG_FILE = "config.json"
+
+# Settings and their defaults. Each sensor's calibration certificate
+# corrections are kept under CORRECTIONS by sensor name, e.g.
+# {"hmt": {"CORR-30": 0.1, ..., "CORR+50": -0.2}}.
+DEFAULTS = {
+    'SSID': '',
+    'WIFI-PASSWORD': '',
+    'WOW_SITE_ID': '',
+    'WOW_AUTH_KEY': '',
+    'REPORTING_SCHED': 3,
+    'LOG_LEVEL': 1,
+    'STATIC_IP': '',
+    'MQTT_BROKER': '',
+    'MQTT_TOPIC': 'hmt333/observations',
+    'MQTT_USER': '',
+    'MQTT_PASSWORD': '',
+    'HTTP_SINK_URL': '',
+    'HTTP_SINK_TOKEN': '',
+}
+CERTIFICATE_TEMPS = (-30, -20, -10, 0, 10, 20, 30, 40, 50)
+
+
+def _auth_key(value):
+    value = str(value)
+    if value and (len(value) != 6 or not value.isdigit()):
+        raise ValueError('WOW_AUTH_KEY must be a 6-digit number')
+    return value
+
+
+def _reporting_sched(value):
+    value = int(value)
+    if value not in (1, 2, 3):
+        raise ValueError("REPORTING_SCHED must be 1, 2 or 3")
+    return value
+
+
+def _log_level(value):
+    value = int(value)
+    if value not in (0, 1, 2):
+        raise ValueError("LOG_LEVEL must be 0, 1 or 2")
+    return value
+
+
+def _static_ip(value):
+    addresses = str(value).replace(',', ' ').split()
+    if addresses and len(addresses) != 4:
+        raise ValueError('STATIC_IP must be 4 addresses: ip netmask gateway '
+                         'dns')
+    for address in addresses:
+        parts = address.split('.')
+        if len(parts) != 4 or not all(part.isdigit() and int(part) < 256
+                                      for part in parts):
+            raise ValueError('STATIC_IP: invalid address ' + address)
+    return ' '.join(addresses)
+
+
+def _sink_url(value):
+    value = str(value)
+    if value and value.split('://')[0] not in ('http', 'https'):
+        raise ValueError('HTTP_SINK_URL must start with http:// or https://')
+    return value
+
+
+def static_ip():
+    """The STATIC_IP setting as (ip, netmask, gateway, dns), or None to
+    use DHCP."""
+    value = values['STATIC_IP']
+    return tuple(value.split()) if value else None
+
+
+# Conversion and validation of each setting's value
+_CHECKS = {
+    'SSID': str,
+    'WIFI-PASSWORD': str,
+    'WOW_SITE_ID': str,
+    'WOW_AUTH_KEY': _auth_key,
+    'REPORTING_SCHED': _reporting_sched,
+    'LOG_LEVEL': _log_level,
+    'STATIC_IP': _static_ip,
+    'MQTT_BROKER': str,
+    'MQTT_TOPIC': str,
+    'MQTT_USER': str,
+    'MQTT_PASSWORD': str,
+    'HTTP_SINK_URL': _sink_url,
+    'HTTP_SINK_TOKEN': str,
+}
+
+
+def correction_key(temp):
+    """Key for the correction at certificate temperature 'temp', e.g.
+    CORR-30, CORR+0."""
+    return 'CORR{:+d}'.format(int(temp))
+
+
+def _default_corrections():
+    return {correction_key(temp): 0.0 for temp in CERTIFICATE_TEMPS}
+
+
+def _migrate():
+    """Settings from the settings.py and calibration.py modules used by
+    earlier versions, if present, to be saved to CONFIG_FILE."""
+    data = {'CORRECTIONS': {}}
+    try:
+        import settings
+        data.update(settings.SETTINGS)
+    except ImportError:
+        pass
+    try:
+        import calibration
+        data['CORRECTIONS']['hmt'] = calibration.CORRECTIONS
+    except ImportError:
+        pass
+    return data
+
+
+def _load():
+    """Read and validate CONFIG_FILE. Missing or invalid settings are
+    reported and replaced with their defaults."""
+    try:
+        with open(CONFIG_FILE, "r") as datafile:
+            data = ujson.load(datafile)
+        migrated = False
+    except (OSError, ValueError):
+        data = _migrate()
+        migrated = True
+    values = {}
+    for key, default in DEFAULTS.items():
+        try:
+            values[key] = _CHECKS[key](data[key]) if key in data else default
+        except ValueError as exc:
+            print('config: ' + str(exc) + ' - using the default')
+            values[key] = default
+    values['CORRECTIONS'] = {}
+    for sensor, corrections in data.get('CORRECTIONS', {}).items():
+        try:
+            values['CORRECTIONS'][sensor] = {
+                correction_key(float(key[4:])): float(value)
+                for key, value in corrections.items()}
+        except (ValueError, AttributeError):
+            print('config: invalid corrections for ' + sensor)
+    return values, migrated
+
+
+def save():
+    """Write the settings to CONFIG_FILE. A temporary file is written and
+    renamed over the old one, so a power cut can't leave a partial file."""
+    with open(CONFIG_FILE + ".tmp", "w") as datafile:
+        ujson.dump(values, datafile)
+    uos.rename(CONFIG_FILE + ".tmp", CONFIG_FILE)
+
+
+def get(key):
+    return values[key]
+
+
+def set_value(key, value):
+    """Validate and save a new value for setting 'key'. Raises ValueError
+    if the setting doesn't exist or the value isn't valid."""
+    if key not in _CHECKS:
+        raise ValueError('unknown setting ' + key)
+    values[key] = _CHECKS[key](value)
+    save()
+
+
+def corrections(sensor):
+    """The calibration corrections for the named sensor (all zero if none
+    have been set)."""
+    table = values['CORRECTIONS'].get(sensor)
+    return _default_corrections() if table is None else table
+
+
+def _finite(value):
+    value = float(value)
+    if value - value != 0:  # nan or inf
+        raise ValueError('not a finite number: ' + str(value))
+    return value
+
+
+def set_correction(sensor, temp, correction):
+    """Set and save the correction at certificate temperature 'temp' for
+    the named sensor. Raises ValueError for a non-numeric or non-finite
+    value."""
+    table = dict(corrections(sensor))
+    table[correction_key(_finite(temp))] = _finite(correction)
+    values['CORRECTIONS'][sensor] = table
+    save()
+
+
+# The config file is parsed once, at startup
+values, _migrated = _load()
+if _migrated:
+    save()
@@ -0,0 +1,77 @@
+import uasyncio as asyncio
+
+poll_interval = 100  # how often UART1 is checked for input (milliseconds)
+MAX_LINE = 80
+
+_commands = {}  # name: (handler, help text, raw)
+_line = bytearray(MAX_LINE)
+_line_len = 0
+
+
+def command(name, handler, help_text, raw=False):
+    """Add a console command. 'handler' is called with the list of words
+    following the command name, or if 'raw' is set with the rest of the
+    line as typed, and returns the text to write back (or None). It may
+    raise ValueError with a message for the user. An OSError, e.g.
+    from saving the settings, is reported rather than stopping the
+    console."""
+    _commands[name] = (handler, help_text, raw)
+
+
+def _help(args):
+    return '\r\n'.join(name + ' ' + _commands[name][1]
+                       for name in sorted(_commands))
+
+
+command('help', _help, '- list the commands')
+
+
+def execute(line):
+    """Run a command line and return the response text."""
+    words = line.split()
+    if not words:
+        return ''
+    entry = _commands.get(words[0].lower())
+    if entry is None:
+        return 'Unknown command ' + words[0] + " - type 'help'"
+    try:
+        if entry[2]:
+            response = entry[0](line.lstrip()[len(words[0]):].lstrip())
+        else:
+            response = entry[0](words[1:])
+    except (ValueError, IndexError) as exc:
+        return 'Error: ' + (str(exc) or 'missing or invalid value')
+    except OSError as exc:
+        # e.g. the flash is full when a setting is saved
+        return 'Error: ' + repr(exc)
+    return '' if response is None else response
+
+
+def poll(uart):
+    """Read whatever has arrived on 'uart' without waiting, echoing it, and
+    run the command once a whole line has arrived."""
+    global _line_len
+    while uart.any():
+        c = uart.read(1)[0]
+        if c == 0x0D or c == 0x0A:  # CR or LF ends the line
+            if _line_len:
+                line = bytes(_line[:_line_len]).decode()
+                _line_len = 0
+                uart.write('\r\n' + execute(line) + '\r\n> ')
+        elif c == 0x08 or c == 0x7F:  # Backspace or delete
+            if _line_len:
+                _line_len -= 1
+                uart.write(b'\x08 \x08')
+        elif 0x20 <= c < 0x7F and _line_len < MAX_LINE:
+            _line[_line_len] = c
+            _line_len += 1
+            uart.write(bytes((c,)))
+
+
+async def run(uart):
+    """Console task: answer commands typed on 'uart' while the station
+    carries on running."""
+    uart.write("\r\nConsole ready - type 'help' for commands\r\n> ")
+    while True:
+        poll(uart)
+        await asyncio.sleep_ms(poll_interval)
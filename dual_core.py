@@ -0,0 +1,91 @@
+import _thread
+import struct
+import utime
+import read_hmt
+
+# Readings taken on core 1 are passed to core 0 through a ring buffer of
+# packed records: RTC time (epoch seconds), ticks_ms when the reading was
+# due, the calibrated temperature and the index of the sensor in
+# read_hmt.sensors.
+RING_SIZE = 64
+RECORD_FORMAT = "<IIfB"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+_ring = bytearray(RING_SIZE * RECORD_SIZE)
+_lock = _thread.allocate_lock()
+_head = 0
+_count = 0
+_running = False
+
+overruns = 0  # Readings dropped because core 0 didn't keep up
+readings = 0  # Readings pushed into the ring
+max_jitter = 0  # Largest delay in starting a reading (milliseconds)
+
+
+def _push(obs_time, due, temp, index):
+    global _head, _count, overruns, readings
+    with _lock:
+        slot = (_head + _count) % RING_SIZE
+        if _count == RING_SIZE:
+            # Ring full - overwrite the oldest reading
+            _head = (_head + 1) % RING_SIZE
+            overruns += 1
+        else:
+            _count += 1
+        struct.pack_into(RECORD_FORMAT, _ring, slot * RECORD_SIZE,
+                         obs_time, due, temp, index)
+        readings += 1
+
+
+def pop():
+    """Return the oldest reading from core 1 as (obs_time, temp, sensor
+    index), or None if there are none waiting."""
+    global _head, _count
+    with _lock:
+        if _count == 0:
+            return None
+        obs_time, _, temp, index = struct.unpack_from(
+            RECORD_FORMAT, _ring, _head * RECORD_SIZE)
+        _head = (_head + 1) % RING_SIZE
+        _count -= 1
+    return obs_time, temp, index
+
+
+def _sample(interval):
+    """Core 1 loop: read the HMTs every 'interval' milliseconds. Only
+    read_hmt and this module's ring buffer are used on this core."""
+    global max_jitter
+    due = utime.ticks_ms()
+    while _running:
+        late = utime.ticks_diff(utime.ticks_ms(), due)
+        if late > max_jitter:
+            max_jitter = late
+        read_hmt.start_requests()
+        while read_hmt.tick_all():
+            utime.sleep_ms(read_hmt.poll_interval)
+        obs_time = utime.time()
+        for index, hmt in enumerate(read_hmt.sensors):
+            temp = hmt.result()
+            if temp is not None:
+                _push(obs_time, due, temp, index)
+        due = utime.ticks_add(due, interval)
+        wait = utime.ticks_diff(due, utime.ticks_ms())
+        if wait > 0:
+            utime.sleep_ms(wait)
+        else:
+            # Fallen behind by more than a whole interval - start afresh
+            due = utime.ticks_ms()
+
+
+def start(interval):
+    """Start reading the HMTs on core 1 every 'interval' milliseconds. Once
+    started, read_hmt must not be used from core 0."""
+    global _running
+    _running = True
+    _thread.start_new_thread(_sample, (interval,))
+
+
+def stop():
+    """Ask the core 1 loop to finish after its current reading."""
+    global _running
+    _running = False
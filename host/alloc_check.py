@@ -0,0 +1,144 @@
+"""Check the steady-state sampling path stays within its allocation budget.
+
+    python host/alloc_check.py [-n ITERATIONS] [--level LOG_LEVEL]
+
+Runs the path taken by every reading (request, response, QC and adding to
+the current minute) and by the end of every minute (logging, the journal
+and the archive) N times each and measures the memory allocated per pass,
+as host/bench.py does: heap bytes from gc.mem_alloc under the MicroPython
+unix port, peak traced bytes from tracemalloc under CPython. Exits with
+status 1 if a budget is exceeded. MicroPython boxes floats, so the budgets
+there allow for the few temperatures each pass computes; CPython allocates
+ints and floats freely and its stand-in UART copies bytes, so its budgets
+are only a guard against regressions such as string building creeping
+back into the path.
+"""
+import sys
+
+HOST = __file__.rsplit('/', 1)[0] if '/' in __file__ else '.'
+ROOT = HOST.rsplit('/', 1)[0] if '/' in HOST else '..'
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HOST + '/stubs')
+sys.path.insert(0, HOST)
+
+import gc  # noqa: E402
+import os  # noqa: E402
+import machine  # noqa: E402
+
+MICROPYTHON = sys.implementation.name == 'micropython'
+FRAME = b"T= 19.5 'C\r\n"
+
+# Bytes allocated per pass: (MicroPython, CPython)
+BUDGETS = {
+    'sample': (128, 512),
+    'minute': (256, 768),
+}
+
+
+class Responder:
+    """UART device answering each request with one frame."""
+
+    def __init__(self):
+        self.pending = False
+
+    def write(self, data):
+        self.pending = True
+
+    def read(self):
+        if self.pending:
+            self.pending = False
+            return FRAME
+        return None
+
+
+class Discard:
+    """Stand-in for stdout and UART1 that drops the log lines."""
+
+    def write(self, data):
+        return len(data)
+
+
+machine.UART_DEVICES[0] = Responder()
+
+# Files written by the check go in a scratch directory
+try:
+    os.mkdir('alloc_tmp')
+except OSError:
+    pass
+os.chdir('alloc_tmp')
+
+import log  # noqa: E402
+import read_hmt  # noqa: E402
+import sampling  # noqa: E402
+
+if not MICROPYTHON:
+    import tracemalloc
+
+log._stdout = Discard()
+log._flush = None
+log.uart = Discard()
+
+
+def measure(fn, n):
+    """Return the bytes allocated per call of fn()."""
+    fn()
+    gc.collect()
+    if MICROPYTHON:
+        gc.disable()
+        before = gc.mem_alloc()
+        for _ in range(n):
+            fn()
+        allocated = gc.mem_alloc() - before
+        gc.enable()
+    else:
+        allocated = 0
+        tracemalloc.start()
+        for _ in range(n):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            fn()
+            allocated += tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+    return allocated / n
+
+
+def sample():
+    """One reading of every sensor, as sensor_task takes it."""
+    read_hmt.start_requests()
+    while read_hmt.tick_all():
+        pass
+    sampling.record_readings()
+
+
+def minute():
+    """The end of a minute for the main sensor."""
+    hmt = sampling.primary
+    hmt.minute.add(19.5)
+    hmt.sample_minute += 1
+    sampling.close_minute(hmt)
+
+
+def main():
+    n = 1000
+    if '-n' in sys.argv:
+        n = int(sys.argv[sys.argv.index('-n') + 1])
+    if '--level' in sys.argv:
+        log.level = int(sys.argv[sys.argv.index('--level') + 1])
+    sample()  # sets the sensor's current minute
+    results = [('sample', measure(sample, n)),
+               ('minute', measure(minute, max(n // 10, 10)))]
+
+    failed = False
+    unit = 'bytes/pass' if MICROPYTHON else 'peak bytes/pass'
+    print('{:<10}{:>18}{:>10}'.format('stage', unit, 'budget'))
+    for name, allocated in results:
+        budget = BUDGETS[name][0 if MICROPYTHON else 1]
+        over = allocated > budget
+        failed = failed or over
+        print('{:<10}{:>18.1f}{:>10}{}'.format(name, allocated, budget,
+                                               '  OVER' if over else ''))
+    if failed:
+        sys.exit(1)
+
+
+main()
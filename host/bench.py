@@ -0,0 +1,150 @@
+"""Microbenchmarks for the firmware hot paths, run on a PC.
+
+    python host/bench.py [-n ITERATIONS] [--wow]
+
+Reports the time per call and the memory allocated per call. Under the
+MicroPython unix port allocation is the number of heap bytes allocated per
+call (gc.mem_alloc with the collector disabled); under CPython it is the
+peak traced memory per call from tracemalloc, which is a comparable
+indicator of short-lived objects. The HMT333 emulator is attached to UART0
+unless UART0_PTY names a pseudo-terminal served by hmt_emulator.py.
+--wow also times complete send_wow calls against a local WoW stand-in.
+"""
+import sys
+
+HOST = __file__.rsplit('/', 1)[0] if '/' in __file__ else '.'
+ROOT = HOST.rsplit('/', 1)[0] if '/' in HOST else '..'
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HOST + '/stubs')
+sys.path.insert(0, HOST)
+
+import gc  # noqa: E402
+import os  # noqa: E402
+import utime  # noqa: E402
+import uasyncio as asyncio  # noqa: E402
+import machine  # noqa: E402
+from hmt_emulator import HMT333Emulator  # noqa: E402
+
+MICROPYTHON = sys.implementation.name == 'micropython'
+FRAME = b"T= 19.5 'C\r\n"
+
+if not os.environ.get('UART0_PTY'):
+    machine.UART_DEVICES[0] = HMT333Emulator()
+
+# Files written by the benchmarks go in a scratch directory
+try:
+    os.mkdir('bench_tmp')
+except OSError:
+    pass
+os.chdir('bench_tmp')
+
+import read_hmt  # noqa: E402
+import metoffice_wow  # noqa: E402
+import temps_file  # noqa: E402
+
+if not MICROPYTHON:
+    import tracemalloc
+
+
+def measure(fn, n):
+    """Return (microseconds per call, bytes per call) for fn()."""
+    fn()
+    gc.collect()
+    start = utime.ticks_us()
+    for _ in range(n):
+        fn()
+    elapsed = utime.ticks_diff(utime.ticks_us(), start)
+    if MICROPYTHON:
+        gc.collect()
+        gc.disable()
+        before = gc.mem_alloc()
+        for _ in range(n):
+            fn()
+        allocated = gc.mem_alloc() - before
+        gc.enable()
+    else:
+        allocated = 0
+        tracemalloc.start()
+        for _ in range(n):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            fn()
+            allocated += tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+    return elapsed / n, allocated / n
+
+
+def run_async(coro_fn):
+    """Wrap a coroutine function as a plain function for measure()."""
+    return lambda: asyncio.run(coro_fn())
+
+
+class Loopback:
+    """UART device that always has another frame waiting."""
+
+    def write(self, data):
+        pass
+
+    def read(self):
+        return FRAME
+
+
+def bench_send_wow(n):
+    import wow_server
+    server = wow_server.serve_in_thread()
+    metoffice_wow.wow_url = server.url
+
+    # The sends share an event loop, as the kept-alive connection to the
+    # server belongs to the loop it was opened in
+    loop = asyncio.new_event_loop()
+
+    async def send():
+        await metoffice_wow.send_wow('site', '123456', 12.3, 15.1, 4.2)
+    result = measure(lambda: loop.run_until_complete(send()), n)
+    loop.close()
+    server.shutdown()
+    return result
+
+
+def main():
+    n = 1000
+    if '-n' in sys.argv:
+        n = int(sys.argv[sys.argv.index('-n') + 1])
+    frame = bytearray(FRAME)
+    frame_len = len(FRAME) - 2
+    hmt = read_hmt.sensor
+    table = hmt.cal
+    now = utime.localtime()
+
+    results = [
+        ('parse_temp', measure(
+            lambda: read_hmt.parse_temp(frame, frame_len), n)),
+        ('apply_calibration', measure(
+            lambda: hmt.apply_calibration(19.5), n)),
+        ('cal_table.apply', measure(
+            lambda: read_hmt.cal_table.apply(table, 19.5), n)),
+        ('format_time', measure(
+            lambda: metoffice_wow.format_time(now), n)),
+        ('build_payload', measure(
+            lambda: metoffice_wow.build_payload('site', '123456', 12.3,
+                                                15.1, 4.2), n)),
+        ('save_temps', measure(
+            lambda: temps_file.save_temps(15.1, 4.2, 100), n)),
+        ('get_hmt_temp (emulator)', measure(
+            run_async(read_hmt.get_hmt_temp), max(n // 100, 5))),
+    ]
+    emulator = hmt.bus.uart._device
+    hmt.bus.uart._device = Loopback()
+    results.append(('read_frame', measure(hmt.bus.read_frame, n)))
+    hmt.bus.uart._device = emulator
+    if '--wow' in sys.argv:
+        results.append(('send_wow (local server)',
+                        bench_send_wow(max(n // 100, 5))))
+
+    unit = 'bytes/call' if MICROPYTHON else 'peak bytes/call'
+    print('{:<26}{:>12}{:>18}'.format('benchmark', 'us/call', unit))
+    for name, (elapsed, allocated) in results:
+        print('{:<26}{:>12.1f}{:>18.1f}'.format(name, elapsed, allocated))
+
+
+main()
@@ -0,0 +1,139 @@
+"""Emulates a Vaisala HMT333 connected over serial, for running the firmware
+on a PC.
+
+The emulator understands the commands the firmware uses: 'send' (STOP
+mode poll), 'SEND <address>' (poll on an RS-485 bus), 'R' (start RUN mode),
+'S' (stop RUN mode) and 'INTV <n> <unit>' (RUN mode output interval).
+Several addressed emulators can share a UART through an RS485Bus. It can be
+attached directly to a host UART stand-in by putting it in
+machine.UART_DEVICES, or served on a pseudo-terminal:
+
+    python host/hmt_emulator.py --temp 12.5
+    UART0_PTY=/dev/pts/N python host/bench.py
+"""
+import argparse
+import math
+import os
+import select
+import time
+
+_INTV_UNITS = {'s': 1, 'min': 60, 'h': 3600}
+
+
+def steady(value):
+    """Temperature source returning a constant value."""
+    return lambda now: value
+
+
+def diurnal(mean=10.0, amplitude=5.0, period=86400.0):
+    """Temperature source following a daily sine wave."""
+    return lambda now: mean + amplitude * math.sin(
+        2 * math.pi * now / period)
+
+
+class HMT333Emulator:
+    """'temperature' is called with the current clock time and returns the
+    temperature in degrees C to output, or None for no response (a sensor
+    dropout). 'clock' returns the time in seconds and defaults to the host
+    monotonic clock. An emulator with an RS-485 'address' only answers
+    'SEND <address>'."""
+
+    def __init__(self, temperature=None, clock=time.monotonic,
+                 address=None):
+        self.temperature = temperature or steady(19.5)
+        self.clock = clock
+        self.address = address
+        self.run_mode = False
+        self.interval = 2
+        self.next_output = 0
+        self.requests = 0
+        self._rx = bytearray()
+        self._tx = bytearray()
+
+    def _output(self):
+        temp = self.temperature(self.clock())
+        if temp is not None:
+            self._tx += "T= {:5.1f} 'C\r\n".format(temp).encode()
+
+    def _command(self, line):
+        words = line.decode(errors='replace').strip().lower().split()
+        if not words:
+            return
+        if words[0] == 'send':
+            if len(words) > 1:
+                polled = words[1].isdigit() and self.address == int(words[1])
+            else:
+                polled = self.address is None
+            if polled:
+                self.requests += 1
+                self._output()
+        elif words[0] == 'r':
+            self.run_mode = True
+            self.next_output = self.clock()
+        elif words[0] == 's':
+            self.run_mode = False
+        elif words[0] == 'intv' and len(words) > 1:
+            unit = words[2] if len(words) > 2 else 's'
+            self.interval = int(words[1]) * _INTV_UNITS.get(unit, 1)
+
+    def write(self, data):
+        """Bytes sent to the HMT."""
+        self._rx += data
+        end = self._rx.find(b'\n')
+        while end >= 0:
+            self._command(bytes(self._rx[:end]))
+            del self._rx[:end + 1]
+            end = self._rx.find(b'\n')
+
+    def read(self):
+        """Bytes output by the HMT since the last call."""
+        if self.run_mode and self.clock() >= self.next_output:
+            self._output()
+            self.next_output = self.clock() + self.interval
+        data = bytes(self._tx)
+        self._tx.clear()
+        return data
+
+
+class RS485Bus:
+    """Several addressed emulators sharing one UART: everything written is
+    seen by all of them and their output is merged."""
+
+    def __init__(self, emulators):
+        self.emulators = emulators
+
+    def write(self, data):
+        for emulator in self.emulators:
+            emulator.write(data)
+
+    def read(self):
+        return b''.join(emulator.read() for emulator in self.emulators)
+
+
+def serve_pty(emulator):
+    """Serve the emulator on a new pseudo-terminal until interrupted."""
+    import tty
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    print('HMT333 emulator on ' + os.ttyname(slave), flush=True)
+    try:
+        while True:
+            readable, _, _ = select.select([master], [], [], 0.05)
+            if readable:
+                emulator.write(os.read(master, 1024))
+            data = emulator.read()
+            if data:
+                os.write(master, data)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--temp', type=float,
+                        help='constant temperature (default daily cycle)')
+    args = parser.parse_args()
+    serve_pty(HMT333Emulator(
+        steady(args.temp) if args.temp is not None else
+        diurnal(period=600)))
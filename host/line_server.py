@@ -0,0 +1,106 @@
+"""Local stand-in for an HTTP endpoint taking InfluxDB line protocol, such
+as InfluxDB's /api/v2/write, for running the firmware on a PC.
+
+    python host/line_server.py --port 8086
+
+Set HTTP_SINK_URL to http://127.0.0.1:8086/api/v2/write to point the
+firmware at it. Each line written is parsed and kept in server.points as
+(measurement, tags, fields, timestamp) and printed. Set server.fail_next
+to a number of requests to answer with server.fail_status, and
+server.delay to a number of seconds to wait before each response, to
+exercise the firmware's retries and queueing.
+"""
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PATH = '/api/v2/write'
+
+
+def parse_line(line):
+    """Parse a line protocol record into (measurement, tags, fields,
+    timestamp). Escaped characters and string fields aren't supported."""
+    series, fields, timestamp = line.split(' ')
+    measurement, *tags = series.split(',')
+    tags = dict(tag.split('=', 1) for tag in tags)
+    fields = {key: float(value) for key, value in
+              (field.split('=', 1) for field in fields.split(','))}
+    return measurement, tags, fields, int(timestamp)
+
+
+class LineHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server.requests += 1
+        if self.path.split('?')[0] != PATH:
+            return self._reply(404)
+        if server.token and self.headers.get('Authorization') != \
+                'Token ' + server.token:
+            return self._reply(401)
+        if server.delay:
+            time.sleep(server.delay)
+        if server.fail_next > 0:
+            server.fail_next -= 1
+            return self._reply(server.fail_status)
+        try:
+            points = [parse_line(line) for line in
+                      body.decode().splitlines() if line]
+        except ValueError:
+            return self._reply(400, b'invalid line protocol')
+        server.points.extend(points)
+        if server.verbose:
+            for line in body.decode().splitlines():
+                print('line: ' + line, flush=True)
+        self._reply(204)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class LineServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, verbose=False, token=None):
+        super().__init__(('127.0.0.1', port), LineHandler)
+        self.verbose = verbose
+        self.token = token
+        self.points = []
+        self.requests = 0
+        self.fail_next = 0
+        self.fail_status = 503
+        self.delay = 0
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}{}'.format(self.server_address[1], PATH)
+
+
+def serve_in_thread(port=0, verbose=False, token=None):
+    """Start a LineServer on a background thread and return it."""
+    server = LineServer(port, verbose, token)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8086)
+    parser.add_argument('--token', help='token required by Authorization')
+    args = parser.parse_args()
+    server = LineServer(args.port, verbose=True, token=args.token)
+    print('Line protocol stand-in on ' + server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,114 @@
+"""Local stand-in for an MQTT broker, for running the firmware on a PC.
+
+    python host/mqtt_broker.py --port 1883
+
+Set MQTT_BROKER to 127.0.0.1:1883 to point the firmware at it. Only what
+a publishing client needs is supported: CONNECT, PUBLISH at QoS 0 and 1,
+PINGREQ and DISCONNECT. Published messages are printed and kept in
+server.messages as (topic, payload). Set server.fail_next to a number of
+PUBLISH packets to answer by closing the connection, and server.delay to
+a number of seconds to wait before each acknowledgement, to exercise the
+firmware's retries and queueing.
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class MQTTHandler(socketserver.BaseRequestHandler):
+
+    def _read(self, n):
+        data = b''
+        while len(data) < n:
+            chunk = self.request.recv(n - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def _packet(self):
+        """Read a packet and return (type byte, body)."""
+        packet_type = self._read(1)[0]
+        length = shift = 0
+        while True:
+            byte = self._read(1)[0]
+            length |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                break
+        return packet_type, self._read(length)
+
+    def handle(self):
+        server = self.server
+        try:
+            packet_type, body = self._packet()
+            if packet_type != 0x10 or body[2:6] != b'MQTT':
+                return
+            server.connections += 1
+            self.request.sendall(b'\x20\x02\x00' + bytes((server.refuse,)))
+            if server.refuse:
+                return
+            while True:
+                packet_type, body = self._packet()
+                kind = packet_type >> 4
+                if kind == 3:  # PUBLISH
+                    if server.fail_next > 0:
+                        server.fail_next -= 1
+                        return
+                    qos = (packet_type >> 1) & 3
+                    length = (body[0] << 8) | body[1]
+                    topic = body[2:2 + length].decode()
+                    payload = body[2 + length + (2 if qos else 0):]
+                    if server.delay:
+                        time.sleep(server.delay)
+                    server.messages.append((topic, payload))
+                    if server.verbose:
+                        print('MQTT ' + topic + ': ' +
+                              payload.decode(errors='replace'), flush=True)
+                    if qos:
+                        packet_id = body[2 + length:4 + length]
+                        self.request.sendall(b'\x40\x02' + packet_id)
+                elif kind == 12:  # PINGREQ
+                    self.request.sendall(b'\xd0\x00')
+                elif kind == 14:  # DISCONNECT
+                    return
+        except (EOFError, OSError):
+            pass
+
+
+class MQTTBroker(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, verbose=False):
+        super().__init__(('127.0.0.1', port), MQTTHandler)
+        self.verbose = verbose
+        self.messages = []
+        self.connections = 0
+        self.fail_next = 0
+        self.delay = 0
+        self.refuse = 0  # CONNACK return code, e.g. 5 (not authorised)
+
+    @property
+    def address(self):
+        return '127.0.0.1:{}'.format(self.server_address[1])
+
+
+def serve_in_thread(port=0, verbose=False):
+    """Start an MQTTBroker on a background thread and return it."""
+    server = MQTTBroker(port, verbose)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=1883)
+    args = parser.parse_args()
+    server = MQTTBroker(args.port, verbose=True)
+    print('MQTT broker stand-in on ' + server.address, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
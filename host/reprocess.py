@@ -0,0 +1,367 @@
+"""Reprocess temperature history on a PC, e.g. when a new calibration
+certificate arrives or a day's readings are suspect.
+
+    python host/reprocess.py temps0.bin temps1.bin --new-config config.json
+        --old-config old_config.json --wow reports.json
+
+Inputs are any mix of:
+  * journal segment files (temps0.bin, temps1.bin) copied off the device,
+  * archive day files (archive/YYYYMMDD.dat) copied off the device,
+  * /history.csv downloads from the HTTP server (time,temp,max,min,count),
+  * CSV logs of raw readings (time,temp), which are first averaged into
+    1-minute means the way the firmware does.
+Journal, archive and history records are already 1-minute means.
+Overlapping inputs are merged, keeping one value per minute.
+
+Recorded temperatures are calibrated with the certificate that was in use
+at the time. --old-config removes that calibration and --new-config applies
+the new one, with cal_table.apply semantics (linear interpolation between
+certificate points, the nearest end's correction outside them). Either is
+a config.json (CORRECTIONS for --sensor) or a plain corrections dictionary.
+
+The daily maximum and minimum are recomputed over the same windows as
+main.py: from one 09:00 UTC report to the next, starting from the reading
+at 09:00, reported only if the day has more than --min-count readings.
+Unlike the firmware, a day without enough readings is not carried over
+into the next. Gaps between readings longer than --max-gap minutes are
+listed and counted per day. --wow writes WoW report bodies, in the form
+metoffice_wow sends them, as a JSON array for resubmission.
+
+All the work is done in vectorised NumPy passes, so years of 1-minute data
+take a few seconds.
+"""
+import argparse
+import json
+import re
+import struct
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    sys.exit('reprocess.py needs NumPy (pip install numpy)')
+
+DAY = 86400
+REPORT_HOUR = 9  # daily max/min report time (UTC), as in main.py
+HOURLY_MINUTE = 50  # hourly report time (minutes past), as in main.py
+DATA_POINTS_REQ = 100  # main.data_points_req
+
+# The journal record layout, temps_file.RECORD_FORMAT "<IIfffHH"
+RECORD_DTYPE = np.dtype([('seq', '<u4'), ('time', '<u4'), ('temp', '<f4'),
+                         ('max', '<f4'), ('min', '<f4'), ('count', '<u2'),
+                         ('check', '<u2')])
+CHECKED_SIZE = RECORD_DTYPE.itemsize - 2
+ARCHIVE_HEADER = '<IHHHhhh'  # archive.HEADER_FORMAT
+
+
+def load_corrections(path, sensor):
+    """Calibration table (temperatures, corrections) as arrays sorted by
+    temperature, from a config.json or a corrections dictionary file."""
+    with open(path) as datafile:
+        data = json.load(datafile)
+    if 'CORRECTIONS' in data:
+        data = data['CORRECTIONS'].get(sensor, {})
+    points = sorted((float(key[4:]), float(value))
+                    for key, value in data.items())
+    if not points:
+        sys.exit('No corrections for ' + sensor + ' in ' + path)
+    table = np.array(points, dtype=np.float64)
+    return table[:, 0], table[:, 1]
+
+
+def calibrate(table, temps):
+    """cal_table.apply for an array of 'as read' temperatures."""
+    cert_temps, corrs = table
+    return temps + np.interp(temps, cert_temps, corrs)
+
+
+def uncalibrate(table, temps):
+    """Inverse of calibrate(): the 'as read' temperatures that calibrate to
+    'temps'. The calibrated curve is piecewise linear too, with its corners
+    at the certificate temperatures plus their corrections."""
+    cert_temps, corrs = table
+    corners = cert_temps + corrs
+    if np.any(np.diff(corners) <= 0):
+        sys.exit('Old corrections are not invertible')
+    return temps - np.interp(temps, corners, corrs)
+
+
+def _checksums(raw):
+    """Fletcher-16 checksum (temps_file._checksum) of every record in the
+    (records x bytes) array 'raw'. The running sums are taken mod 255 at
+    the end: a is the sum of the bytes and b the sum weighted by the number
+    of running sums each byte is part of."""
+    data = raw[:, :CHECKED_SIZE].astype(np.int64)
+    weights = np.arange(CHECKED_SIZE, 0, -1, dtype=np.int64)
+    a = data.sum(axis=1) % 255
+    b = (data @ weights) % 255
+    return (b << 8) | a
+
+
+def read_journal(path):
+    """(minute end times, temperatures) of the valid records in a journal
+    segment file. Erased and torn records fail the checksum."""
+    raw = np.fromfile(path, dtype=np.uint8)
+    raw = raw[:len(raw) - len(raw) % RECORD_DTYPE.itemsize]
+    records = raw.view(RECORD_DTYPE)
+    raw = raw.reshape(-1, RECORD_DTYPE.itemsize)
+    valid = (records['seq'] != 0) & (records['check'] == _checksums(raw))
+    records = records[valid]
+    # Records are written just after the minute they close
+    ends = records['time'].astype(np.int64) // 60 * 60
+    return ends, records['temp'].astype(np.float64)
+
+
+def read_archive(path):
+    """(minute end times, temperatures) from an archive day file, in the
+    format described in archive.py."""
+    with open(path, 'rb') as datafile:
+        header = datafile.read(struct.calcsize(ARCHIVE_HEADER))
+        if len(header) != struct.calcsize(ARCHIVE_HEADER):
+            return np.zeros(0, np.int64), np.zeros(0)
+        first, count, length = struct.unpack(ARCHIVE_HEADER, header)[:3]
+        data = datafile.read(length)
+    # Split the data into varints and add up their 7-bit groups
+    groups = np.frombuffer(data, np.uint8)
+    ends = np.flatnonzero(groups < 0x80)
+    starts = np.r_[0, ends[:-1] + 1]
+    index = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = 7 * (np.arange(len(groups)) - starts[index])
+    values = np.zeros(len(ends), np.int64)
+    np.add.at(values, index, (groups & 0x7F).astype(np.int64) << shifts)
+    # Each reading's code is followed by a gap only if its low bit is set.
+    # After a run of odd values the codes and gaps alternate from its
+    # start, so a value is a code if an even number of odd values come
+    # straight before it.
+    odd = values & 1
+    position = np.arange(len(values))
+    last_even = np.maximum.accumulate(np.where(odd == 0, position, -1))
+    run = np.r_[0, (position - last_even)[:-1]]
+    at = np.flatnonzero(run % 2 == 0)[:count]
+    following = np.r_[values, 1][at + 1]
+    gaps = np.where(odd[at] == 1, following, 1)
+    zigzag = values[at] >> 1
+    changes = np.where(zigzag & 1, -((zigzag + 1) >> 1), zigzag >> 1)
+    offsets = np.cumsum(gaps) - 1
+    return first + offsets * 60, np.cumsum(changes) / 10
+
+
+def read_csv(path):
+    """(times, temperatures, already minute means) from a CSV file with a
+    time,temp header. Empty temperatures are read as missing."""
+    with open(path) as datafile:
+        header = datafile.readline().strip().lower().split(',')
+        text = datafile.read()
+    if header[:2] != ['time', 'temp']:
+        sys.exit(path + ': expected a time,temp header')
+    text = re.sub(r',(?=,|\r?$)', ',nan', text, flags=re.M)
+    data = np.loadtxt(text.splitlines(), delimiter=',', usecols=(0, 1),
+                      ndmin=2)
+    times = data[:, 0].astype(np.int64)
+    if len(header) > 2:  # /history.csv: minute means with max/min/count
+        return times // 60 * 60, data[:, 1], True
+    return times, data[:, 1], False
+
+
+def minute_means(times, temps):
+    """Average raw readings into 1-minute means, as Aggregator does, each
+    timed at the end of its minute and rounded to 0.1 degrees."""
+    minutes = times // 60
+    keys, index = np.unique(minutes, return_inverse=True)
+    sums = np.bincount(index, weights=temps, minlength=len(keys))
+    counts = np.bincount(index, minlength=len(keys))
+    return (keys + 1) * 60, np.round(sums / counts, 1)
+
+
+def load(paths):
+    """Merge the inputs into sorted 1-minute (end times, temperatures),
+    one value per minute (the last input wins)."""
+    all_ends = []
+    all_temps = []
+    for path in paths:
+        if path.endswith('.bin'):
+            ends, temps = read_journal(path)
+        elif path.endswith('.dat'):
+            ends, temps = read_archive(path)
+        else:
+            times, temps, means = read_csv(path)
+            keep = ~np.isnan(temps)
+            times, temps = times[keep], temps[keep]
+            if means:
+                ends = times
+            else:
+                ends, temps = minute_means(times, temps)
+        keep = ~np.isnan(temps)
+        all_ends.append(ends[keep])
+        all_temps.append(temps[keep])
+    if not all_ends:
+        return np.zeros(0, np.int64), np.zeros(0)
+    ends = np.concatenate(all_ends)
+    temps = np.concatenate(all_temps)
+    # np.unique keeps the first of equal times, so look at them reversed
+    ends, index = np.unique(ends[::-1], return_index=True)
+    return ends, temps[::-1][index]
+
+
+def find_gaps(ends, max_gap):
+    """(start, end) times of each gap between readings over 'max_gap'
+    seconds."""
+    steps = np.diff(ends)
+    at = np.nonzero(steps > max_gap)[0]
+    return ends[at], ends[at + 1]
+
+
+def daily(ends, temps, gap_ends):
+    """Daily report for each 09:00 to 09:00 window with readings, as a
+    dict of arrays: report time, temperature at the report, age of that
+    temperature (seconds), max, min, number of readings and gaps."""
+    offset = REPORT_HOUR * 3600
+    # Each reading belongs to the report at or after it
+    windows = (ends - offset + DAY - 1) // DAY
+    starts = np.flatnonzero(np.r_[True, windows[1:] != windows[:-1]])
+    lasts = np.r_[starts[1:], len(ends)] - 1
+    max_temps = np.maximum.reduceat(temps, starts)
+    min_temps = np.minimum.reduceat(temps, starts)
+    # As in main.py each day starts from the reading at the previous report
+    seeds = np.flatnonzero(starts)
+    seed_temps = temps[starts[seeds] - 1]
+    max_temps[seeds] = np.maximum(max_temps[seeds], seed_temps)
+    min_temps[seeds] = np.minimum(min_temps[seeds], seed_temps)
+    report_windows = windows[starts]
+    gap_windows = (gap_ends - offset + DAY - 1) // DAY
+    gaps = np.searchsorted(gap_windows, report_windows, 'right') - \
+        np.searchsorted(gap_windows, report_windows, 'left')
+    times = report_windows * DAY + offset
+    return {'time': times, 'temp': temps[lasts], 'age': times - ends[lasts],
+            'max': max_temps, 'min': min_temps,
+            'count': lasts - starts + 1, 'gaps': gaps}
+
+
+def hourly(ends, temps, max_gap):
+    """(report times, temperatures) for the HH:50 reports, each with the
+    latest reading no more than 'max_gap' seconds old."""
+    if not len(ends):
+        return ends, temps
+    offset = HOURLY_MINUTE * 60
+    first = (ends[0] - offset + 3599) // 3600
+    last = (ends[-1] - offset) // 3600
+    times = np.arange(first, last + 1, dtype=np.int64) * 3600 + offset
+    latest = np.searchsorted(ends, times, 'right') - 1
+    keep = times - ends[latest] <= max_gap
+    return times[keep], temps[latest[keep]]
+
+
+def format_times(times):
+    """WoW date/time strings for an array of epoch seconds."""
+    return np.char.add(times.astype('datetime64[s]').astype(str), '+00:00')
+
+
+def wow_reports(site_id, auth_key, times, temps, max_temps=None,
+                min_temps=None):
+    """WoW report bodies as metoffice_wow.build_payload makes them."""
+    reports = []
+    dtgs = format_times(times)
+    temps = np.round(temps, 1).tolist()
+    if max_temps is not None:
+        max_temps = np.round(max_temps, 1).tolist()
+    if min_temps is not None:
+        min_temps = np.round(min_temps, 1).tolist()
+    for i, dtg in enumerate(dtgs.tolist()):
+        report = {'reportStartDateTime': dtg, 'reportEndDateTime': dtg,
+                  'siteId': site_id, 'siteAuthenticationKey': auth_key,
+                  'isPublic': 'true', 'isLatestVersion': 'true',
+                  'collectionName': 1, 'observationType': 1,
+                  'dryBulbTemperature_Celsius': temps[i]}
+        if max_temps is not None:
+            report['airTemperatureMax_Celsius'] = max_temps[i]
+            if min_temps is not None:
+                report['airTemperatureMin_Celsius'] = min_temps[i]
+        reports.append(report)
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Recalibrate and recompute daily max/min temperatures')
+    parser.add_argument('inputs', nargs='+',
+                        help='journal .bin files and history/readings CSVs')
+    parser.add_argument('--sensor', default='hmt',
+                        help='sensor name in config.json CORRECTIONS')
+    parser.add_argument('--old-config',
+                        help='calibration to remove from the readings')
+    parser.add_argument('--new-config', help='calibration to apply')
+    parser.add_argument('--start', type=np.datetime64,
+                        help='first report date/time to keep (UTC)')
+    parser.add_argument('--end', type=np.datetime64,
+                        help='last report date/time to keep (UTC)')
+    parser.add_argument('--max-gap', type=float, default=5,
+                        help='longest step between readings (minutes)')
+    parser.add_argument('--min-count', type=int, default=DATA_POINTS_REQ,
+                        help='readings needed for a daily report')
+    parser.add_argument('--sched', type=int, choices=(1, 2, 3), default=3,
+                        help='REPORTING_SCHED of the reports to write')
+    parser.add_argument('--wow', help='write WoW reports to this JSON file')
+    parser.add_argument('--site-id', default='', help='WoW site id')
+    parser.add_argument('--auth-key', default='', help='WoW auth key')
+    args = parser.parse_args()
+
+    ends, temps = load(args.inputs)
+    if not len(ends):
+        sys.exit('No readings in the inputs')
+    if args.old_config:
+        temps = uncalibrate(load_corrections(args.old_config, args.sensor),
+                            temps)
+    if args.new_config:
+        temps = calibrate(load_corrections(args.new_config, args.sensor),
+                          temps)
+    # The device works with 1-minute means to 0.1 degrees
+    temps = np.round(temps, 1)
+    max_gap = int(args.max_gap * 60)
+    gap_starts, gap_ends = find_gaps(ends, max_gap)
+    days = daily(ends, temps, gap_ends)
+    hours = hourly(ends, temps, max_gap)
+    selected = np.ones(len(days['time']), bool)
+    hour_selected = np.ones(len(hours[0]), bool)
+    gap_selected = np.ones(len(gap_starts), bool)
+    if args.start is not None:
+        start = args.start.astype('datetime64[s]').astype(np.int64)
+        selected &= days['time'] >= start
+        hour_selected &= hours[0] >= start
+        gap_selected &= gap_ends >= start - DAY
+    if args.end is not None:
+        end = args.end.astype('datetime64[s]').astype(np.int64)
+        selected &= days['time'] <= end
+        hour_selected &= hours[0] <= end
+        gap_selected &= gap_starts <= end
+    days = {key: value[selected] for key, value in days.items()}
+    hours = hours[0][hour_selected], hours[1][hour_selected]
+    gap_starts, gap_ends = gap_starts[gap_selected], gap_ends[gap_selected]
+    # A day is reported if the station was running at its 09:00 report
+    reported = (days['count'] > args.min_count) & (days['age'] <= max_gap)
+
+    print('{} readings, {} gaps over {:g} minutes'.format(
+        len(ends), len(gap_starts), args.max_gap))
+    for start, end in zip(format_times(gap_starts), format_times(gap_ends)):
+        print('  gap ' + start + ' to ' + end)
+    print('report,temp,max,min,count,gaps,reported')
+    for i, dtg in enumerate(format_times(days['time'])):
+        print('{},{:.1f},{:.1f},{:.1f},{},{},{}'.format(
+            dtg, days['temp'][i], days['max'][i], days['min'][i],
+            days['count'][i], days['gaps'][i],
+            'yes' if reported[i] else 'no'))
+
+    if args.wow:
+        days = {key: value[reported] for key, value in days.items()}
+        reports = wow_reports(
+            args.site_id, args.auth_key, days['time'], days['temp'],
+            days['max'], None if args.sched == 1 else days['min'])
+        if args.sched == 3:
+            reports += wow_reports(args.site_id, args.auth_key, *hours)
+            reports.sort(key=lambda report: report['reportEndDateTime'])
+        with open(args.wow, 'w') as datafile:
+            json.dump(reports, datafile, indent=1)
+        print('{} WoW reports written to {}'.format(len(reports), args.wow))
+
+
+if __name__ == '__main__':
+    main()
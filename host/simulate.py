@@ -0,0 +1,392 @@
+"""Discrete-event simulation of the station, running days or weeks of
+main.py in seconds on a PC.
+
+    python host/simulate.py --days 14 --fault wifi:3d2h:6h --fault reset:5d
+
+The real firmware runs against the host stand-ins, with a virtual clock
+that jumps straight to the next scheduled event instead of waiting. The
+HMT333 emulator outputs a scripted temperature series (a daily sine wave,
+or --temps CSV of time,temp with times in seconds from the start), and WoW
+and NTP are answered by stand-ins that use the simulated true time. Every
+WoW submission and every max/min change is reported, along with each
+restart; the firmware's own output goes to --log.
+
+Faults are scheduled with --fault KIND:START[:DURATION], times relative to
+the start of the simulation, e.g. 2d, 3d4h30m or 90s:
+    sensor  the HMT doesn't respond
+    spike   the HMT reads 'spike_size' degrees high (to exercise qc.py;
+            a spike lasting qc.step_samples readings is a step change)
+    wifi    the access point is unavailable
+    wow     the WoW API answers 503
+    reset   watchdog reset (no duration)
+    power   power cut for DURATION; the RTC is lost
+The files the firmware writes are kept in --dir (a temporary directory by
+default), so the journal and queue carry over restarts as they would on
+flash.
+"""
+import argparse
+import asyncio as _asyncio
+import bisect
+import calendar
+import contextlib
+import json
+import math
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+HOST = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HOST)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HOST + '/stubs')
+sys.path.insert(0, HOST)
+
+import utime  # noqa: E402
+import uasyncio  # noqa: E402
+import machine  # noqa: E402
+import network  # noqa: E402
+from hmt_emulator import HMT333Emulator  # noqa: E402
+
+RTC_RESET_TIME = 1609459200  # 2021-01-01, the RP2040 RTC after a reset
+BOOT_TIME = 2  # seconds from a reset to main.py running
+FAULT_KINDS = ('sensor', 'spike', 'wifi', 'wow', 'reset', 'power')
+spike_size = 30.0
+
+
+class VirtualClock:
+    """utime clock for the simulation. 'mono' is the tick counter in
+    seconds, advanced by the event loop and by blocking sleeps; the true
+    time is 'start' plus 'mono', and the RTC is the true time plus an
+    offset changed by setting it."""
+
+    def __init__(self, start):
+        self.start = start
+        self.mono = 0.0
+        self.offset = 0.0
+
+    def true_time(self):
+        return self.start + self.mono
+
+    def time(self):
+        return self.true_time() + self.offset
+
+    def monotonic(self):
+        return self.mono
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.mono += seconds
+
+    def set_time(self, epoch):
+        self.offset = epoch - self.true_time()
+
+
+class _VirtualSelector:
+    """Selector that polls the real one, and if nothing is ready moves the
+    virtual clock on by the time the event loop would have waited."""
+
+    def __init__(self, selector, clock):
+        self._selector = selector
+        self._clock = clock
+
+    def select(self, timeout=None):
+        events = self._selector.select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            raise RuntimeError('simulation stalled: nothing scheduled')
+        self._clock.mono += timeout
+        return events
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+
+class VirtualLoop(_asyncio.SelectorEventLoop):
+    clock = None
+
+    def __init__(self):
+        super().__init__()
+        self._selector = _VirtualSelector(self._selector, self.clock)
+
+    def time(self):
+        return self.clock.mono
+
+
+class _NoCollect:
+    @staticmethod
+    def collect():
+        pass
+
+
+def parse_duration(text):
+    """Seconds in a duration such as 3d4h30m or 90s."""
+    parts = re.findall(r'(\d+(?:\.\d+)?)([dhms])', text)
+    if not parts or ''.join(n + u for n, u in parts) != text:
+        raise argparse.ArgumentTypeError('bad duration ' + text)
+    units = {'d': 86400, 'h': 3600, 'm': 60, 's': 1}
+    return sum(float(n) * units[u] for n, u in parts)
+
+
+def parse_fault(text):
+    fields = text.split(':')
+    if fields[0] not in FAULT_KINDS or not 2 <= len(fields) <= 3:
+        raise argparse.ArgumentTypeError('bad fault ' + text)
+    duration = parse_duration(fields[2]) if len(fields) > 2 else 0
+    return fields[0], parse_duration(fields[1]), duration
+
+
+class Simulation:
+
+    def __init__(self, args):
+        self.args = args
+        self.clock = VirtualClock(args.start)
+        self.end = args.start + args.days * 86400
+        self.faults = [(kind, args.start + at, args.start + at + length)
+                       for kind, at, length in args.fault]
+        self.temps = None
+        if args.temps:
+            self.temps = self._load_temps(args.temps)
+        self.random = random.Random(args.seed)
+        self.submissions = []
+        self.transitions = 0
+        self.restarts = []
+        self.main = None  # globals of the running main.py
+        self._extremes = {}
+        self._action = None  # 'reset', 'power' or 'end' when the loop stops
+        self._out = sys.stdout
+
+    @staticmethod
+    def _load_temps(path):
+        with open(path) as datafile:
+            datafile.readline()
+            rows = [line.split(',') for line in datafile if line.strip()]
+        return [float(row[0]) for row in rows], \
+            [float(row[1]) for row in rows]
+
+    def active(self, kind):
+        now = self.clock.true_time()
+        for fault in self.faults:
+            if fault[0] == kind and fault[1] <= now < fault[2]:
+                return True
+        return False
+
+    def temperature(self, now):
+        """The temperature the HMT outputs at true time 'now', or None
+        during a sensor fault."""
+        if self.active('sensor'):
+            return None
+        if self.temps is not None:
+            times, temps = self.temps
+            t = now - self.args.start
+            i = bisect.bisect_right(times, t)
+            if i == 0:
+                temp = temps[0]
+            elif i == len(times):
+                temp = temps[-1]
+            else:
+                f = (t - times[i - 1]) / (times[i] - times[i - 1])
+                temp = temps[i - 1] + f * (temps[i] - temps[i - 1])
+        else:
+            # Coldest at 03:00, warmest at 15:00 UTC
+            temp = self.args.mean + self.args.amplitude * math.sin(
+                2 * math.pi * (now % 86400 - 9 * 3600) / 86400)
+            temp += self.random.gauss(0, self.args.noise)
+        if self.active('spike'):
+            temp += spike_size
+        return temp
+
+    def report(self, text):
+        stamp = time.strftime('%Y-%m-%dT%H:%M:%S',
+                              time.gmtime(self.clock.true_time()))
+        self._out.write(stamp + ' ' + text + '\n')
+
+    # Stand-ins for the network services
+
+    async def wow_post(self, url, headers, data):
+        if not network.link_up:
+            raise OSError('no route to host')
+        if self.active('wow'):
+            return 503
+        body = json.loads(bytes(data))
+        self.submissions.append((self.clock.true_time(), body))
+        text = 'WoW ' + body['reportEndDateTime'][:19] + ' temp ' + \
+            str(body['dryBulbTemperature_Celsius'])
+        if 'airTemperatureMax_Celsius' in body:
+            text += ' max ' + str(body['airTemperatureMax_Celsius'])
+        if 'airTemperatureMin_Celsius' in body:
+            text += ' min ' + str(body['airTemperatureMin_Celsius'])
+        self.report(text)
+        return 201
+
+    async def ntp_query(self, server):
+        ntp = sys.modules['NTP_sync']
+        if not network.link_up:
+            return None
+        await uasyncio.sleep_ms(20)
+        return int(self.clock.true_time() * 1000) - ntp.local_ms() + 10, 20
+
+    # Watching the firmware
+
+    def _close_minute(self, close_minute):
+        def wrapper(hmt):
+            before = self._extremes.get(hmt.name, (None, None))
+            close_minute(hmt)
+            after = (hmt.max_temp, hmt.min_temp)
+            if after != before:
+                self.transitions += 1
+                if self.args.transitions:
+                    self.report('{} max {} -> {} min {} -> {}'.format(
+                        hmt.name, before[0], after[0], before[1], after[1]))
+            self._extremes[hmt.name] = after
+        return wrapper
+
+    async def _idle(self):
+        await _asyncio.Event().wait()
+
+    def run_firmware(self, coro):
+        """Stand-in for uasyncio.run(main()) at the end of main.py."""
+        self.main = coro.cr_frame.f_globals
+        # The LED heartbeat and console polling only add events
+        self.main['heartbeat_task'] = self._idle
+        self.main['console'].poll_interval = 3600000
+        sampling = sys.modules['sampling']
+        sampling.close_minute = self._close_minute(sampling.close_minute)
+        loop = VirtualLoop()
+        _asyncio.set_event_loop(loop)
+        for kind, start, end in self.faults:
+            for at, action in ((start, kind), (end, None)):
+                delay = at - self.clock.true_time()
+                if delay <= 0:
+                    continue
+                if action in ('reset', 'power'):
+                    loop.call_at(self.clock.mono + delay, self._stop, loop,
+                                 action)
+                else:
+                    loop.call_at(self.clock.mono + delay, self._faults)
+        loop.call_at(self.clock.mono + self.end - self.clock.true_time(),
+                     self._stop, loop, 'end')
+        self._faults()
+        self._action = None
+        task = loop.create_task(coro)
+        try:
+            loop.run_until_complete(task)
+        except RuntimeError:
+            pass  # stopped by _stop()
+        except machine.ResetError:
+            self._action = 'firmware reset'
+        finally:
+            tasks = _asyncio.all_tasks(loop)
+            for pending in tasks:
+                pending.cancel()
+            if tasks:
+                loop.run_until_complete(
+                    _asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+            _asyncio.set_event_loop(None)
+
+    def _stop(self, loop, action):
+        self._action = action
+        loop.stop()
+
+    def _faults(self):
+        network.link_up = not self.active('wifi')
+
+    def boot(self):
+        """Start main.py afresh, as the device does after a reset."""
+        for name, module in list(sys.modules.items()):
+            path = getattr(module, '__file__', None) or ''
+            if os.path.dirname(os.path.abspath(path)) == ROOT:
+                del sys.modules[name]
+        uasyncio.run = self.run_firmware
+        machine.UART_DEVICES[0] = HMT333Emulator(self.temperature,
+                                                 self.clock.true_time)
+        import metoffice_wow
+        import NTP_sync
+        import stats
+        metoffice_wow.post = self.wow_post
+        NTP_sync.query = self.ntp_query
+        # A full CPython collection each minute would take most of the time
+        stats.gc = _NoCollect
+        with open(self.args.log, 'a') as log, \
+                contextlib.redirect_stdout(log):
+            import main  # noqa: F401
+
+    def run(self):
+        os.chdir(self.args.dir)
+        with open('config.json', 'w') as datafile:
+            json.dump({'SSID': 'sim', 'WIFI-PASSWORD': 'sim',
+                       'WOW_SITE_ID': '000000', 'WOW_AUTH_KEY': '123456',
+                       'REPORTING_SCHED': self.args.sched}, datafile)
+        utime.clock = self.clock
+        VirtualLoop.clock = self.clock
+        machine._reset_cause = machine.PWRON_RESET
+        self.clock.set_time(RTC_RESET_TIME)
+        started = time.monotonic()
+        while True:
+            self.boot()
+            action = self._action
+            if action == 'end':
+                break
+            self.report('restart: ' + action)
+            self.restarts.append((self.clock.true_time(), action))
+            if action == 'power':
+                self.clock.mono += max(
+                    end for kind, start, end in self.faults
+                    if kind == 'power' and start <= self.clock.true_time()) \
+                    - self.clock.true_time()
+                machine._reset_cause = machine.PWRON_RESET
+            else:
+                machine._reset_cause = machine.WDT_RESET
+            self.clock.mono += BOOT_TIME
+            self.clock.set_time(RTC_RESET_TIME)
+        elapsed = time.monotonic() - started
+        daily = sum(1 for _, body in self.submissions
+                    if 'airTemperatureMax_Celsius' in body)
+        self._out.write(
+            '{:g} days simulated in {:.1f}s: {} WoW submissions ({} daily),'
+            ' {} max/min changes, {} restarts\n'.format(
+                self.args.days, elapsed, len(self.submissions), daily,
+                self.transitions, len(self.restarts)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run main.py against a virtual clock')
+    parser.add_argument('--days', type=float, default=7,
+                        help='length of the simulation')
+    parser.add_argument('--start', default='2024-06-01T00:00:00',
+                        help='simulated start time (UTC)')
+    parser.add_argument('--temps', help='CSV of time,temp to output')
+    parser.add_argument('--mean', type=float, default=12.0)
+    parser.add_argument('--amplitude', type=float, default=5.0)
+    parser.add_argument('--noise', type=float, default=0.1,
+                        help='standard deviation of the sensor noise')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--fault', type=parse_fault, action='append',
+                        default=[], help='KIND:START[:DURATION]')
+    parser.add_argument('--sched', type=int, choices=(1, 2, 3), default=3,
+                        help='REPORTING_SCHED')
+    parser.add_argument('--no-transitions', dest='transitions',
+                        action='store_false',
+                        help="don't list each max/min change")
+    parser.add_argument('--dir', help='directory for the firmware files')
+    parser.add_argument('--log', default=os.devnull,
+                        help='file for the firmware output')
+    args = parser.parse_args()
+    args.start = calendar.timegm(time.strptime(args.start,
+                                               '%Y-%m-%dT%H:%M:%S'))
+    if args.log != os.devnull:
+        args.log = os.path.abspath(args.log)
+    if args.temps:
+        args.temps = os.path.abspath(args.temps)
+    if args.dir is None:
+        args.dir = tempfile.mkdtemp(prefix='simulate_')
+    Simulation(args).run()
+
+
+if __name__ == '__main__':
+    main()
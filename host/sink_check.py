@@ -0,0 +1,139 @@
+"""Check the report sinks against local stand-ins for WoW, an MQTT broker
+and a line protocol HTTP endpoint.
+
+    python host/sink_check.py [-n REPORTS] [--delay SECONDS]
+
+Publishes n reports to all three sinks at once. The HTTP endpoint is made
+slow (--delay seconds per request) and the broker drops the connection
+on the first two messages, so the MQTT sink has to retry. Checks that
+every report arrives at every destination, in order and as sent, and
+that the slow endpoint doesn't hold up WoW or MQTT. Exits with status 1
+if a check fails.
+"""
+import sys
+
+HOST = __file__.rsplit('/', 1)[0] if '/' in __file__ else '.'
+ROOT = HOST.rsplit('/', 1)[0] if '/' in HOST else '..'
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HOST + '/stubs')
+sys.path.insert(0, HOST)
+
+import os  # noqa: E402
+import time  # noqa: E402
+import uasyncio as asyncio  # noqa: E402
+import line_server  # noqa: E402
+import mqtt_broker  # noqa: E402
+import wow_server  # noqa: E402
+
+# Files written by the check go in a scratch directory
+try:
+    os.mkdir('sink_tmp')
+except OSError:
+    pass
+os.chdir('sink_tmp')
+try:
+    os.remove('wow_queue.bin')
+except OSError:
+    pass
+
+import metoffice_wow  # noqa: E402
+import sinks  # noqa: E402
+import wifi_manager  # noqa: E402
+import wow_queue  # noqa: E402
+
+START = 1717232400  # 2024-06-01T09:00:00Z
+
+
+def option(name, default):
+    if name in sys.argv:
+        return type(default)(sys.argv[sys.argv.index(name) + 1])
+    return default
+
+
+async def check(n, delay):
+    wow = wow_server.serve_in_thread()
+    broker = mqtt_broker.serve_in_thread()
+    endpoint = line_server.serve_in_thread(token='secret')
+    metoffice_wow.wow_url = wow.url
+    metoffice_wow.delay = 0
+    wow_queue.MIN_INTERVAL = 0  # no WoW rate limit for the check
+    wow_queue.POLL_INTERVAL = 0.1
+    endpoint.delay = delay
+    broker.fail_next = 2
+    sinks.Sink.retry_wait = 1
+    sinks.Sink.timeout = delay + 5
+
+    wifi_manager.start('ssid', 'password')
+    sinks.sinks.append(sinks.WoWSink('site', '123456'))
+    sinks.sinks.append(sinks.MQTTSink(broker.address, 'hmt333/test'))
+    sinks.sinks.append(sinks.HTTPSink(endpoint.url, 'secret'))
+    tasks = [asyncio.create_task(wifi_manager.run()),
+             asyncio.create_task(sinks.run())]
+    await wifi_manager.wait_ready(10)
+
+    expected = []
+    for i in range(n):
+        obs_time = START + i * 3600
+        temp = 10.0 + i / 10
+        max_temp = None if i % 2 else 15.0 + i
+        min_temp = None if i % 2 else -2.5
+        sinks.publish(obs_time, temp, max_temp, min_temp)
+        fields = {'temp': temp}
+        if max_temp is not None:
+            fields.update(max=max_temp, min=min_temp)
+        expected.append((obs_time, fields))
+
+    started = time.monotonic()
+    done = {}
+    delivered = {'wow': lambda: len(wow.observations),
+                 'mqtt': lambda: len(broker.messages),
+                 'http': lambda: len(endpoint.points)}
+    while len(done) < len(delivered) and \
+            time.monotonic() - started < n * (delay + 2) + 20:
+        for name, count in delivered.items():
+            if name not in done and count() >= n:
+                done[name] = time.monotonic() - started
+        await asyncio.sleep(0.05)
+    for task in tasks:
+        task.cancel()
+
+    failed = []
+    for name in delivered:
+        if name not in done:
+            failed.append(name + ': ' + str(delivered[name]()) + ' of ' +
+                          str(n) + ' reports delivered')
+    mqtt_points = [line_server.parse_line(payload.decode())
+                   for topic, payload in broker.messages]
+    for name, points in (('mqtt', mqtt_points), ('http', endpoint.points)):
+        got = [(point[3] // 1000000000, point[2]) for point in points]
+        if got != expected:
+            failed.append(name + ': reports differ from those published')
+        if any(point[1] != {'sensor': 'hmt'} for point in points):
+            failed.append(name + ': wrong tags')
+    wow_times = [observation['reportEndDateTime'][:19]
+                 for observation in wow.observations]
+    if wow_times != [time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(t))
+                     for t, _ in expected]:
+        failed.append('wow: reports differ from those published')
+    if 'http' in done and ('wow' not in done or 'mqtt' not in done or
+                           done['wow'] >= done['http'] or
+                           done['mqtt'] >= done['http']):
+        failed.append('the slow HTTP endpoint held up the other sinks')
+
+    print('{:<6}{:>10}{:>10}{:>10}'.format('sink', 'reports', 'seconds',
+                                          'retries'))
+    retries = {'wow': metoffice_wow.retries,
+               'mqtt': sinks.sinks[1].failures,
+               'http': sinks.sinks[2].failures}
+    for name in delivered:
+        print('{:<6}{:>10}{:>10}{:>10}'.format(
+            name, delivered[name](),
+            '-' if name not in done else '{:.1f}'.format(done[name]),
+            retries[name]))
+    for line in failed:
+        print('FAILED ' + line)
+    return not failed
+
+
+if not asyncio.run(check(option('-n', 5), option('--delay', 1.0))):
+    sys.exit(1)
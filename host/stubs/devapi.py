@@ -0,0 +1,4 @@
+"""Host stand-in for the user supplied devapi.py."""
+DEV = {
+    'API_KEY': 'host-test-key',
+}
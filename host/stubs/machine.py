@@ -0,0 +1,175 @@
+"""Host stand-in for the MicroPython machine module.
+
+A UART is attached to a device by putting an object with write(data) and
+read() methods (read returns whatever bytes are waiting) in UART_DEVICES
+under the UART id, e.g. an HMT333Emulator, or by setting the UART<id>_PTY
+environment variable to the path of a pseudo-terminal. Without a device,
+writes are discarded and nothing is ever received."""
+import os
+import sys
+import utime
+
+PWRON_RESET = 1
+WDT_RESET = 3
+SOFT_RESET = 5
+
+UART_DEVICES = {}
+_reset_cause = PWRON_RESET
+
+
+class ResetError(SystemExit):
+    """Raised by reset() so a host runner can restart the firmware."""
+
+
+def reset():
+    raise ResetError('machine.reset()')
+
+
+def soft_reset():
+    raise ResetError('machine.soft_reset()')
+
+
+def reset_cause():
+    return _reset_cause
+
+
+def lightsleep(ms=None):
+    utime.sleep_ms(ms or 0)
+
+
+deepsleep = lightsleep
+
+
+def freq(*args):
+    return 125000000
+
+
+def unique_id():
+    return b'HOSTPICO'
+
+
+def idle():
+    pass
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    def __init__(self, pin_id, mode=-1, pull=-1, value=None):
+        self.id = pin_id
+        self._value = value or 0
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = 1 if value else 0
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    def toggle(self):
+        self._value ^= 1
+
+
+class PtyDevice:
+    """UART device connected to a pseudo-terminal, e.g. one served by
+    host/hmt_emulator.py."""
+
+    def __init__(self, path):
+        import tty
+        self.fd = os.open(path, os.O_RDWR | os.O_NONBLOCK | os.O_NOCTTY)
+        tty.setraw(self.fd)
+
+    def write(self, data):
+        os.write(self.fd, data)
+
+    def read(self):
+        try:
+            return os.read(self.fd, 4096)
+        except (BlockingIOError, OSError):
+            return b''
+
+
+class UART:
+    def __init__(self, uart_id, baudrate=9600, **kwargs):
+        self.id = uart_id
+        self.baudrate = baudrate
+        self._rx = bytearray()
+        self._device = UART_DEVICES.get(uart_id)
+        if self._device is None:
+            path = os.environ.get('UART{}_PTY'.format(uart_id))
+            if path:
+                self._device = PtyDevice(path)
+
+    def init(self, baudrate=9600, **kwargs):
+        self.baudrate = baudrate
+
+    def _poll(self):
+        if self._device is not None:
+            data = self._device.read()
+            if data:
+                self._rx += data
+
+    def any(self):
+        self._poll()
+        return len(self._rx)
+
+    def read(self, nbytes=None):
+        self._poll()
+        if not self._rx:
+            return None
+        if nbytes is None:
+            nbytes = len(self._rx)
+        data = bytes(self._rx[:nbytes])
+        del self._rx[:nbytes]
+        return data
+
+    def readinto(self, buf, nbytes=None):
+        self._poll()
+        n = min(len(buf) if nbytes is None else nbytes, len(self._rx))
+        if n == 0:
+            return None
+        buf[:n] = self._rx[:n]
+        del self._rx[:n]
+        return n
+
+    def readline(self):
+        self._poll()
+        end = self._rx.find(b'\n')
+        return self.read(end + 1 if end >= 0 else None)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        if self._device is not None:
+            self._device.write(bytes(data))
+        elif os.environ.get('UART{}_STDOUT'.format(self.id)):
+            sys.stdout.write(bytes(data).decode(errors='replace'))
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class RTC:
+    def datetime(self, datetimetuple=None):
+        if datetimetuple is None:
+            tm = utime.localtime()
+            return (tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0)
+        year, month, day, _, hour, minute, second, _ = datetimetuple
+        utime.clock.set_time(utime.mktime(
+            (year, month, day, hour, minute, second, 0, 0)))
+
+
+class WDT:
+    def __init__(self, id=0, timeout=5000):
+        self.timeout = timeout
+
+    def feed(self):
+        pass
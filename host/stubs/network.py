@@ -0,0 +1,53 @@
+"""Host stand-in for the MicroPython network module. Set 'link_up' to
+False to simulate the access point going away."""
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_CONNECT_FAIL = -1
+STAT_NO_AP_FOUND = -2
+STAT_WRONG_PASSWORD = -3
+STAT_GOT_IP = 3
+
+link_up = True
+
+
+class WLAN:
+    def __init__(self, interface=STA_IF):
+        self._active = False
+        self._wanted = False
+        self._config = {}
+        self._ifconfig = ('192.168.1.50', '255.255.255.0', '192.168.1.1',
+                          '192.168.1.1')
+        self.ssid = None
+
+    def active(self, state=None):
+        if state is None:
+            return self._active
+        self._active = bool(state)
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self._config.get(args[0])
+        self._config.update(kwargs)
+
+    def connect(self, ssid=None, password=None, **kwargs):
+        self.ssid = ssid
+        self._wanted = True
+
+    def disconnect(self):
+        self._wanted = False
+
+    def status(self, *args):
+        if not self._wanted:
+            return STAT_IDLE
+        return STAT_GOT_IP if link_up else STAT_NO_AP_FOUND
+
+    def isconnected(self):
+        return self.status() == STAT_GOT_IP
+
+    def ifconfig(self, config=None):
+        if config is None:
+            return self._ifconfig
+        self._ifconfig = tuple(config)
@@ -0,0 +1,34 @@
+"""Host stand-in for the MicroPython uasyncio module, built on the CPython
+asyncio package with the MicroPython specific additions."""
+import asyncio as _asyncio
+from asyncio import *  # noqa: F401,F403
+
+
+def sleep_ms(ms):
+    return _asyncio.sleep(max(ms, 0) / 1000)
+
+
+def wait_for_ms(awaitable, timeout):
+    return _asyncio.wait_for(awaitable, timeout / 1000)
+
+
+class ThreadSafeFlag:
+    """Flag that can be set from another thread and awaited by one task."""
+
+    def __init__(self):
+        self._event = _asyncio.Event()
+        self._loop = None
+
+    def set(self):
+        if self._loop is None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        self._loop = _asyncio.get_running_loop()
+        await self._event.wait()
+        self._event.clear()
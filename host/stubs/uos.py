@@ -0,0 +1,19 @@
+"""Host stand-in for the MicroPython uos module."""
+from os import *  # noqa: F401,F403
+from os import listdir, stat as _stat
+
+
+def stat(path):
+    return tuple(_stat(path))
+
+
+def ilistdir(path='.'):
+    for name in listdir(path):
+        yield name, 0x4000 if _stat(path + '/' + name).st_mode & 0o40000 \
+            else 0x8000, 0
+
+
+def statvfs(path):
+    st = __import__('os').statvfs(path)
+    return (st.f_bsize, st.f_frsize, st.f_blocks, st.f_bfree, st.f_bavail,
+            st.f_files, st.f_ffree, st.f_favail, st.f_flag, st.f_namemax)
@@ -0,0 +1,81 @@
+"""Host stand-in for the MicroPython utime module.
+
+Wall clock and tick counter both come from 'clock', which can be replaced
+(e.g. by a virtual clock) to control time seen by the firmware."""
+import calendar as _calendar
+import time as _time
+
+
+class RealClock:
+    """Host wall clock. 'offset' is added to the host time so that setting
+    the RTC behaves as it does on the device."""
+
+    def __init__(self):
+        self.offset = 0.0
+
+    def time(self):
+        return _time.time() + self.offset
+
+    def monotonic(self):
+        return _time.monotonic()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            _time.sleep(seconds)
+
+    def set_time(self, epoch):
+        self.offset = epoch - _time.time()
+
+
+clock = RealClock()
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_HALF = _TICKS_PERIOD // 2
+
+
+def time():
+    return int(clock.time())
+
+
+def time_ns():
+    return int(clock.time() * 1000000000)
+
+
+def localtime(secs=None):
+    return _time.gmtime(time() if secs is None else secs)[:8]
+
+
+gmtime = localtime
+
+
+def mktime(tm):
+    return _calendar.timegm(tuple(tm[:6]))
+
+
+def sleep(seconds):
+    clock.sleep(seconds)
+
+
+def sleep_ms(ms):
+    clock.sleep(ms / 1000)
+
+
+def sleep_us(us):
+    clock.sleep(us / 1000000)
+
+
+def ticks_ms():
+    return int(clock.monotonic() * 1000) % _TICKS_PERIOD
+
+
+def ticks_us():
+    return int(clock.monotonic() * 1000000) % _TICKS_PERIOD
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) % _TICKS_PERIOD
+
+
+def ticks_diff(ticks1, ticks2):
+    diff = (ticks1 - ticks2) % _TICKS_PERIOD
+    return diff - _TICKS_PERIOD if diff >= _TICKS_HALF else diff
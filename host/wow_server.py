@@ -0,0 +1,93 @@
+"""Local stand-in for the Met Office WoW Observations API, for running the
+firmware on a PC.
+
+    python host/wow_server.py --port 8080
+
+Point the firmware at it with
+metoffice_wow.wow_url = 'http://127.0.0.1:8080/api/Observations'.
+Accepted observations are printed and kept in server.observations. Set
+server.fail_next to a number of requests to answer with server.fail_status
+to exercise the firmware's retries and queueing.
+"""
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PATH = '/api/Observations'
+REQUIRED = ('reportStartDateTime', 'reportEndDateTime', 'siteId',
+            'siteAuthenticationKey', 'dryBulbTemperature_Celsius')
+
+
+class WoWHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server.requests += 1
+        server.connections.add(self.client_address)
+        if self.path.split('?')[0] != PATH:
+            return self._reply(404)
+        if not self.headers.get('Ocp-Apim-Subscription-Key'):
+            return self._reply(401)
+        if server.fail_next > 0:
+            server.fail_next -= 1
+            return self._reply(server.fail_status)
+        try:
+            observation = json.loads(body)
+            missing = [key for key in REQUIRED if key not in observation]
+        except ValueError:
+            missing = ['body']
+        if missing:
+            return self._reply(400, ('missing ' + ','.join(missing)).encode())
+        server.observations.append(observation)
+        if server.verbose:
+            print('WoW observation: ' + json.dumps(observation), flush=True)
+        self._reply(201)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class WoWServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, verbose=False):
+        super().__init__(('127.0.0.1', port), WoWHandler)
+        self.verbose = verbose
+        self.observations = []
+        self.requests = 0
+        self.connections = set()
+        self.fail_next = 0
+        self.fail_status = 503
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}{}'.format(self.server_address[1], PATH)
+
+
+def serve_in_thread(port=0, verbose=False):
+    """Start a WoWServer on a background thread and return it."""
+    server = WoWServer(port, verbose)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+    server = WoWServer(args.port, verbose=True)
+    print('WoW stand-in on ' + server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,156 @@
+import socket
+import utime
+import uasyncio as asyncio
+import wifi_manager
+
+idle_timeout = 120  # close a connection unused for this long in seconds
+
+
+def split_url(url):
+    """Split a URL into (use_ssl, host, port, path) for opening a stream
+    connection to it."""
+    proto, _, host, path = url.split('/', 3)
+    use_ssl = proto == 'https:'
+    port = 443 if use_ssl else 80
+    if ':' in host:
+        host, port = host.split(':')
+        port = int(port)
+    return use_ssl, host, port, '/' + path
+
+
+class HTTPClient:
+    """Minimal HTTP/1.1 client for POSTing to one URL over a connection that
+    is kept open between requests, so a TLS handshake is only needed when
+    the connection has to be reopened. The server address comes from the
+    wifi_manager DNS cache. If the server has closed a kept-alive
+    connection the request is repeated once on a new connection.
+    MicroPython's ssl module doesn't expose TLS session resumption, so a
+    new connection always does a full handshake."""
+
+    def __init__(self, url):
+        self.url = url
+        self.use_ssl, self.host, self.port, self.path = split_url(url)
+        self._ssl = None
+        self._reader = None
+        self._writer = None
+        self._last_used = 0
+        self._request_line = 'POST {} HTTP/1.1\r\nHost: {}\r\n'.format(
+            self.path, self.host).encode()
+        self.connects = 0  # connections opened (TLS handshakes if https)
+        self.requests = 0
+
+    def _ssl_context(self):
+        if self._ssl is None:
+            import ssl
+            self._ssl = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            # The server certificate isn't verified, as with urequests
+            if hasattr(self._ssl, 'check_hostname'):
+                self._ssl.check_hostname = False
+            self._ssl.verify_mode = ssl.CERT_NONE
+        return self._ssl
+
+    async def _connect(self):
+        address = wifi_manager.resolve(self.host, self.port,
+                                       socket.SOCK_STREAM)[0]
+        try:
+            if self.use_ssl:
+                self._reader, self._writer = await asyncio.open_connection(
+                    address, self.port, ssl=self._ssl_context(),
+                    server_hostname=self.host)
+            else:
+                self._reader, self._writer = await asyncio.open_connection(
+                    address, self.port)
+        except OSError:
+            # The server may have moved - look it up again next time
+            wifi_manager.forget(self.host, self.port)
+            raise
+        self.connects += 1
+
+    def close(self):
+        """Close the connection, if open."""
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            except OSError:
+                pass
+        self._reader = self._writer = None
+
+    async def _read_response(self):
+        """Read the response, discarding the body. Returns (status code,
+        True if the server will close the connection)."""
+        reader = self._reader
+        status_line = await reader.readline()
+        if not status_line:
+            raise OSError('connection closed')
+        # Status line e.g. HTTP/1.1 201 Created
+        version, status = status_line.split(None, 2)[:2]
+        close = version != b'HTTP/1.1'
+        length = None
+        chunked = False
+        while True:
+            line = await reader.readline()
+            if not line or line == b'\r\n':
+                break
+            name, value = (line.split(b':', 1) + [b''])[:2]
+            name = name.strip().lower()
+            value = value.strip().lower()
+            if name == b'content-length':
+                length = int(value)
+            elif name == b'connection':
+                close = value == b'close'
+            elif name == b'transfer-encoding':
+                chunked = value == b'chunked'
+        if chunked:
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                await self._discard(size + 2)  # chunk and its CRLF
+                if size == 0:
+                    break
+        elif length is not None:
+            await self._discard(length)
+        else:
+            # Body runs until the server closes the connection
+            close = True
+        return int(status), close
+
+    async def _discard(self, length):
+        while length > 0:
+            data = await self._reader.read(min(length, 256))
+            if not data:
+                raise OSError('connection closed')
+            length -= len(data)
+
+    async def post(self, head, body):
+        """POST 'body' (any bytes-like object) with the extra request header
+        lines in 'head' (bytes, each line ending CRLF) and return the HTTP
+        response status code."""
+        if self._writer is not None and utime.time() - self._last_used > \
+                idle_timeout:
+            # The server has probably dropped it by now
+            self.close()
+        for attempt in range(2):
+            reused = self._writer is not None
+            if not reused:
+                await self._connect()
+            done = False
+            try:
+                self._writer.write(self._request_line)
+                self._writer.write(head)
+                self._writer.write(b'Content-Length: %d\r\n\r\n' % len(body))
+                self._writer.write(body)
+                await self._writer.drain()
+                status, close = await self._read_response()
+                done = True
+            except OSError:
+                if not reused:
+                    raise
+                # Stale kept-alive connection - try again on a new one
+                continue
+            finally:
+                if not done:
+                    self.close()
+            self.requests += 1
+            self._last_used = utime.time()
+            if close:
+                self.close()
+            return status
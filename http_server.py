@@ -0,0 +1,171 @@
+import uasyncio as asyncio
+import temps_file
+import archive
+
+port = 80
+request_timeout = 5  # time allowed for a client to send its request (secs)
+max_clients = 2  # further connections are closed straight away
+
+_server = None
+_readings = None
+_clients = 0
+requests = 0  # requests answered
+
+_CSV_HEADER = b'time,temp,max,min,count\r\n'
+
+
+def _json_number(value):
+    return 'null' if value is None else '{:.1f}'.format(value)
+
+
+def _csv_number(value):
+    return '' if value is None else '{:.1f}'.format(value)
+
+
+def _json_record(record):
+    return '{{"time":{},"temp":{},"max":{},"min":{},"count":{}}}'.format(
+        record[0], _json_number(record[1]), _json_number(record[2]),
+        _json_number(record[3]), record[4])
+
+
+def _csv_record(record):
+    return '{},{},{},{},{}\r\n'.format(
+        record[0], _csv_number(record[1]), _csv_number(record[2]),
+        _csv_number(record[3]), record[4])
+
+
+def _head(writer, status, content_type):
+    writer.write('HTTP/1.0 {}\r\nContent-Type: {}\r\n'
+                 'Connection: close\r\n\r\n'.format(status,
+                                                    content_type).encode())
+
+
+async def _history(writer, as_json):
+    """Stream the journal records, oldest first, one record per write so
+    only a single line is ever held in memory."""
+    if as_json:
+        writer.write(b'[')
+    else:
+        writer.write(_CSV_HEADER)
+    first = True
+    for record in temps_file.history():
+        if as_json:
+            line = _json_record(record)
+            if not first:
+                line = ',' + line
+        else:
+            line = _csv_record(record)
+        first = False
+        writer.write(line.encode())
+        # Sends the line and lets the other tasks run
+        await writer.drain()
+    if as_json:
+        writer.write(b']')
+
+
+def _query_int(query, name):
+    """The integer value of 'name' in the query string, or None."""
+    for item in query.split(b'&'):
+        if item.startswith(name + b'='):
+            return int(item[len(name) + 1:])
+    return None
+
+
+async def _archive(writer, query):
+    """Stream the archived readings between the 'from' and 'to' times in
+    the query string (epoch seconds, both optional) as CSV."""
+    try:
+        start = _query_int(query, b'from')
+        end = _query_int(query, b'to')
+    except ValueError:
+        _head(writer, '400 Bad Request', 'text/plain')
+        return
+    _head(writer, '200 OK', 'text/csv')
+    writer.write(b'time,temp\r\n')
+    for obs_time, temp in archive.readings(start, end):
+        writer.write('{},{:.1f}\r\n'.format(obs_time, temp).encode())
+        await writer.drain()
+
+
+async def _archive_days(writer):
+    """Send the archive's index of days as a JSON array."""
+    writer.write(b'[')
+    first = True
+    for day in archive.days():
+        line = '{{"first":{},"last":{},"count":{},"min":{:.1f},' \
+            '"max":{:.1f}}}'.format(*day)
+        if not first:
+            line = ',' + line
+        first = False
+        writer.write(line.encode())
+        await writer.drain()
+    writer.write(b']')
+
+
+async def _handle(reader, writer):
+    global _clients, requests
+    if _clients >= max_clients:
+        writer.close()
+        await writer.wait_closed()
+        return
+    _clients += 1
+    try:
+        request = await asyncio.wait_for(reader.readline(), request_timeout)
+        # The request headers aren't needed
+        while True:
+            line = await asyncio.wait_for(reader.readline(),
+                                          request_timeout)
+            if not line or line == b'\r\n':
+                break
+        parts = request.split()
+        target = parts[1].split(b'?') if len(parts) > 1 else [b'']
+        path = target[0]
+        query = target[1] if len(target) > 1 else b''
+        if parts[0] != b'GET':
+            _head(writer, '405 Method Not Allowed', 'text/plain')
+        elif path == b'/' or path == b'/latest':
+            _head(writer, '200 OK', 'application/json')
+            writer.write(_json_record(_readings()).encode())
+        elif path == b'/history.json':
+            _head(writer, '200 OK', 'application/json')
+            await _history(writer, True)
+        elif path == b'/history.csv':
+            _head(writer, '200 OK', 'text/csv')
+            await _history(writer, False)
+        elif path == b'/archive.csv':
+            await _archive(writer, query)
+        elif path == b'/archive/days.json':
+            _head(writer, '200 OK', 'application/json')
+            await _archive_days(writer)
+        else:
+            _head(writer, '404 Not Found', 'text/plain')
+        await writer.drain()
+        requests += 1
+    except (OSError, IndexError, asyncio.TimeoutError):
+        # Client went away, sent a malformed request or was too slow
+        pass
+    finally:
+        _clients -= 1
+        writer.close()
+        await writer.wait_closed()
+
+
+async def serve(readings):
+    """Start serving the current readings and the journal history over
+    HTTP on 'port':
+
+        /latest (or /)  the current reading as JSON
+        /history.json   journal records, oldest first, as a JSON array
+        /history.csv    journal records as CSV
+        /archive.csv    archived readings as CSV, optionally limited with
+                        ?from=<time>&to=<time> (epoch seconds)
+        /archive/days.json  the archive's index of days as a JSON array
+
+    'readings' is called for each /latest request and returns (time, temp,
+    max temp, min temp, count). Responses are written a record at a time
+    straight from the journal on flash, and each client is a uasyncio task,
+    so serving never holds up sampling or WoW uploads."""
+    global _server, _readings
+    _readings = readings
+    _server = await asyncio.start_server(_handle, '0.0.0.0', port)
+    print('HTTP server listening on port ' + str(port))
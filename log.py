@@ -0,0 +1,91 @@
+import sys
+
+# Verbosity of the routine messages (config.json LOG_LEVEL)
+ERROR = 0  # failures only
+INFO = 1  # plus a line for each 1-minute mean
+DEBUG = 2  # plus every reading
+level = INFO
+
+uart = None  # console UART the lines are also written to, e.g. UART1
+
+MAX_LINE = 120
+
+_stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+_flush = getattr(sys.stdout, 'flush', None)
+
+
+class Line:
+    """A log line formatted in place in a preallocated buffer, so building
+    one doesn't allocate. Text is added as bytes, e.g. b' Max:', and
+    anything past MAX_LINE is dropped."""
+
+    def __init__(self):
+        self._buf = bytearray(MAX_LINE)
+        self._view = memoryview(self._buf)
+        self.len = 0
+
+    def start(self, text=b''):
+        self.len = 0
+        return self.add(text)
+
+    def add(self, text):
+        n = min(len(text), MAX_LINE - self.len)
+        buf = self._buf
+        start = self.len
+        for i in range(n):
+            buf[start + i] = text[i]
+        self.len = start + n
+        return self
+
+    def add_int(self, value, width=1):
+        """Add 'value' in decimal, zero padded to 'width' digits."""
+        if value < 0:
+            self.add(b'-')
+            value = -value
+        digits = 1
+        limit = 10
+        while value >= limit:
+            digits += 1
+            limit *= 10
+        if digits < width:
+            digits = width
+        if self.len + digits > MAX_LINE:
+            return self
+        i = self.len + digits - 1
+        while i >= self.len:
+            self._buf[i] = 0x30 + value % 10
+            value //= 10
+            i -= 1
+        self.len += digits
+        return self
+
+    def add_temp(self, temp):
+        """Add a temperature to one decimal place, or None."""
+        if temp is None:
+            return self.add(b'None')
+        tenths = int(temp * 10 + (0.5 if temp >= 0 else -0.5))
+        if tenths < 0:
+            self.add(b'-')
+            tenths = -tenths
+        return self.add_int(tenths // 10).add(b'.').add_int(tenths % 10)
+
+    def add_time(self, secs):
+        """Add the time of day of 'secs' (epoch seconds) as HH:MM:SS."""
+        secs %= 86400
+        return self.add_int(secs // 3600, 2).add(b':').add_int(
+            secs // 60 % 60, 2).add(b':').add_int(secs % 60, 2)
+
+    def view(self):
+        """The line so far, as a view of the buffer."""
+        return self._view[:self.len]
+
+    def write(self):
+        """Write the line to the console and the UART."""
+        line = self.view()
+        if _flush is not None:
+            _flush()  # keeps the order with print()
+        _stdout.write(line)
+        _stdout.write(b'\n')
+        if uart is not None:
+            uart.write(b'\r\n')
+            uart.write(line)
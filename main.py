@@ -1,192 +1,503 @@
 import utime
-import network
-import metoffice_wow
+import uasyncio as asyncio
+import wow_queue
 import rp2
 import time
 import read_hmt
-import setup
-import settings
-import gc
 import temps_file
+import dual_core
+import scheduler
 import NTP_sync
+import metoffice_wow
+import stats
+import http_server
+import boot_timeline
+import cal_table
+import config
+import console
+import log
+import sampling
+import wifi_manager
+import sinks
 import machine
 
-# Setup UART port for user interaction to e.g. change settings
-# noinspection PyArgumentList
-uart1 = machine.UART(1, 9600, parity=None, stop=1, bits=8, rx=machine.Pin(5),
-                     tx=machine.Pin(4), timeout=30000)
+
+class NoConsole:
+    """Stands in for the UART1 console when UART1 is used for a sensor."""
+
+    def write(self, data):
+        return 0
+
+    def any(self):
+        return 0
+
+    def read(self, nbytes=None):
+        return None
+
+
+# Setup UART port for the command console, e.g. to change settings
+if read_hmt.uses_uart(1):
+    uart1 = NoConsole()
+else:
+    # noinspection PyArgumentList
+    uart1 = machine.UART(1, 9600, parity=None, stop=1, bits=8,
+                         rx=machine.Pin(5), tx=machine.Pin(4), timeout=10)
+
+# Routine messages go to the console as well as the USB serial port, as
+# much of them as LOG_LEVEL asks for
+log.uart = uart1
+log.level = config.get('LOG_LEVEL')
 
 led = machine.Pin("LED", machine.Pin.OUT)
 led.on()
 
-# User interaction over UART port
-print('Waiting 30 secs for any user interaction on UART1...')
-# user_setup.do_setup(uart1)
-setup.do_setup(uart1)
+# After a restart by reset() (e.g. on a WiFi failure) sampling resumes
+# from the saved state as soon as possible
+boot_timeline.start()
 
-# Use a 'settings.py' file to provide WiFi passwords etc.
-ssid = str(settings.SETTINGS['SSID'])
-password = str(settings.SETTINGS['WIFI-PASSWORD'])
+# WiFi passwords etc. are kept in 'config.json' and can be changed with the
+# console's 'set' command
+ssid = config.get('SSID')
+password = config.get('WIFI-PASSWORD')
 rp2.country('GB')
 
 # Get settings for WoW transmissions
-wow_site_id = str(settings.SETTINGS['WOW_SITE_ID'])
-wow_auth_key = str(settings.SETTINGS['WOW_AUTH_KEY'])
+wow_site_id = config.get('WOW_SITE_ID')
+wow_auth_key = config.get('WOW_AUTH_KEY')
+
+# Reports go to WoW and any MQTT broker or HTTP endpoint set up in
+# config.json, each from a queue of its own
+sinks.setup(wow_site_id, wow_auth_key, read_hmt.sensor.label)
 
 # Number of temperature readings required before submitting
 # a daily max/min report
 data_points_req = 100
 
-# Interval between sensor readings in milliseconds
+# Interval between sensor readings in milliseconds. Readings are averaged
+# over each minute and the daily max/min are taken from the 1-minute means,
+# so an interval of e.g. 5000 catches short peaks without changing memory
+# use.
 sensor_read_intv = 60000
 
+# Read the HMT on the second RP2040 core, so that WiFi, TLS and file I/O
+# on this core can't delay sampling
+use_dual_core = False
+
+# Low power mode: the device lightsleeps between scheduled jobs (readings,
+# reports and time sync) instead of running continuously. Readings are
+# taken by the scheduler and queued reports are sent after each report.
+low_power = False
+
+# Serve the current readings and recent history over HTTP on the local
+# network (see http_server.py). Not available in low power mode.
+use_http_server = False
+
 # 1=daily Max only, 2=daily Max/Min only, 3= daily Max/Min and hourly
-reporting_sched = int(settings.SETTINGS['REPORTING_SCHED'])
-utime.sleep(1)
-led.off()
+reporting_sched = config.get('REPORTING_SCHED')
 
-# Setup WiFi
-wlan = network.WLAN(network.STA_IF)
-wlan.active(True)
-wlan.config(pm=0xa11140)
-wlan.connect(ssid, password)
+ntp_retry_wait = 60  # time between tries of the first NTP sync (seconds)
 
+# Setup WiFi. The connection is kept up by wifi_manager.run() and waited
+# for by connect_network(), alongside the sensor warm-up. A STATIC_IP
+# setting skips DHCP.
 uart1.write('\r\nProceeding to WiFi setup...')
 print('Proceeding to WiFi setup...')
-# Wait for connect or fail
-max_wait = 15
-while max_wait > 0:
-    if wlan.status() < 0 or wlan.status() >= 3:
-        break
-    max_wait -= 1
-    print('Waiting for connection...')
-    uart1.write('\r\nWaiting for connection...')
-    time.sleep(1)
-
-if wlan.status() != 3:
-    uart1.write('\r\nNetwork connection failed...')
-    machine.reset()
+wifi_manager.start(ssid, password, config.static_ip())
+led.off()
 
-else:
-    print('WiFi connected...')
+# Each sensor keeps its own current temperature and daily max/min. Those of
+# the main sensor are reported to WoW and saved to the journal.
+primary = read_hmt.sensor
+
+# Counters included in the stats report (console 'stats' command)
+for hmt in read_hmt.sensors:
+    stats.register(hmt.name, hmt, ('reads_ok', 'timeouts', 'invalid_frames',
+                                   'retries', 'failures'))
+    stats.register(hmt.name + '_qc', hmt.qc, ('accepted', 'range_errors',
+                                              'rate_errors', 'spikes',
+                                              'flatlines', 'steps'))
+stats.register('wow', metoffice_wow, ('posts', 'retries', 'failures'))
+stats.register('wifi', wifi_manager, ('connects', 'reconnects', 'failures',
+                                      'dns_lookups', 'dns_hits'))
+stats.register('queue', wow_queue, ('count', 'evicted'))
+for sink in sinks.sinks:
+    if isinstance(sink, sinks.Sink):
+        stats.register(sink.name, sink, ('count', 'sent', 'failures',
+                                         'dropped'))
+stats.register('ntp', NTP_sync, ('syncs', 'failures', 'last_offset_ms',
+                                 'last_delay_ms'))
+if use_http_server:
+    stats.register('http', http_server, ('requests',))
+if use_dual_core:
+    stats.register('core1', dual_core, ('readings', 'overruns',
+                                        'max_jitter'))
+
+
+# Set once the RTC is known to be right: set by NTP, or restored after
+# reset(). Until then it may be years out (e.g. after a power cut), so the
+# journal isn't used or written and reports are held.
+clock_set = asyncio.Event()
+
+
+async def connect_network():
+    """Wait for the WiFi connection, then sync the clock with NTP, trying
+    again until it succeeds. Sampling carries on meanwhile and wifi_manager
+    keeps retrying the connection."""
+    await wifi_manager.wait_ready()
     uart1.write('\r\nWiFi connected')
-    status = wlan.ifconfig()
-    print('ip = ' + status[0])
-    uart1.write('\r\nip = ' + status[0])
+    uart1.write('\r\nip = ' + wifi_manager.wlan.ifconfig()[0])
+    boot_timeline.mark('wifi')
+
     print('Attempting NTP time sync...')
     uart1.write('\r\nAttempting NTP time sync...')
-    NTP_sync.set_ntp_time()
+    while not NTP_sync.syncs and not await NTP_sync.set_ntp_time():
+        await asyncio.sleep(ntp_retry_wait)
+        await wifi_manager.wait_ready()
     print('Completed NTP time sync...')
     uart1.write('\r\nCompleted NTP time sync...')
     print(time.localtime())
     uart1.write('\r\n' + str(time.localtime()))
+    boot_timeline.mark('ntp')
+    sampling.dated = True
+    clock_set.set()
 
-# Set some timing start points
-last_reading_msec = utime.ticks_ms()
-last_minute = utime.localtime()[4]
-last_hour = utime.localtime()[3] - 1
-last_day = utime.localtime()[2] - 1
 
-print('Getting HMT reading...')
-uart1.write('\r\nGetting HMT reading...')
-led.on()
-# Make a few data requests to ensure HMT has responded with a temperature
-read_hmt.get_hmt_temp()
-read_hmt.get_hmt_temp()
-temp = read_hmt.get_hmt_temp()
-print('Temp C= ' + str(temp))
-uart1.write('\r\nCalibrated Temp C = ' + str(temp))
-led.off()
+async def warm_up():
+    """Take a first reading from every sensor to start its max/min."""
+    print('Getting HMT reading...')
+    uart1.write('\r\nGetting HMT reading...')
+    led.on()
+    # Each sensor is retried until it has responded with a temperature or
+    # its retry budget is used up
+    await read_hmt.read_all()
+    for hmt in read_hmt.sensors:
+        hmt.temp = hmt.result()
+        if hmt.temp is not None and \
+                hmt.qc.check(utime.time(), hmt.temp) is not None:
+            hmt.temp = None
+        print(hmt.name + ' Temp C= ' + str(hmt.temp))
+        uart1.write('\r\n' + hmt.name + ' Calibrated Temp C = ' +
+                    str(hmt.temp))
+        if hmt.temp is not None:
+            hmt.max_temp = hmt.temp
+            hmt.min_temp = hmt.temp
+            hmt.count = 1
+    led.off()
+    boot_timeline.mark('sensors')
+
+
+def recover(max_temp, min_temp, count):
+    """Carry on with the main sensor's previous max/min and temperature
+    readings count from the journal if they were available and recent,
+    taking in the readings since the restart."""
+    temp = primary.temp
+    if temp and max_temp and min_temp and count is not None:
+        print('Temp OK, prev max/min avail')
+        primary.max_temp = max(max_temp, primary.max_temp)
+        primary.min_temp = min(min_temp, primary.min_temp)
+        primary.count += count
+        print(primary.count, temp, primary.max_temp, primary.min_temp)
+
+    elif temp is not None:
+        print('Temp OK - prev max/min NOT avail')
+        print(primary.count, temp, primary.max_temp, primary.min_temp)
+    boot_timeline.mark('state')
+
+
+async def recover_late():
+    """Carry on from the journal once NTP has set the clock its age is
+    checked against, for a boot that went ahead without it. Sampling
+    carries on meanwhile."""
+    print('Clock not set - reports held until NTP sets it...')
+    uart1.write('\r\nClock not set - reports held until NTP sets it...')
+    await clock_set.wait()
+    recover(*temps_file.load_temps())
+    boot_timeline.save()
 
-print('Loading previous temp data if available and recent....')
-uart1.write('\r\nLoading previous temp data if available and recent....')
-max_temp, min_temp, count = temps_file.load_temps()
-
-# Set our initial temp max/min and temperature readings count based
-# on if recent readings are available (from above) or not
-if temp and max_temp and min_temp and count is not None:
-    print('Temp OK, prev max/min avail')
-    prev_temp = temp
-    print(count, temp, max_temp, min_temp)
-
-elif temp is not None:
-    print('Temp OK - prev max/min NOT avail')
-    max_temp = temp
-    min_temp = temp
-    count = 1
-    prev_temp = temp
-    print(count, temp, max_temp, min_temp)
-
-print('Entering main loop - reading sensor every ' + str(
-    int(sensor_read_intv/1000)) + ' secs')
-uart1.write('\r\nCommencing operation')
-uart1.write('\r\nReading sensor every ' + str(int(sensor_read_intv/1000))
-            + ' secs')
-
-# main loop, steady LED flash if connected to WiFi
-while True:
-    if wlan.isconnected():
+
+async def heartbeat_task():
+    """Steady LED flash if connected to WiFi."""
+    while True:
+        if wifi_manager.ready():
+            led.on()
+            await asyncio.sleep_ms(100)
+            led.off()
+        await asyncio.sleep(1)
+
+
+def current_readings():
+    """The current readings of the main sensor for the HTTP server."""
+    return primary.temp_time, primary.temp, primary.max_temp, \
+        primary.min_temp, primary.count
+
+
+async def take_reading():
+    """Read the HMTs and add the readings to the current minute."""
+    led.on()
+    await read_hmt.read_all()
+    led.off()
+    sampling.record_readings()
+
+
+async def sensor_task():
+    """Read the HMTs every 'sensor_read_intv' milliseconds and update the
+    running max/min temperatures from the 1-minute mean once each minute
+    ends. Sampling keeps to its schedule regardless of what the reporting
+    and NTP tasks are doing. The requests are polled here rather than
+    through read_hmt.read_all(), whose coroutine would be allocated for
+    every reading."""
+    last_reading_msec = utime.ticks_ms()
+    while True:
+        await asyncio.sleep_ms(utime.ticks_diff(
+            utime.ticks_add(last_reading_msec, sensor_read_intv),
+            utime.ticks_ms()))
+        last_reading_msec = utime.ticks_ms()
         led.on()
-        utime.sleep_ms(100)
+        read_hmt.start_requests()
+        while read_hmt.tick_all():
+            await asyncio.sleep_ms(read_hmt.poll_interval)
         led.off()
-    # Read the HMT every 'sensor_read_intv' milliseconds
-    current_time = utime.ticks_ms()
-    if utime.ticks_diff(current_time, last_reading_msec) > sensor_read_intv:
-        led.on()
-        temp = read_hmt.get_hmt_temp()
-        uart1.write('\r\nTemp = ' + str(temp))
-        utime.sleep(1)
-        # Update our temperature values
-        if temp is not None:
-            led.off()
-            count += 1
-            if temp > max_temp:
-                max_temp = temp
-            elif temp < min_temp:
-                min_temp = temp
-            prev_temp = temp
-            last_reading_msec = current_time
-            print(utime.localtime())
-            print('Readings:' + str(count) + ' Temp:' + str(temp) +
-                  ' Max:' + str(max_temp) + ' Min:' + str(min_temp))
-            print('MEM free: ' + str(gc.mem_free()))
-
-            print('Saving temperatures to file....')
-            temps_file.save_temps(max_temp, min_temp, count)
-
-    # Hourly tasks
-    current_minute = utime.localtime()[4]
-    current_hour = utime.localtime()[3]
-    if current_hour != last_hour and current_minute == 50 \
-            and reporting_sched == 3:
-        uart1.write('\r\nSending WoW report...')
-        send_wow = metoffice_wow.send_wow(wlan, ssid, password, wow_site_id,
-                                          wow_auth_key, temp)
-        uart1.write('\r\nWoW result (201 = success): ' + send_wow)
-        last_hour = current_hour
-
-    # Daily tasks
-    current_day = utime.localtime()[2]
-    if current_day != last_day and current_hour == 9 and \
-            current_minute == 0 and count > data_points_req:
-        uart1.write('\r\nSending WoW report...')
+        sampling.record_readings()
+
+
+async def save_stats():
+    stats.save()
+
+
+async def core1_reading_task():
+    """Collect the readings taken on core 1 when 'use_dual_core' is set,
+    and report any the ring buffer had to drop."""
+    overruns = 0
+    while True:
+        reading = dual_core.pop()
+        while reading is not None:
+            sampling.add_reading(read_hmt.sensors[reading[2]], reading[0],
+                                 reading[1])
+            reading = dual_core.pop()
+        if dual_core.overruns != overruns:
+            overruns = dual_core.overruns
+            uart1.write('\r\nCore 1 readings dropped: ' + str(overruns))
+        await asyncio.sleep_ms(250)
+
+
+async def queue_report(tempc, max_tempc=None, min_tempc=None):
+    """Add a report to the queue of each sink: WoW and any others set up.
+    Each sink's task sends it as soon as WiFi and the sink's rate limit
+    allow. In low power mode there are no sink tasks, so the oldest queued
+    report of each sink is sent straight away."""
+    sinks.publish(utime.time(), tempc, max_tempc, min_tempc)
+    uart1.write('\r\nWoW report queued (' + str(wow_queue.count) +
+                ' pending)')
+    if low_power:
+        await sinks.send_next()
+
+
+def clock_unset():
+    """True, with a message, if the RTC isn't known to be right yet, so a
+    report would be misdated."""
+    if clock_set.is_set():
+        return False
+    print('Clock not set - report skipped')
+    uart1.write('\r\nClock not set - report skipped')
+    return True
+
+
+async def close_minutes():
+    """Close the minute just ended, on the clock rather than when the next
+    reading arrives."""
+    sampling.close_minutes(utime.time())
+
+
+async def hourly_report():
+    """Hourly temperature report at HH+50, if reporting schedule 3."""
+    if clock_unset():
+        return
+    sampling.close_minutes(utime.time())
+    if reporting_sched == 3 and primary.temp is not None:
+        await queue_report(primary.temp)
+
+
+async def daily_report():
+    """Daily max/min report at 0900 UTC, provided there have been enough
+    readings, followed by starting the new day's max/min for every sensor.
+    Only the main sensor is reported to WoW; the others' max/min are
+    written to UART1. Skipped, max/min and all, until the clock is set."""
+    if clock_unset():
+        return
+    # The minute ending at 0900 belongs to the day being reported
+    sampling.close_minutes(utime.time())
+    if primary.count > data_points_req:
         if reporting_sched == 1:  # daily max temp only
-            send_wow = metoffice_wow.send_wow(wlan, ssid, password,
-                                              wow_site_id, wow_auth_key,
-                                              temp, max_temp)
-            uart1.write('\r\nWoW result (201 = success): ' + send_wow)
+            await queue_report(primary.temp, primary.max_temp)
         else:
-            send_wow = metoffice_wow.send_wow(wlan, ssid, password,
-                                              wow_site_id, wow_auth_key,
-                                              temp, max_temp, min_temp)
-            uart1.write('\r\nWoW result (201 = success): ' + send_wow)
-        max_temp = temp
-        min_temp = temp
-        count = 0
-        last_day = current_day
-
-        # daily NTP time sync
-        NTP_sync.set_ntp_time()
-
-    # wait for 1 second
-    utime.sleep(1)
+            await queue_report(primary.temp, primary.max_temp,
+                               primary.min_temp)
+        for hmt in read_hmt.sensors:
+            if hmt is not primary:
+                uart1.write('\r\n' + hmt.name + ' Max:' +
+                            str(hmt.max_temp) + ' Min:' + str(hmt.min_temp) +
+                            ' Readings:' + str(hmt.count))
+            hmt.max_temp = hmt.temp
+            hmt.min_temp = hmt.temp
+            hmt.count = 0
+    if low_power:
+        uart1.write('\r\nAwake ' + str(jobs.awake_ms // 1000) + 's, asleep '
+                    + str(jobs.asleep_ms // 1000) + 's')
+        # UART1 isn't watched while asleep, so send the stats every day
+        stats.report(uart1.write)
+
+
+def status_command(args):
+    lines = ['Time ' + str(utime.localtime()[:6]),
+             'WiFi ' + ('connected' if wifi_manager.ready() else
+                        'not connected'),
+             'WoW queue ' + str(wow_queue.count) + ' pending']
+    for sink in sinks.sinks:
+        if isinstance(sink, sinks.Sink):
+            lines.append(sink.name + ' queue ' + str(sink.count) +
+                         ' pending')
+    for hmt in read_hmt.sensors:
+        lines.append(hmt.name + ' Temp:' + str(hmt.temp) + ' Max:' +
+                     str(hmt.max_temp) + ' Min:' + str(hmt.min_temp) +
+                     ' Readings:' + str(hmt.count) +
+                     ('' if hmt.healthy() else ' NOT RESPONDING'))
+    return '\r\n'.join(lines)
+
+
+def stats_command(args):
+    stats.report(uart1.write)
+
+
+def get_command(args):
+    lines = []
+    for key in args or sorted(config.DEFAULTS):
+        key = key.upper()
+        if key not in config.DEFAULTS:
+            raise ValueError('unknown setting ' + key)
+        value = str(config.get(key))
+        if key in ('WIFI-PASSWORD', 'WOW_AUTH_KEY', 'MQTT_PASSWORD',
+                   'HTTP_SINK_TOKEN'):
+            value = '*' * len(value)
+        lines.append(key + ': ' + value)
+    return '\r\n'.join(lines)
+
+
+def set_command(text):
+    """Change a setting. The value is the rest of the line as typed, so
+    spaces in an SSID or password are kept. The reporting schedule and log
+    level take effect straight away, the WiFi, WoW, MQTT and HTTP settings
+    after a reset."""
+    global reporting_sched
+    name = text.split()[0]
+    key = name.upper()
+    config.set_value(key, text[len(name):].lstrip())
+    if key == 'REPORTING_SCHED':
+        reporting_sched = config.get(key)
+        return key + ' set to ' + str(reporting_sched)
+    if key == 'LOG_LEVEL':
+        log.level = config.get(key)
+        return key + ' set to ' + str(log.level)
+    return key + " saved - used after 'reset'"
+
+
+def cal_command(args):
+    """Show a sensor's calibration corrections, or set one and rebuild the
+    sensor's calibration table so it's used from the next reading."""
+    for hmt in read_hmt.sensors:
+        if hmt.name == args[0]:
+            break
+    else:
+        raise ValueError('unknown sensor ' + args[0])
+    if len(args) > 1:
+        config.set_correction(hmt.name, args[1], args[2])
+        hmt.cal = cal_table.load(config.corrections(hmt.name))
+    corrections = config.corrections(hmt.name)
+    return '\r\n'.join(
+        key + ': ' + str(corrections[key])
+        for key in sorted(corrections, key=lambda key: float(key[4:])))
+
+
+def send_command(args):
+    if primary.temp is None:
+        raise ValueError('no temperature yet')
+    asyncio.create_task(queue_report(primary.temp))
+
+
+def reset_command(args):
+    boot_timeline.reset()
+
+
+console.command('status', status_command,
+                '- current readings, WiFi and WoW queue')
+console.command('stats', stats_command, '- timings, memory and counters')
+console.command('get', get_command, '[<setting>] - show the settings')
+console.command('set', set_command, '<setting> <value> - change a setting',
+                raw=True)
+console.command('cal', cal_command,
+                '<sensor> [<temp> <correction>] - show or set calibration')
+console.command('send', send_command,
+                '- queue a WoW report of the current temperature')
+console.command('reset', reset_command, '- restart, resuming sampling')
+
+
+# Deadlines for the scheduled jobs are worked out from the RTC, so a
+# report due while the device was busy is sent late rather than skipped
+jobs = scheduler.Scheduler(low_power)
+# Added first so a minute ending with a report is closed before it
+jobs.add('close minute', scheduler.every(60), close_minutes)
+jobs.add('hourly report', scheduler.hourly_at(50), hourly_report)
+jobs.add('daily report', scheduler.daily_at(9), daily_report)
+# NTP sync when due, otherwise correct the RTC for its measured drift
+jobs.add('time sync', scheduler.hourly_at(5), NTP_sync.maintain)
+if stats.persist_interval:
+    jobs.add('save stats', scheduler.every(stats.persist_interval),
+             save_stats)
+
+
+async def main():
+    global sensor_read_intv
+    boot_timeline.mark('main')
+    if read_hmt.run_mode:
+        # Sample at the rate the HMT outputs readings in RUN mode
+        read_hmt.start_run_mode()
+        sensor_read_intv = read_hmt.run_interval * 1000
+
+    print('Loading previous temp data if available and recent....')
+    uart1.write('\r\nLoading previous temp data if available and recent....')
+    asyncio.create_task(wifi_manager.run())
+    asyncio.create_task(connect_network())
+    # The journal's age is checked against the RTC, so it is only used
+    # once the clock is known to be right. Sampling doesn't wait for that.
+    if boot_timeline.restore_clock():
+        clock_set.set()
+    else:
+        sampling.dated = False
+    await warm_up()
+    if clock_set.is_set():
+        recover(*temps_file.load_temps())
+    else:
+        asyncio.create_task(recover_late())
+    boot_timeline.save()
+
+    print('Entering main loop - reading sensor every ' + str(
+        int(sensor_read_intv/1000)) + ' secs')
+    uart1.write('\r\nCommencing operation')
+    uart1.write('\r\nReading sensor every ' + str(int(sensor_read_intv/1000))
+                + ' secs')
+
+    if low_power:
+        jobs.add('reading', scheduler.every(sensor_read_intv // 1000),
+                 take_reading)
+        await jobs.run()
+    if use_http_server:
+        await http_server.serve(current_readings)
+    if use_dual_core:
+        dual_core.start(sensor_read_intv)
+        readings = core1_reading_task()
+    else:
+        readings = sensor_task()
+    await asyncio.gather(heartbeat_task(), console.run(uart1), readings,
+                         jobs.run(), sinks.run())
+
+
+asyncio.run(main())
@@ -1,111 +1,250 @@
-import json
+import ujson
 import utime
+import uasyncio as asyncio
 import devapi
-import urequests as requests
+import http_client
+import stats
+import wifi_manager
 
 wow_url = 'https://mowowprod.azure-api.net/api/Observations'
 api_key = str(devapi.DEV['API_KEY'])
 max_retries = 3  # number retries to be made when report submission fails
 delay = 5  # delay between retries in seconds
+post_timeout = 30  # time allowed for a single POST to complete in seconds
+reconnect_wait = 30  # time allowed for the WiFi to come back in seconds
+verbose = False  # print each report payload
 
+headers = {
+    'Ocp-Apim-Subscription-Key': api_key,
+    'Content-Type': 'application/json'
+}
 
-def send_wow(wlan, ssid, password, wow_site_id, wow_auth_key,
-             tempc, max_tempc=None, min_tempc=None):
+
+_client = None
+_request_head = None  # Request header lines built from 'headers'
+
+# Transmission counters
+posts = 0  # POSTs completed, whatever the response
+retries = 0
+failures = 0  # Reports that couldn't be sent at all
+
+
+async def post(url, headers, data):
+    """POST 'data' to 'url' and return the HTTP response status code.
+    'data' can be any bytes-like object, such as a memoryview of the
+    payload buffer, and is written without being copied. The connection is
+    kept open for the next report and retries, so the TLS handshake is
+    only repeated when the connection has been closed. Other tasks keep
+    running while the (sometimes very slow) WoW API response is awaited."""
+    global _client, _request_head, posts
+    if _client is None or _client.url != url:
+        _client = http_client.HTTPClient(url)
+    if _request_head is None:
+        request = ''
+        for key, value in headers.items():
+            request += '{}: {}\r\n'.format(key, value)
+        _request_head = request.encode()
+    stats.wow_post.start()
+    status = await _client.post(_request_head, data)
+    stats.wow_post.stop()
+    posts += 1
+    return status
+
+
+async def post_with_retries(headers, data, retry_limit=None):
+    """POST the report, retrying up to 'retry_limit' (default 'max_retries')
+    times if we don't get a 201 response. Returns the final status code as
+    a string."""
+    global retries
+    if retry_limit is None:
+        retry_limit = max_retries
+    number_retries = 0
+    status = await asyncio.wait_for(post(wow_url, headers, data),
+                                    post_timeout)
+    print("sent (" + str(status) + ")")
+    while status != 201 and number_retries < retry_limit:
+        await asyncio.sleep(delay)
+        print('retrying wow transmission...')
+        status = await asyncio.wait_for(post(wow_url, headers, data),
+                                        post_timeout)
+        number_retries += 1
+        retries += 1
+    return str(status)
+
+
+async def send_wow(wow_site_id, wow_auth_key, tempc, max_tempc=None,
+                   min_tempc=None, obs_time=None, retry_limit=None):
     """Transmit a formatted data message to the Met Office WoW website using
     the 'canonical' API. If daily maximum and minimum temperatures are
     provided as parameters then these will be included in the report.
     Date and time is formatted as required by the WoW API.
 
     Normal HTTP response code will be 201 for a successful submission. If
-    transmission is unsuccessful due to no wifi connection, then an
-    attempt is made to reconnect to WiFi and repeat the transmission.
+    transmission is unsuccessful, the transmission is repeated once the
+    WiFi connection (kept up by wifi_manager) is ready again.
     A number of retries will also be made if a 201 response is not received
     (as can happen if the WoW servers are busy or down).
     Note that at times, the WoW API can be very slow to respond to requests
     and that the minimum time allowed between transmissions to WoW API
-    is approx 5 mins."""
+    is approx 5 mins. All waiting is done with uasyncio so that sensor
+    sampling carries on while a report is in progress. 'obs_time' (epoch
+    seconds) is the observation time for a report sent late from the
+    outbound queue; it defaults to now. 'retry_limit' is the number of
+    retries (default 'max_retries'). With 0 a single POST is made and not
+    repeated when the WiFi comes back, for a caller such as wow_queue that
+    keeps to the WoW interval with retries of its own."""
+    global failures
+    if retry_limit is None:
+        retry_limit = max_retries
+
+    if tempc is None:
+        print('No temperature or payload for transmission...')
+        return 'No temperature or payload for transmission...'
 
     print('preparing WoW report...')
-    data = dict()
-    wow_dtg = format_time(utime.localtime())
-    data["reportStartDateTime"] = wow_dtg
-    data["reportEndDateTime"] = wow_dtg
-    data["siteId"] = wow_site_id
-    data["siteAuthenticationKey"] = wow_auth_key
-    data["isPublic"] = "true"
-    data["isLatestVersion"] = "true"
-    data["dryBulbTemperature_Celsius"] = tempc
-    if max_tempc is not None:
-        data["airTemperatureMax_Celsius"] = max_tempc
-    if min_tempc is not None:
-        data["airTemperatureMin_Celsius"] = min_tempc
-    data["collectionName"] = 1
-    data["observationType"] = 1
-    data = json.dumps(data)
-    print(data)
-
-    headers = {
-        'Ocp-Apim-Subscription-Key': api_key,
-        'Content-Type': 'application/json'
-    }
+    data = build_payload(wow_site_id, wow_auth_key, tempc, max_tempc,
+                         min_tempc, obs_time)
+    if verbose:
+        print(bytes(data))
+
     # noinspection PyBroadException
     try:
-        if data and tempc is not None:
-            print('sending WoW...')
-            number_retries = 0
-            response = requests.post(wow_url, headers=headers, data=data)
-            print("sent (" + str(response.status_code) + "), status = " + str(
-                wlan.status()))
-            response.close()
-            # Retry the wow post if we don't get a 201 response
-            while response.status_code != 201 and number_retries < max_retries:
-                utime.sleep(delay)
-                response = requests.post(wow_url, headers=headers, data=data)
-                print('retrying wow transmission...')
-                number_retries += 1
-            return str(response.status_code)
+        print('sending WoW...')
+        return await post_with_retries(headers, data, retry_limit)
+    except Exception:
+        print('could not connect')
+
+    if retry_limit:
+        # Give the connection manager time to notice a lost link
+        await asyncio.sleep(delay)
+        if await wifi_manager.wait_ready(reconnect_wait):
+            # noinspection PyBroadException
+            try:
+                return await post_with_retries(headers, data, retry_limit)
+            except Exception:
+                pass
+    print('failed')
+    failures += 1
+    return 'WoW transmission failed'
+
+
+# The report is formatted into a preallocated buffer laid out as below.
+# Values are written in place: the date/times at the two DTG fields and each
+# temperature right aligned (space padded, which is valid JSON) in its
+# TEMP_WIDTH field. The optional max and min fields are at the end, so a
+# report without them is sent as a shorter view of the buffer with '}'
+# written over the comma before the first field left out. The site id and
+# auth key are JSON encoded, so any character in them gives a valid body.
+DTG = '0000-00-00T00:00:00+00:00'
+TEMP_WIDTH = 6
+_TEMPLATE = ('{{"reportStartDateTime":"{dtg}","reportEndDateTime":"{dtg}",'
+             '"siteId":{site},"siteAuthenticationKey":{auth},'
+             '"isPublic":"true","isLatestVersion":"true",'
+             '"collectionName":1,"observationType":1,'
+             '"dryBulbTemperature_Celsius":{temp},'
+             '"airTemperatureMax_Celsius":{temp},'
+             '"airTemperatureMin_Celsius":{temp}}}')
+
+_payload = None
+_payload_ids = None  # (site id, auth key) the buffer was built for
+_views = None  # Views of the buffer for (temp), (temp, max), (temp, max, min)
+_dtg_pos = None
+_temp_pos = None
+
+
+def init_payload(wow_site_id, wow_auth_key):
+    """Build the payload buffer and find the position of each field."""
+    global _payload, _payload_ids, _views, _dtg_pos, _temp_pos
+    # Positions are found in the encoded text, as they are byte offsets
+    text = _TEMPLATE.format(dtg=DTG, site=ujson.dumps(str(wow_site_id)),
+                            auth=ujson.dumps(str(wow_auth_key)),
+                            temp=' ' * TEMP_WIDTH).encode()
+    _payload = bytearray(text)
+    _payload_ids = (wow_site_id, wow_auth_key)
+    dtg = DTG.encode()
+    start = text.index(dtg)
+    _dtg_pos = (start, text.index(dtg, start + 1))
+    _temp_pos = tuple(text.index(b'":', text.index(key)) + 2 for key in (
+        b'"dryBulbTemperature', b'"airTemperatureMax', b'"airTemperatureMin'))
+    # The comma before each optional field becomes the closing brace
+    max_end = _temp_pos[1] - len('"airTemperatureMax_Celsius":') - 1
+    min_end = _temp_pos[2] - len('"airTemperatureMin_Celsius":') - 1
+    view = memoryview(_payload)
+    _views = (view[:max_end + 1], view[:min_end + 1], view)
+
+
+def _put_digits(pos, value, width):
+    """Write 'value' as 'width' zero padded digits at 'pos'."""
+    for i in range(pos + width - 1, pos - 1, -1):
+        _payload[i] = 0x30 + value % 10
+        value //= 10
+
+
+def _put_temp(pos, tempc):
+    """Write 'tempc' to one decimal place, right aligned in its field."""
+    tenths = int(tempc * 10 + (0.5 if tempc >= 0 else -0.5))
+    negative = tenths < 0
+    if negative:
+        tenths = -tenths
+    i = pos + TEMP_WIDTH - 1
+    _payload[i] = 0x30 + tenths % 10
+    _payload[i - 1] = 0x2E  # '.'
+    tenths //= 10
+    i -= 2
+    while True:
+        _payload[i] = 0x30 + tenths % 10
+        tenths //= 10
+        i -= 1
+        if not tenths or i < pos:
+            break
+    if negative and i >= pos:
+        _payload[i] = 0x2D  # '-'
+        i -= 1
+    while i >= pos:
+        _payload[i] = 0x20
+        i -= 1
+
+
+def _put_dtg(pos, tm):
+    _put_digits(pos, tm[0], 4)
+    _put_digits(pos + 5, tm[1], 2)
+    _put_digits(pos + 8, tm[2], 2)
+    _put_digits(pos + 11, tm[3], 2)
+    _put_digits(pos + 14, tm[4], 2)
+    _put_digits(pos + 17, tm[5], 2)
+
+
+def build_payload(wow_site_id, wow_auth_key, tempc, max_tempc=None,
+                  min_tempc=None, obs_time=None):
+    """Build the JSON report body for the WoW 'canonical' API and return it
+    as a memoryview of the payload buffer. Daily maximum and minimum
+    temperatures are only included if provided (a minimum is only sent
+    along with a maximum). The buffer is reused by the next call, so the
+    report must be sent before another is built."""
+    if _payload_ids != (wow_site_id, wow_auth_key):
+        init_payload(wow_site_id, wow_auth_key)
+    tm = utime.localtime(obs_time)
+    _put_dtg(_dtg_pos[0], tm)
+    _put_dtg(_dtg_pos[1], tm)
+    _put_temp(_temp_pos[0], tempc)
+    # Restore the separators that may have been overwritten with '}'
+    _payload[len(_views[0]) - 1] = 0x2C  # ','
+    _payload[len(_views[1]) - 1] = 0x2C
+    if max_tempc is None:
+        view = _views[0]
+    else:
+        _put_temp(_temp_pos[1], max_tempc)
+        if min_tempc is None:
+            view = _views[1]
         else:
-            print('No temperature or payload for transmission...')
-            return 'No temperature or payload for transmission...'
-    except:
-        print("could not connect (status =" + str(wlan.status()) + ")")
-        if wlan.status() < 0 or wlan.status() >= 3:
-            print("trying to reconnect...")
-            wlan.disconnect()
-            wlan.connect(ssid, password)
-            if wlan.status() == 3:
-                print('connected')
-                number_retries = 0
-                response = requests.post(wow_url, headers=headers, data=data)
-                print("sent (" + str(
-                    response.status_code) + "), status = " + str(
-                    wlan.status()))
-                response.close()
-                # Retry the wow post if we don't get a 201 response
-                while response.status_code != 201 and \
-                        number_retries < max_retries:
-                    utime.sleep(delay)
-                    response = requests.post(wow_url, headers=headers,
-                                             data=data)
-                    print('retrying wow transmission...')
-                    number_retries += 1
-                return str(response.status_code)
-            else:
-                print('failed')
-                return 'WoW transmission failed'
+            _put_temp(_temp_pos[2], min_tempc)
+            view = _views[2]
+    _payload[len(view) - 1] = 0x7D  # '}'
+    return view
 
 
 def format_time(utime_list):
     """Takes a Micro Python utime list with date/time members and constructs
     into a datetime string format acceptable to the WoW API."""
-    formatted_list = []
-    for item in utime_list:
-        if item < 10:
-            formatted_list.append('0' + str(item))
-        else:
-            formatted_list.append(str(item))
-    dtg = formatted_list[0] + '-' + (
-        formatted_list[1]) + '-' + (formatted_list[2]) + 'T' + (
-              formatted_list[3]) + ':' + (formatted_list[4]) + ':' + (
-              formatted_list[5]) + '+' + '00:00'
-    return dtg
+    return '{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}+00:00'.format(
+        *utime_list[:6])
@@ -0,0 +1,125 @@
+import socket
+import utime
+import uasyncio as asyncio
+import wifi_manager
+
+idle_timeout = 120  # close a connection unused for this long in seconds
+
+
+def _string(text):
+    """An MQTT string: its length (2 bytes) followed by the UTF-8 text."""
+    data = text.encode()
+    return bytes((len(data) >> 8, len(data) & 0xFF)) + data
+
+
+def _fixed_header(packet_type, length):
+    """The packet type byte followed by the remaining length, varint
+    encoded."""
+    header = bytearray((packet_type,))
+    while True:
+        byte = length & 0x7F
+        length >>= 7
+        header.append(byte | 0x80 if length else byte)
+        if not length:
+            return header
+
+
+class MQTTClient:
+    """Minimal MQTT 3.1.1 client for publishing to a broker over a
+    connection that is kept open between messages, as with http_client. At
+    QoS 1 publish() waits for the broker's acknowledgement. If the broker
+    has closed a kept-alive connection the message is sent again on a new
+    connection. No keepalive is asked for, so the broker doesn't expect
+    pings between messages."""
+
+    def __init__(self, host, port=1883, client_id='hmt333', user=None,
+                 password=None):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.user = user
+        self.password = password
+        self._reader = None
+        self._writer = None
+        self._last_used = 0
+        self._packet_id = 0
+        self.connects = 0
+        self.publishes = 0
+
+    async def _connect(self):
+        address = wifi_manager.resolve(self.host, self.port,
+                                       socket.SOCK_STREAM)[0]
+        try:
+            self._reader, self._writer = await asyncio.open_connection(
+                address, self.port)
+        except OSError:
+            wifi_manager.forget(self.host, self.port)
+            raise
+        flags = 0x02  # clean session
+        payload = _string(self.client_id)
+        if self.user:
+            flags |= 0x80
+            payload += _string(self.user)
+            if self.password:
+                flags |= 0x40
+                payload += _string(self.password)
+        # Protocol name and level, flags and a keepalive of 0 (none)
+        variable = _string('MQTT') + bytes((4, flags, 0, 0))
+        self._writer.write(_fixed_header(0x10, len(variable) + len(payload)))
+        self._writer.write(variable + payload)
+        await self._writer.drain()
+        connack = await self._reader.readexactly(4)
+        if connack[0] != 0x20 or connack[3] != 0:
+            raise OSError('MQTT connection refused (' + str(connack[3]) +
+                          ')')
+        self.connects += 1
+
+    def close(self):
+        """Close the connection, if open."""
+        if self._writer is not None:
+            try:
+                self._writer.write(b'\xe0\x00')  # DISCONNECT
+                self._writer.close()
+            except OSError:
+                pass
+        self._reader = self._writer = None
+
+    async def publish(self, topic, payload, qos=1):
+        """Publish 'payload' (any bytes-like object) to 'topic' at QoS 0
+        or 1. Raises OSError if it couldn't be sent or, at QoS 1, wasn't
+        acknowledged."""
+        if self._writer is not None and utime.time() - self._last_used > \
+                idle_timeout:
+            # The broker or a NAT router has probably dropped it by now
+            self.close()
+        header = _string(topic)
+        if qos:
+            self._packet_id = self._packet_id % 0xFFFF + 1
+            header += bytes((self._packet_id >> 8, self._packet_id & 0xFF))
+        for attempt in range(2):
+            reused = self._writer is not None
+            done = False
+            try:
+                if not reused:
+                    await self._connect()
+                self._writer.write(_fixed_header(
+                    0x30 | qos << 1, len(header) + len(payload)))
+                self._writer.write(header)
+                self._writer.write(payload)
+                await self._writer.drain()
+                if qos:
+                    puback = await self._reader.readexactly(4)
+                    if puback[0] != 0x40 or puback[2:] != header[-2:]:
+                        raise OSError('unexpected MQTT reply')
+                done = True
+            except (OSError, EOFError):
+                if not reused:
+                    raise
+                # Stale kept-alive connection - try again on a new one
+                continue
+            finally:
+                if not done:
+                    self.close()
+            self.publishes += 1
+            self._last_used = utime.time()
+            return
@@ -0,0 +1,130 @@
+from array import array
+import log
+
+# Plausible range of air temperatures (degrees C). Readings outside it are
+# rejected, e.g. stray digits in a corrupted UART line.
+min_valid = -40.0
+max_valid = 50.0
+# Largest believable rate of change between readings (degrees C per second)
+max_rate = 0.05
+# Smallest change the HMT reports (degrees C). A change of one step is
+# always allowed, with a margin for float rounding, however short the
+# interval between readings.
+resolution = 0.1
+# Largest difference from the mean of the last WINDOW accepted readings
+spike_limit = 3.0
+# Number of consecutive rejected readings, all within 'step_tolerance' of
+# each other, taken as a genuine step change rather than spikes
+step_samples = 3
+step_tolerance = 0.5
+# Time the readings can stay exactly the same before the sensor is treated
+# as stuck (seconds, 0 to never)
+flatline_time = 7200
+# After a longer break in the readings the recent history is forgotten
+# (seconds)
+max_gap = 900
+
+WINDOW = 5
+
+# Reasons returned by QC.check() for a rejected reading
+RANGE = b'range'
+RATE = b'rate'
+SPIKE = b'spike'
+FLATLINE = b'flatline'
+
+_line = log.Line()
+
+
+class QC:
+    """Streaming quality control of one sensor's readings: range, rate of
+    change, spike, step and flatline checks against a small window of the
+    recently accepted readings. Each check takes constant time and memory
+    use is fixed."""
+
+    def __init__(self):
+        self._window = array('f', (0.0 for _ in range(WINDOW)))
+        self._n = 0  # readings in the window
+        self._next = 0  # window slot for the next accepted reading
+        self._last = 0.0  # last accepted reading and its time
+        self._last_time = 0
+        self._flat_since = 0  # time the readings stopped changing
+        self._pending = 0  # consecutive readings rejected as rate/spike
+        self._pending_temp = 0.0
+        self.accepted = 0
+        self.range_errors = 0
+        self.rate_errors = 0
+        self.spikes = 0
+        self.flatlines = 0
+        self.steps = 0
+
+    def _restart(self, obs_time, temp):
+        self._n = 0
+        self._next = 0
+        self._accept(obs_time, temp)
+
+    def _accept(self, obs_time, temp):
+        if self._n == 0 or temp != self._last:
+            self._flat_since = obs_time
+        self._window[self._next] = temp
+        self._next = (self._next + 1) % WINDOW
+        if self._n < WINDOW:
+            self._n += 1
+        self._last = temp
+        self._last_time = obs_time
+        self._pending = 0
+        self.accepted += 1
+
+    def _mean(self):
+        total = 0.0
+        for i in range(self._n):
+            total += self._window[i]
+        return total / self._n
+
+    def check(self, obs_time, temp):
+        """Check the reading 'temp' taken at 'obs_time' (epoch seconds).
+        Returns None if it's accepted, otherwise the reason it was rejected
+        (RANGE, RATE, SPIKE or FLATLINE)."""
+        if temp < min_valid or temp > max_valid:
+            self.range_errors += 1
+            return RANGE
+        if self._n == 0 or obs_time - self._last_time > max_gap:
+            self._restart(obs_time, temp)
+            return None
+        interval = obs_time - self._last_time
+        if interval < 1:
+            interval = 1
+        if abs(temp - self._last) > \
+                max(max_rate * interval, resolution) + resolution / 10:
+            reason = RATE
+        elif abs(temp - self._mean()) > spike_limit:
+            reason = SPIKE
+        else:
+            reason = None
+        if reason is not None:
+            # A run of similar rejected readings is a real change in level
+            if self._pending and \
+                    abs(temp - self._pending_temp) <= step_tolerance:
+                self._pending += 1
+            else:
+                self._pending = 1
+                self._pending_temp = temp
+            if self._pending >= step_samples:
+                if log.level >= log.INFO:
+                    _line.start(b'QC: step change from ')
+                    _line.add_temp(self._last).add(b' to ').add_temp(temp)
+                    _line.write()
+                self.steps += 1
+                self._restart(obs_time, temp)
+                return None
+            if reason is RATE:
+                self.rate_errors += 1
+            else:
+                self.spikes += 1
+            return reason
+        if flatline_time and temp == self._last and \
+                obs_time - self._flat_since >= flatline_time:
+            self.flatlines += 1
+            self._last_time = obs_time
+            return FLATLINE
+        self._accept(obs_time, temp)
+        return None
@@ -1,82 +1,442 @@
-import re
-import calibration
+import utime
+import uasyncio as asyncio
+import aggregator
+import cal_table
+import qc
+import config
+import stats
 from machine import UART, Pin
 
-# Sensor corrections
-corr50 = float(calibration.CORRECTIONS['CORR+50'])
-corr40 = float(calibration.CORRECTIONS['CORR+40'])
-corr30 = float(calibration.CORRECTIONS['CORR+30'])
-corr20 = float(calibration.CORRECTIONS['CORR+20'])
-corr10 = float(calibration.CORRECTIONS['CORR+10'])
-corr0 = float(calibration.CORRECTIONS['CORR+0'])
-corrM10 = float(calibration.CORRECTIONS['CORR-10'])
-corrM20 = float(calibration.CORRECTIONS['CORR-20'])
-corrM30 = float(calibration.CORRECTIONS['CORR-30'])
-
-# HMT sensor UART port setup
-# noinspection PyArgumentList
-uart = UART(0, 4800, parity=None, stop=1, bits=8, rx=Pin(1), tx=Pin(0),
-            timeout=5000)
-
-# Regular expression pattern to match a float or integer number: T= 19.5 'C
-pattern = r"[-+]?\d*\.\d+|\d+"
-
-
-def get_hmt_temp():
-    """Request the latest HMT temperature reading from the instrument by
-    writing 'send' to the connected UART port. HMT responds with the following
-    format: T= 19.5 'C. Note that the HMT must be in 'STOP' mode and 'echo off'
-    as well as Serial Interface parameters set to match those above or the
-    radio unit to which it is connected."""
-    try:
-        temp = None
-        uart.write(bytearray(b'send\r\n'))
-        dataline = uart.readline()
-        # dataline = 'T= 19.5 C'
-        if dataline is not None:
-            match = re.search(pattern, dataline)
-            if match:
-                raw_temp = round(float(match.group(0)), 1)
-                temp = apply_calibration(raw_temp)
+# HMT sensors to poll, the first being the one reported to WoW. Each entry
+# is (name, UART id, baud rate, tx pin, rx pin, RS-485 address). Each
+# sensor's calibration corrections are kept in config.json under its name.
+# The address is None for an HMT on its own UART, polled with 'send'.
+# Several HMTs with RS-485 modules can share a UART, each with its own
+# address, and are polled with 'SEND <address>'. UART1 is the console port
+# in main.py, so a sensor on UART1 disables the console.
+SENSORS = (
+    ('hmt', 0, 4800, 0, 1, None),
+)
+# Driver enable pin for each RS-485 UART whose transceiver doesn't switch
+# direction by itself, e.g. {1: 6}
+DE_PINS = {}
+
+# Time allowed for the HMT to respond to each 'send' request (milliseconds)
+response_timeout = 2000
+# Number of further requests made after a failed attempt
+max_retries = 2
+# How often the UART is checked for new bytes while waiting (milliseconds)
+poll_interval = 20
+# Consecutive failed requests after which the sensor is reported unhealthy
+unhealthy_after = 3
+
+# In RUN mode the HMT outputs a reading every 'run_interval' seconds without
+# being asked, so the sensor can be sampled at its own rate. In STOP mode
+# (the default) each reading is requested with 'send'. RUN mode isn't used
+# for addressed sensors, as they would talk over each other on the bus.
+run_mode = False
+run_interval = 10
+
+SEND = b'send\r\n'
+
+# Request states
+IDLE = 0  # No request in progress
+REQUEST_SENT = 1  # 'send' written, no response bytes yet
+AWAITING = 2  # Response bytes arriving, frame not complete
+PARSED = 3  # Calibrated temperature available from result()
+TIMED_OUT = 4  # All attempts failed
+QUEUED = 5  # Waiting for another sensor on the same bus to finish
+
+
+def parse_temp(buf, end):
+    """Extract the temperature from a frame in the form T= 19.5 'C held in
+    buf[0:end] without regex or intermediate objects. Returns the value in
+    degrees C or None if the frame doesn't contain a temperature."""
+    # Find the '=' following the 'T' parameter name
+    i = 0
+    while i < end and buf[i] != 0x3D:  # '='
+        i += 1
+    j = i - 1
+    while j >= 0 and buf[j] == 0x20:  # ' '
+        j -= 1
+    if i >= end or j < 0 or buf[j] != 0x54:  # 'T'
+        return None
+    i += 1
+    while i < end and buf[i] == 0x20:
+        i += 1
+    negative = False
+    if i < end and (buf[i] == 0x2D or buf[i] == 0x2B):  # '-' or '+'
+        negative = buf[i] == 0x2D
+        i += 1
+    # Accumulate the value as an integer count of tenths of a degree
+    tenths = 0
+    digits = 0
+    decimals = -1
+    while i < end:
+        c = buf[i]
+        if 0x30 <= c <= 0x39:  # '0' - '9'
+            if decimals < 1:
+                tenths = tenths * 10 + c - 0x30
+            elif decimals == 1 and c >= 0x35:
+                # Round on the hundredths digit
+                tenths += 1
+            if decimals >= 0:
+                decimals += 1
+            digits += 1
+        elif c == 0x2E and decimals < 0:  # '.'
+            decimals = 0
         else:
-            temp = None
-            print('retrying get HMT temp...')
-            get_hmt_temp()
+            break
+        i += 1
+    if digits == 0:
+        return None
+    if decimals <= 0:
+        tenths *= 10
+    return (-tenths if negative else tenths) / 10
+
 
+class Bus:
+    """A UART with one or more HMTs on it. Received bytes are collected in a
+    preallocated buffer until a complete line (frame) has arrived, so
+    reading a sensor doesn't allocate. Only one request can be in progress
+    on a bus at a time, so sensors sharing an RS-485 bus take turns."""
+
+    def __init__(self, uart, de=None):
+        self.uart = uart
+        self.de = de
+        self.owner = None  # sensor with a request in progress
+        self._frame = bytearray(32)
+        self._frame_len = 0
+        self._carried = False  # frame buffer holds bytes left from a read
+        self._rx = bytearray(16)
+
+    def write(self, data):
+        if self.de is not None:
+            self.de.on()
+        self.uart.write(data)
+        if self.de is not None:
+            # Release the bus once the last byte has gone
+            self.uart.flush()
+            self.de.off()
+
+    def read_frame(self):
+        """Move any bytes waiting on the UART into the frame buffer. When a
+        complete line has arrived return the temperature parsed from it
+        (None if it doesn't hold a valid reading), otherwise return False.
+        Bytes following the line are kept for the next frame, and a complete
+        line among them is returned before the UART is read again."""
+        uart = self.uart
+        frame = self._frame
+        rx = self._rx
+        if self._carried:
+            self._carried = False
+            for k in range(self._frame_len):
+                if frame[k] == 0x0A:
+                    return self._split(k)
+        available = uart.any()
+        while available:
+            n = uart.readinto(rx, min(available, len(rx)))
+            if not n:
+                break
+            available -= n
+            for k in range(n):
+                c = rx[k]
+                if c == 0x0A:  # '\n' ends the frame
+                    stats.parse.start()
+                    temp = parse_temp(frame, self._frame_len)
+                    stats.parse.stop()
+                    # Keep the rest of the received bytes for the next frame
+                    rest = n - k - 1
+                    for m in range(rest):
+                        frame[m] = rx[k + 1 + m]
+                    self._frame_len = rest
+                    self._carried = rest > 0
+                    return temp
+                if self._frame_len < len(frame):
+                    frame[self._frame_len] = c
+                    self._frame_len += 1
+                else:
+                    # Overlong line - discard it and start again
+                    self._frame_len = 0
+        return False
+
+    def _split(self, end):
+        """Parse the line ending at frame[end] from the carried over bytes
+        and move the bytes after it to the start of the frame buffer."""
+        frame = self._frame
+        stats.parse.start()
+        temp = parse_temp(frame, end)
+        stats.parse.stop()
+        rest = self._frame_len - end - 1
+        for m in range(rest):
+            frame[m] = frame[end + 1 + m]
+        self._frame_len = rest
+        self._carried = rest > 0
         return temp
 
-    except OSError:
-        print('error reading from HMT - retrying...')
-        get_hmt_temp()
-        pass
-
-
-def apply_calibration(temp):
-    """
-    Apply the correct instrument calibration adjustment to the
-    as read temperature. Calibration coefficients are provided for on the
-    instrument calibration certificate for temperatures of -30/-20/-10/0
-    /10/20/30/40/50 deg C.
-    :param temp: The 'as read' temperature in degrees C from the HMT333
-    :return: The 'as read' temperature plus the most appropriate
-    instrument calibration coefficient (degrees C).
-    """
-    if temp >= 45:
-        temp = temp + corr50
-    elif temp >= 35:
-        temp = temp + corr40
-    elif temp >= 25:
-        temp = temp + corr30
-    elif temp >= 15:
-        temp = temp + corr20
-    elif temp >= 5:
-        temp = temp + corr10
-    elif temp >= -5:
-        temp = temp + corr0
-    elif temp >= -15:
-        temp = temp + corrM10
-    elif temp >= -25:
-        temp = temp + corrM20
-    else:
-        temp = temp + corrM30
-    return temp
+    def flush(self):
+        """Discard any partial or stale frames."""
+        while self.uart.any():
+            self.uart.readinto(self._rx, min(self.uart.any(), len(self._rx)))
+        self._frame_len = 0
+        self._carried = False
+
+
+class HMT:
+    """One HMT333 on a bus, with its own calibration table, request state
+    machine, health counters and daily max/min state. A request is started
+    with start_request() and advanced without blocking by calling tick()
+    until busy() is False."""
+
+    def __init__(self, name, bus, table, address=None):
+        self.name = name
+        self.label = name.encode()  # for log lines
+        self.bus = bus
+        self.cal = table
+        self.address = address
+        self.run_mode = run_mode and address is None
+        if address is None:
+            self._request = SEND
+        else:
+            self._request = 'SEND {}\r\n'.format(address).encode()
+        self.state = IDLE
+        self._deadline = 0
+        self._attempt = 0
+        self._started = 0
+        self._temp = None
+
+        # Health counters
+        self.reads_ok = 0
+        self.timeouts = 0  # Attempts with no complete response in time
+        self.invalid_frames = 0  # Responses without a valid temperature
+        self.retries = 0
+        self.failures = 0  # Requests where every attempt failed
+        self.consecutive_failures = 0
+
+        # Readings in the current minute, and the 1-minute mean temperature
+        # and daily max/min taken from them
+        self.minute = aggregator.Aggregator()
+        self.qc = qc.QC()  # checks each reading before it's aggregated
+        self.sample_minute = None
+        self.temp = None
+        self.temp_time = None  # end of the minute 'temp' is the mean for
+        self.max_temp = None
+        self.min_temp = None
+        self.count = 0
+
+    def start_run_mode(self):
+        """Put the HMT into RUN mode, outputting a reading every
+        'run_interval' seconds."""
+        if self.run_mode:
+            self.bus.write('INTV {} s\r\n'.format(run_interval))
+            self.bus.write(b'R\r\n')
+
+    def stop_run_mode(self):
+        """Put the HMT into STOP mode, where it outputs a reading only when
+        polled with 'send'."""
+        self.bus.write(b'S\r\n')
+
+    def busy(self):
+        return self.state == QUEUED or self.state == REQUEST_SENT or \
+            self.state == AWAITING
+
+    def _send(self):
+        """Start a new attempt at the current request."""
+        if self.run_mode:
+            # Wait for the next frame the HMT outputs
+            timeout = run_interval * 1000 + response_timeout
+            self.state = AWAITING
+        else:
+            timeout = response_timeout
+            self.bus.flush()
+            self.bus.write(self._request)
+            self.state = REQUEST_SENT
+        self._deadline = utime.ticks_add(utime.ticks_ms(), timeout)
+
+    def _finish(self, state):
+        self.state = state
+        self.bus.owner = None
+
+    def _attempt_failed(self):
+        """Retry the request if there are attempts left, otherwise give
+        up."""
+        if self._attempt < max_retries:
+            self._attempt += 1
+            self.retries += 1
+            self._send()
+        else:
+            self._finish(TIMED_OUT)
+            self.failures += 1
+            self.consecutive_failures += 1
+
+    def start_request(self):
+        """Start a new temperature request unless one is already in
+        progress. If another sensor on the bus is being read, the request
+        is queued until it has finished."""
+        if self.busy():
+            return
+        self._attempt = 0
+        self._temp = None
+        self._started = utime.ticks_us()
+        if self.bus.owner is not None:
+            self.state = QUEUED
+            return
+        self.bus.owner = self
+        if self.run_mode:
+            # Use the newest complete frame if several have queued up
+            frame = self.bus.read_frame()
+            while frame is not False:
+                if frame is not None:
+                    self._temp = frame
+                frame = self.bus.read_frame()
+            if self._temp is not None:
+                self._parsed(self._temp)
+                return
+        self._send()
+
+    def _parsed(self, raw_temp):
+        stats.hmt.add(utime.ticks_diff(utime.ticks_us(), self._started))
+        stats.calibrate.start()
+        self._temp = self.apply_calibration(raw_temp)
+        stats.calibrate.stop()
+        self._finish(PARSED)
+        self.reads_ok += 1
+        self.consecutive_failures = 0
+
+    def tick(self):
+        """Advance the current request without blocking and return its
+        state. Call this regularly until busy() is False."""
+        state = self.state
+        if state == QUEUED:
+            if self.bus.owner is not None:
+                return state
+            self.bus.owner = self
+            self._send()
+            return self.state
+        if state != REQUEST_SENT and state != AWAITING:
+            return state
+        try:
+            if state == REQUEST_SENT and self.bus.uart.any():
+                self.state = AWAITING
+            if self.state == AWAITING:
+                frame = self.bus.read_frame()
+                if frame is None:
+                    print('invalid response from ' + self.name + '...')
+                    self.invalid_frames += 1
+                    if not self.run_mode:
+                        self._attempt_failed()
+                    return self.state
+                if frame is not False:
+                    self._parsed(frame)
+                    return self.state
+            if utime.ticks_diff(utime.ticks_ms(), self._deadline) >= 0:
+                print('no response from ' + self.name + '...')
+                self.timeouts += 1
+                self._attempt_failed()
+        except OSError:
+            print('error reading from ' + self.name + '...')
+            self._attempt_failed()
+        return self.state
+
+    def result(self):
+        """The calibrated temperature from the last request, or None if it
+        failed or hasn't finished."""
+        return self._temp if self.state == PARSED else None
+
+    def healthy(self):
+        """False once 'unhealthy_after' requests in a row have failed."""
+        return self.consecutive_failures < unhealthy_after
+
+    async def get_temp(self):
+        """Read this HMT on its own. Returns the calibrated temperature, or
+        None if every attempt fails."""
+        self.start_request()
+        self.tick()
+        while self.busy():
+            await asyncio.sleep_ms(poll_interval)
+            self.tick()
+        return self.result()
+
+    def apply_calibration(self, temp):
+        """
+        Apply the correct instrument calibration adjustment to the
+        as read temperature. Calibration coefficients are provided for on
+        the instrument calibration certificate for temperatures of
+        -30/-20/-10/0/10/20/30/40/50 deg C and interpolated linearly between
+        those points.
+        :param temp: The 'as read' temperature in degrees C from the HMT333
+        :return: The 'as read' temperature plus the interpolated instrument
+        calibration coefficient (degrees C).
+        """
+        return cal_table.apply(self.cal, temp)
+
+
+def _make_sensors():
+    buses = {}
+    made = []
+    for name, uart_id, baud, tx, rx, address in SENSORS:
+        if uart_id not in buses:
+            # noinspection PyArgumentList
+            uart = UART(uart_id, baud, parity=None, stop=1, bits=8,
+                        rx=Pin(rx), tx=Pin(tx), timeout=5000)
+            de = DE_PINS.get(uart_id)
+            if de is not None:
+                de = Pin(de, Pin.OUT, value=0)
+            buses[uart_id] = Bus(uart, de)
+        made.append(HMT(name, buses[uart_id],
+                        cal_table.load(config.corrections(name)), address))
+    return buses, made
+
+
+_buses, sensors = _make_sensors()
+sensor = sensors[0]  # The sensor reported to WoW
+
+
+def uses_uart(uart_id):
+    """True if a sensor is on UART 'uart_id'."""
+    return uart_id in _buses
+
+
+def start_run_mode():
+    """Put every sensor that can into RUN mode."""
+    for hmt in sensors:
+        hmt.start_run_mode()
+
+
+def start_requests():
+    for hmt in sensors:
+        hmt.start_request()
+
+
+def tick_all():
+    """Advance every sensor's request. Returns True while any is busy."""
+    busy = False
+    for hmt in sensors:
+        hmt.tick()
+        if hmt.busy():
+            busy = True
+    return busy
+
+
+async def read_all():
+    """Read every sensor. Requests on separate UARTs are in progress at the
+    same time, and on a shared RS-485 bus each request is sent as soon as
+    the previous sensor has answered, so a reading of all the sensors takes
+    little longer than the slowest bus. Other tasks keep running while we
+    wait for the responses. Each sensor's temperature is then available
+    from its result() (None if every attempt failed).
+
+    The HMT responds to 'send' in the form T= 19.5 'C. Note that the HMT
+    must be in 'echo off' as well as Serial Interface parameters set to
+    match those above or the radio unit to which it is connected. In RUN
+    mode the most recent frame output by the HMT is used, waiting for the
+    next one if none has arrived since the last call."""
+    start_requests()
+    while tick_all():
+        await asyncio.sleep_ms(poll_interval)
+
+
+async def get_hmt_temp():
+    """Get the latest calibrated temperature from the main sensor, or None
+    if every attempt fails."""
+    return await sensor.get_temp()
@@ -0,0 +1,97 @@
+import utime
+import archive
+import log
+import read_hmt
+import stats
+import temps_file
+
+# The steady-state path taken by every reading. It is written not to
+# allocate: log lines are formatted in a preallocated buffer and only when
+# the log level asks for them, and the journal and archive are written from
+# their own buffers (host/alloc_check.py checks this).
+
+primary = read_hmt.sensor  # its 1-minute means are saved and archived
+dated = True  # the RTC is right, so the means can be saved and archived
+_line = log.Line()
+
+
+def close_minute(hmt):
+    """Take the mean of the last minute's readings from 'hmt' as its
+    current temperature and update its running max/min temperatures with
+    it."""
+    minute = hmt.minute
+    hmt.temp = round(minute.mean, 1)
+    hmt.temp_time = (hmt.sample_minute + 1) * 60
+    hmt.count += 1
+    if hmt.max_temp is None or hmt.temp > hmt.max_temp:
+        hmt.max_temp = hmt.temp
+    if hmt.min_temp is None or hmt.temp < hmt.min_temp:
+        hmt.min_temp = hmt.temp
+    if log.level >= log.INFO:
+        _line.start().add_time(hmt.temp_time).add(b' ').add(hmt.label)
+        _line.add(b' Readings:').add_int(hmt.count)
+        _line.add(b' Temp:').add_temp(hmt.temp)
+        _line.add(b' Max:').add_temp(hmt.max_temp)
+        _line.add(b' Min:').add_temp(hmt.min_temp)
+        _line.add(b' (').add_int(minute.n).add(b' samples, range ')
+        _line.add_temp(minute.min).add(b' to ').add_temp(minute.max)
+        _line.add(b')').write()
+    minute.reset()
+    if hmt is primary:
+        stats.collect()
+        if log.level >= log.DEBUG and stats.heap_free is not None:
+            _line.start(b'MEM free: ').add_int(stats.heap_free).write()
+        if dated:
+            temps_file.save_temps(hmt.max_temp, hmt.min_temp, hmt.count,
+                                  hmt.temp)
+            archive.append(hmt.temp_time, hmt.temp)
+
+
+def add_reading(hmt, obs_time, reading):
+    """Add a calibrated reading from 'hmt' taken at 'obs_time' (epoch
+    seconds) to its current minute, closing the previous minute first if it
+    hasn't been closed already. Readings failing the QC checks are counted
+    and left out."""
+    reason = hmt.qc.check(obs_time, reading)
+    if reason is not None:
+        if log.level >= log.INFO:
+            _line.start(b'QC: ').add(hmt.label).add(b' ').add_temp(reading)
+            _line.add(b' rejected (').add(reason).add(b')').write()
+        return
+    this_minute = obs_time // 60
+    if this_minute != hmt.sample_minute:
+        if hmt.minute.n:
+            close_minute(hmt)
+        hmt.sample_minute = this_minute
+    elif not hmt.minute.n and hmt.temp_time == (this_minute + 1) * 60:
+        # A late reading (e.g. from core 1) of a minute already closed
+        return
+    hmt.minute.add(reading)
+
+
+def close_minutes(now):
+    """Close the current minute of every sensor if it has ended by 'now'
+    (epoch seconds), so the latest minute is in the temperatures and
+    max/min even before the next reading, or if the sensor stops
+    answering."""
+    this_minute = now // 60
+    for hmt in read_hmt.sensors:
+        if hmt.minute.n and hmt.sample_minute != this_minute:
+            close_minute(hmt)
+
+
+def record_readings():
+    """Add the results of the last read_hmt request to each sensor's
+    current minute."""
+    obs_time = utime.time()
+    for hmt in read_hmt.sensors:
+        reading = hmt.result()
+        if log.level >= log.DEBUG:
+            _line.start().add(hmt.label).add(b' Temp = ').add_temp(reading)
+            _line.write()
+        if not hmt.healthy():
+            _line.start().add(hmt.label).add(b' not responding (')
+            _line.add_int(hmt.consecutive_failures).add(b' failures)')
+            _line.write()
+        if reading is not None:
+            add_reading(hmt, obs_time, reading)
@@ -0,0 +1,112 @@
+import utime
+import machine
+import uasyncio as asyncio
+
+HOUR = 3600
+DAY = 86400
+LATE = 60  # A job starting this many seconds after its deadline is 'late'
+STEP = 5  # An RTC change this many seconds off the tick count is a step
+
+
+def every(seconds):
+    """Deadline function for a job run every 'seconds' seconds, aligned to
+    multiples of 'seconds' since the epoch."""
+    return lambda now: now - now % seconds + seconds
+
+
+def hourly_at(minute):
+    """Deadline function for a job run at 'minute' past every hour."""
+    def next_due(now):
+        due = now - now % HOUR + minute * 60
+        return due if due > now else due + HOUR
+    return next_due
+
+
+def daily_at(hour, minute=0):
+    """Deadline function for a job run once a day at hour:minute UTC."""
+    def next_due(now):
+        due = now - now % DAY + hour * HOUR + minute * 60
+        return due if due > now else due + DAY
+    return next_due
+
+
+class Scheduler:
+    """Runs async jobs at absolute RTC deadlines (epoch seconds). After each
+    job its next deadline is worked out from the time it finished, so a
+    deadline missed while the device was busy (e.g. a slow WoW POST) is run
+    as soon as possible rather than skipped. If the RTC is stepped (by NTP
+    or when it is restored) the deadlines are worked out again from the new
+    time, and only a job that was already overdue before the step is run
+    straight away. Between deadlines the scheduler either awaits, letting
+    other tasks run, or in low power mode puts the whole device into
+    machine.lightsleep until the next deadline. The time spent awake and
+    asleep is counted so the average power use can be estimated."""
+
+    def __init__(self, low_power=False):
+        self.low_power = low_power
+        self.jobs = []
+        self.awake_ms = 0
+        self.asleep_ms = 0
+        self.late_runs = 0
+        self._rtc = 0  # RTC time and tick count when the clock was last
+        self._ticks = 0  # checked for a step
+
+    def add(self, name, next_due, action):
+        """Add a job. 'next_due' is called with the current time and returns
+        the job's next deadline, 'action' is a coroutine function."""
+        self.jobs.append([name, next_due, action, next_due(utime.time())])
+
+    def duty_cycle(self):
+        """Fraction of the time the device has been awake."""
+        total = self.awake_ms + self.asleep_ms
+        return self.awake_ms / total if total else 1.0
+
+    def _check_step(self):
+        """Return the current time, first moving the deadlines if the RTC
+        has been stepped since the last check."""
+        now = utime.time()
+        ticks = utime.ticks_ms()
+        step = now - self._rtc - utime.ticks_diff(ticks, self._ticks) // 1000
+        self._rtc = now
+        self._ticks = ticks
+        if abs(step) >= STEP:
+            print('Clock stepped by ' + str(step) + 's - rescheduling')
+            for job in self.jobs:
+                if job[3] + step > now:
+                    job[3] = job[1](now)
+                else:
+                    # Overdue before the step, i.e. missed while busy
+                    job[3] += step
+        return now
+
+    async def run(self):
+        # The clock may have been set since the jobs were added
+        now = utime.time()
+        self._rtc = now
+        self._ticks = utime.ticks_ms()
+        for job in self.jobs:
+            job[3] = job[1](now)
+        while True:
+            woke = utime.ticks_ms()
+            for job in self.jobs:
+                now = self._check_step()
+                if now >= job[3]:
+                    if now - job[3] >= LATE:
+                        self.late_runs += 1
+                        print(job[0] + ' job running late')
+                    await job[2]()
+                    job[3] = job[1](utime.time())
+            self._check_step()
+            next_due = self.jobs[0][3]
+            for job in self.jobs:
+                if job[3] < next_due:
+                    next_due = job[3]
+            wait = (next_due - utime.time()) * 1000
+            self.awake_ms += utime.ticks_diff(utime.ticks_ms(), woke)
+            if wait <= 0:
+                continue
+            if self.low_power:
+                machine.lightsleep(wait)
+                self.asleep_ms += wait
+            else:
+                await asyncio.sleep_ms(wait)
@@ -1,7 +0,0 @@
-SETTINGS = {
-    'WIFI-PASSWORD': '',
-    'WOW_SITE_ID': '',
-    'SSID': '',
-    'WOW_AUTH_KEY': '',
-    'REPORTING_SCHED': '3'
-}
@@ -0,0 +1,261 @@
+import utime
+import uasyncio as asyncio
+from array import array
+import config
+import http_client
+import log
+import mqtt_client
+import wifi_manager
+import wow_queue
+
+# Each report of the main sensor is published to every sink: WoW, and the
+# MQTT broker (MQTT_BROKER) and HTTP endpoint (HTTP_SINK_URL) if set. The
+# observation is encoded once, as an InfluxDB line protocol record, e.g.
+#   temperature,sensor=hmt temp=12.3,max=15.1,min=4.2 1717232400000000000
+# and copied into the queue of each sink. Each sink sends from its queue
+# in a task of its own, with its own rate limit and retries, so a slow or
+# unreachable destination never holds up the others or sampling. WoW has
+# an API of its own, so its sink keeps the flash-backed queue of
+# wow_queue.py.
+MEASUREMENT = b'temperature'
+QUEUE_SIZE = 32  # records queued by each sink, the oldest dropped if full
+RECORD_SIZE = log.MAX_LINE  # longest record
+
+sinks = []
+_sensor = b'hmt'  # label of the sensor the observations are of
+_record = log.Line()  # the encoded record of the latest observation
+
+
+def encode(sensor, obs_time, tempc, max_tempc=None, min_tempc=None):
+    """Encode an observation of the sensor labelled 'sensor' (bytes) as a
+    line protocol record and return it as a view of a shared buffer,
+    reused by the next call."""
+    line = _record.start(MEASUREMENT).add(b',sensor=').add(sensor)
+    line.add(b' temp=').add_temp(tempc)
+    if max_tempc is not None:
+        line.add(b',max=').add_temp(max_tempc)
+    if min_tempc is not None:
+        line.add(b',min=').add_temp(min_tempc)
+    # Nanoseconds, the default precision of line protocol
+    line.add(b' ').add_int(obs_time).add(b'000000000')
+    return line.view()
+
+
+class Sink:
+    """A destination for the encoded records, with a fixed-size queue of
+    its own. A failed send is retried after 'retry_wait' seconds, doubling
+    for each failure in a row up to 'max_retry_wait', and a record is
+    dropped after 'max_attempts' failed sends. Sends are spaced at least
+    'min_interval' seconds apart. Subclasses provide send()."""
+
+    min_interval = 0
+    retry_wait = 30
+    max_retry_wait = 1800
+    max_attempts = 10
+    timeout = 30  # time allowed for a single send in seconds
+
+    def __init__(self, name, queue_size=QUEUE_SIZE):
+        self.name = name
+        self._queue = bytearray(queue_size * RECORD_SIZE)
+        view = memoryview(self._queue)
+        self._slots = tuple(view[i * RECORD_SIZE:(i + 1) * RECORD_SIZE]
+                            for i in range(queue_size))
+        self._lengths = array('H', (0 for _ in range(queue_size)))
+        self._head = 0
+        self._wake = asyncio.Event()
+        self._last_sent = None  # ticks_ms of the last send
+        self._failed = 0  # failed sends of the oldest record in a row
+        self._sending = False  # the oldest record is being sent
+        self.count = 0  # records queued
+        self.sent = 0
+        self.failures = 0  # failed sends
+        self.dropped = 0  # records dropped, unsent or rejected
+
+    async def send(self, record):
+        """Send 'record' (a memoryview). Returns True once it has been
+        accepted, False to retry it later or None if it was rejected and
+        shouldn't be retried. Raising an exception is a failed send."""
+        raise NotImplementedError
+
+    def put(self, record, observation):
+        """Add 'record' to the end of the queue, dropping the oldest record
+        if the queue is full (or this one, if the oldest is being sent).
+        'observation' is (obs_time, temp, max temp, min temp) for sinks with
+        an encoding of their own."""
+        size = len(self._slots)
+        if self.count == size:
+            self.dropped += 1
+            print(self.name + ' queue full - record dropped')
+            if self._sending:
+                return
+            self._head = (self._head + 1) % size
+            self._failed = 0
+        else:
+            self.count += 1
+        slot = (self._head + self.count - 1) % size
+        n = min(len(record), RECORD_SIZE)
+        self._slots[slot][:n] = record[:n]
+        self._lengths[slot] = n
+        self._wake.set()
+
+    def _pop(self):
+        self._head = (self._head + 1) % len(self._slots)
+        self.count -= 1
+        self._failed = 0
+
+    def _wait_ms(self):
+        """Time until the next send is allowed in milliseconds."""
+        if self._last_sent is None:
+            return 0
+        if self._failed:
+            interval = min(self.retry_wait << (self._failed - 1),
+                           self.max_retry_wait)
+        else:
+            interval = self.min_interval
+        return interval * 1000 - utime.ticks_diff(utime.ticks_ms(),
+                                                  self._last_sent)
+
+    async def send_next(self):
+        """Send the oldest queued record if the WiFi is connected and the
+        rate limit and retry wait allow. Returns the send() result, or
+        None if nothing was sent."""
+        if not self.count or not wifi_manager.ready() or \
+                self._wait_ms() > 0:
+            return None
+        record = self._slots[self._head][:self._lengths[self._head]]
+        self._sending = True
+        # noinspection PyBroadException
+        try:
+            result = await asyncio.wait_for(self.send(record), self.timeout)
+        except Exception as exc:
+            print(self.name + ' send failed: ' + repr(exc))
+            result = False
+        self._sending = False
+        self._last_sent = utime.ticks_ms()
+        if result:
+            self.sent += 1
+            self._pop()
+        elif result is None:
+            print(self.name + ' rejected a record - dropped')
+            self.dropped += 1
+            self._pop()
+        else:
+            self.failures += 1
+            self._failed += 1
+            if self._failed >= self.max_attempts:
+                print(self.name + ' send failed ' + str(self._failed) +
+                      ' times - record dropped')
+                self.dropped += 1
+                self._pop()
+        return result
+
+    async def run(self):
+        """Background task sending the queued records, oldest first."""
+        while True:
+            if not self.count:
+                self._wake.clear()
+                await self._wake.wait()
+            elif not wifi_manager.ready():
+                await wifi_manager.wait_ready()
+            elif self._wait_ms() > 0:
+                await asyncio.sleep_ms(self._wait_ms())
+            else:
+                await self.send_next()
+
+
+class MQTTSink(Sink):
+    """Publishes each record to 'topic' on an MQTT broker at QoS 1."""
+
+    def __init__(self, broker, topic, user=None, password=None,
+                 client_id='hmt333'):
+        super().__init__('mqtt')
+        host, _, port = broker.partition(':')
+        self.client = mqtt_client.MQTTClient(host, int(port or 1883),
+                                             client_id, user, password)
+        self.topic = topic
+
+    async def send(self, record):
+        await self.client.publish(self.topic, record, 1)
+        return True
+
+
+class HTTPSink(Sink):
+    """POSTs each record to an HTTP endpoint taking line protocol, e.g.
+    InfluxDB's /api/v2/write (with org, bucket and precision=ns query
+    parameters). 'token' is sent as an InfluxDB style Authorization
+    header. A 4xx response other than 429 (too many requests) rejects the
+    record."""
+
+    def __init__(self, url, token=None):
+        super().__init__('http')
+        self.client = http_client.HTTPClient(url)
+        head = b'Content-Type: text/plain; charset=utf-8\r\n'
+        if token:
+            head += b'Authorization: Token ' + token.encode() + b'\r\n'
+        self._headers = head
+
+    async def send(self, record):
+        status = await self.client.post(self._headers, record)
+        if 200 <= status < 300:
+            return True
+        if 400 <= status < 500 and status != 429:
+            return None
+        return False
+
+
+class WoWSink:
+    """Sends the observations to WoW through the flash-backed wow_queue,
+    which keeps to the WoW rate limit and retries until WoW accepts or
+    rejects a report."""
+
+    name = 'wow'
+
+    def __init__(self, site_id, auth_key):
+        self.site_id = site_id
+        self.auth_key = auth_key
+
+    def put(self, record, observation):
+        wow_queue.enqueue(*observation)
+
+    async def send_next(self):
+        return await wow_queue.send_next(self.site_id, self.auth_key)
+
+    async def run(self):
+        await wow_queue.drain(self.site_id, self.auth_key)
+
+
+def setup(site_id, auth_key, sensor):
+    """Create the sinks from the settings. 'sensor' is the label (bytes) of
+    the sensor the observations are of, used to tag the records."""
+    global _sensor
+    _sensor = sensor
+    sinks.append(WoWSink(site_id, auth_key))
+    broker = config.get('MQTT_BROKER')
+    if broker:
+        sinks.append(MQTTSink(broker, config.get('MQTT_TOPIC'),
+                              config.get('MQTT_USER'),
+                              config.get('MQTT_PASSWORD')))
+    url = config.get('HTTP_SINK_URL')
+    if url:
+        sinks.append(HTTPSink(url, config.get('HTTP_SINK_TOKEN')))
+
+
+def publish(obs_time, tempc, max_tempc=None, min_tempc=None):
+    """Queue an observation on every sink. This never waits on the
+    network."""
+    record = encode(_sensor, obs_time, tempc, max_tempc, min_tempc)
+    observation = (obs_time, tempc, max_tempc, min_tempc)
+    for sink in sinks:
+        sink.put(record, observation)
+
+
+async def send_next():
+    """Send the oldest queued observation of each sink, for low power mode
+    where there are no sink tasks."""
+    for sink in sinks:
+        await sink.send_next()
+
+
+async def run():
+    """Run every sink's task."""
+    await asyncio.gather(*[sink.run() for sink in sinks])
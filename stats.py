@@ -0,0 +1,136 @@
+import gc
+import ujson
+import utime
+from array import array
+
+STATS_FILE = "stats.json"
+persist_interval = 0  # seconds between saving stats to STATS_FILE, 0 = off
+
+# Histogram bucket i counts durations below 4 ** i microseconds (the last
+# bucket counts everything longer), so 12 buckets cover 1us to over 4s
+BUCKETS = 12
+
+
+class Timer:
+    """Fixed-size record of how long one stage takes: count, min, mean and
+    max, and a histogram of durations in power-of-4 microsecond buckets.
+    Time a stage with start() and stop(), or add() a measured duration."""
+
+    def __init__(self, name):
+        self.name = name
+        self.hist = array('L', [0] * BUCKETS)
+        self._started = 0
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total_us = 0
+        self.min_us = 0
+        self.max_us = 0
+        for i in range(BUCKETS):
+            self.hist[i] = 0
+
+    def start(self):
+        self._started = utime.ticks_us()
+
+    def stop(self):
+        self.add(utime.ticks_diff(utime.ticks_us(), self._started))
+
+    def add(self, us):
+        if self.count == 0 or us < self.min_us:
+            self.min_us = us
+        if us > self.max_us:
+            self.max_us = us
+        self.count += 1
+        self.total_us += us
+        bucket = 0
+        limit = 1
+        while us >= limit and bucket < BUCKETS - 1:
+            bucket += 1
+            limit <<= 2
+        self.hist[bucket] += 1
+
+    def mean_us(self):
+        return self.total_us // self.count if self.count else 0
+
+
+hmt = Timer('hmt')  # HMT request to parsed reply
+parse = Timer('parse')
+calibrate = Timer('calibrate')
+save_temps = Timer('save_temps')
+archive = Timer('archive')
+wow_post = Timer('wow_post')
+ntp_sync = Timer('ntp_sync')
+wifi = Timer('wifi')  # link down (or boot) to connected
+gc_collect = Timer('gc')
+TIMERS = (hmt, parse, calibrate, save_temps, archive, wow_post, ntp_sync,
+          wifi, gc_collect)
+
+# Heap watermarks (bytes), from gc.mem_free() when sampled. MicroPython
+# only reports the largest free block through micropython.mem_info(),
+# which prints it rather than returning it, so it isn't tracked here.
+heap_free = None
+heap_free_low = None
+heap_free_high = None
+
+# Counters read from other modules: (label, module, attribute names)
+_counters = []
+
+
+def register(label, module, names):
+    """Include the named counters of 'module' in the report."""
+    _counters.append((label, module, names))
+
+
+def sample_heap():
+    """Update the heap watermarks with the current free memory."""
+    global heap_free, heap_free_low, heap_free_high
+    if not hasattr(gc, 'mem_free'):
+        return  # not running on MicroPython
+    heap_free = gc.mem_free()
+    if heap_free_low is None or heap_free < heap_free_low:
+        heap_free_low = heap_free
+    if heap_free_high is None or heap_free > heap_free_high:
+        heap_free_high = heap_free
+
+
+def collect():
+    """Run the garbage collector, timing it and sampling the heap before
+    (lowest free memory) and after (highest free memory)."""
+    sample_heap()
+    gc_collect.start()
+    gc.collect()
+    gc_collect.stop()
+    sample_heap()
+
+
+def timer_line(timer):
+    return '{} n={} min={} avg={} max={} us hist={}'.format(
+        timer.name, timer.count, timer.min_us, timer.mean_us(),
+        timer.max_us, ','.join(str(n) for n in timer.hist))
+
+
+def report(write):
+    """Write the stats a line at a time with 'write', e.g. uart1.write."""
+    for timer in TIMERS:
+        write('\r\n' + timer_line(timer))
+    write('\r\nheap free ' + str(heap_free) + ' low ' + str(heap_free_low) +
+          ' high ' + str(heap_free_high))
+    for label, module, names in _counters:
+        write('\r\n' + label + ' ' + ' '.join(
+            name + '=' + str(getattr(module, name)) for name in names))
+    write('\r\n')
+
+
+def save():
+    """Save the stats to STATS_FILE as JSON."""
+    data = {'time': utime.time(), 'counters': {},
+            'heap': [heap_free, heap_free_low, heap_free_high]}
+    for timer in TIMERS:
+        data[timer.name] = [timer.count, timer.min_us, timer.mean_us(),
+                            timer.max_us, list(timer.hist)]
+    counters = data['counters']
+    for label, module, names in _counters:
+        counters[label] = {name: getattr(module, name) for name in names}
+    with open(STATS_FILE, "w") as datafile:
+        ujson.dump(data, datafile)
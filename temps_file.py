@@ -1,38 +1,155 @@
-import ujson as json
+import struct
 import utime
-import uos
+import stats
 
-TEMPS_FILE = "temps.json"
-MAX_FILE_AGE = 600  # Maximum age of the file in seconds (10 mins) allowed
+SEGMENT_FILES = ("temps0.bin", "temps1.bin")
+SEGMENT_RECORDS = 128  # Number of records each segment file holds
+MAX_FILE_AGE = 600  # Maximum age of the last record in seconds (10 mins)
+
+# Each record: sequence number, timestamp (epoch seconds), current temp, max
+# temp, min temp, readings count and a Fletcher-16 checksum of the preceding
+# fields.
+RECORD_FORMAT = "<IIfffHH"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+CHECKED_SIZE = RECORD_SIZE - 2
+SEGMENT_SIZE = RECORD_SIZE * SEGMENT_RECORDS
+NAN = float('nan')
+
+_record = bytearray(RECORD_SIZE)
+_erased = b'\xff' * RECORD_SIZE
+_file = None  # Open handle on the segment currently being written
+_segment = 0  # Index of the segment currently being written
+_slot = 0  # Next free record slot in the current segment
+_seq = 0  # Sequence number of the last record written
+_last = None  # (timestamp, max, min, count) of the last valid record
+
+
+def _checksum(buf):
+    """Fletcher-16 checksum of the record fields."""
+    a = b = 0
+    for i in range(CHECKED_SIZE):
+        a = (a + buf[i]) % 255
+        b = (b + a) % 255
+    return (b << 8) | a
+
+
+def _valid(buf):
+    """True if 'buf' holds a complete record. Erased (0xFF) and torn
+    records fail the checksum."""
+    seq = buf[0] | buf[1] << 8 | buf[2] << 16 | buf[3] << 24
+    check = buf[CHECKED_SIZE] | buf[CHECKED_SIZE + 1] << 8
+    return seq != 0 and check == _checksum(buf)
+
+
+def _erase(name):
+    """Pre-size a segment file and fill it with erased records."""
+    with open(name, "wb") as segment:
+        for _ in range(SEGMENT_RECORDS):
+            segment.write(_erased)
+
+
+def _recover():
+    """Find the most recent valid record by scanning each segment backwards
+    from its end, and set the write position to the slot after it. Creates
+    any missing segment files."""
+    global _segment, _slot, _seq, _last
+    _segment, _slot, _seq, _last = 0, 0, 0, None
+    for index, name in enumerate(SEGMENT_FILES):
+        try:
+            with open(name, "rb") as segment:
+                for slot in range(SEGMENT_RECORDS - 1, -1, -1):
+                    segment.seek(slot * RECORD_SIZE)
+                    if segment.readinto(_record) != RECORD_SIZE or \
+                            not _valid(_record):
+                        continue
+                    seq, timestamp, _, max_temp, min_temp, count, _ = \
+                        struct.unpack(RECORD_FORMAT, _record)
+                    if seq > _seq:
+                        _segment, _slot, _seq = index, slot + 1, seq
+                        _last = (timestamp, max_temp, min_temp, count)
+        except OSError:
+            # Segment doesn't exist yet
+            _erase(name)
+
+
+def _open_segment():
+    global _file, _segment, _slot
+    if _slot >= SEGMENT_RECORDS:
+        # Current segment full - move on to the oldest one and reuse it
+        _segment = (_segment + 1) % len(SEGMENT_FILES)
+        _slot = 0
+        _erase(SEGMENT_FILES[_segment])
+    _file = open(SEGMENT_FILES[_segment], "r+b")
 
 
 def load_temps():
     """Return the last recorded max / min temperature and count of temperature
     readings provided those readings haven't exceeded the maximum age
     allowed. This is useful if the machine has restarted and allows max/min
-    temperature recording to continue."""
+    temperature recording to continue. A torn or corrupt record from a
+    power cut during a write is skipped and the record before it used."""
     try:
-        file_stats = uos.stat(TEMPS_FILE)
-        # Index 8 represents the file's modified time
-        modified_time = file_stats[8]
-        time_now = utime.time()
-        if time_now - modified_time < MAX_FILE_AGE:
-            with open(TEMPS_FILE, "r") as datafile:
-                temp_data = json.load(datafile)
-                return temp_data.get("max_temp"), temp_data.get("min_temp"), \
-                    temp_data.get("count")
+        _recover()
     except OSError:
-        # File doesn't exist or couldn't be read
-        pass
-
+        # Segments couldn't be read or created
+        return None, None, 0
+    if _last is not None and utime.time() - _last[0] < MAX_FILE_AGE:
+        timestamp, max_temp, min_temp, count = _last
+        # NaN (not equal to itself) is stored for a missing temperature
+        return None if max_temp != max_temp else max_temp, \
+            None if min_temp != min_temp else min_temp, count
     return None, None, 0
 
 
-def save_temps(max_temp, min_temp, count):
-    """Save the current max/min temps and readings count to file in
-    JSON format"""
-    # Save the variables' values
-    data = {"max_temp": max_temp, "min_temp": min_temp,
-            "count": count}
-    with open(TEMPS_FILE, "w") as datafile:
-        json.dump(data, datafile)
+def save_temps(max_temp, min_temp, count, temp=None):
+    """Append the current max/min temps, readings count and (1-minute mean)
+    temperature to the journal as a fixed-size packed record. Records are
+    written in turn into pre-sized segment files, so each save is a single
+    small write in place rather than a rewrite of the whole file, and the
+    segments share the flash wear."""
+    global _file, _slot, _seq
+    stats.save_temps.start()
+    if _file is None:
+        if _seq == 0:
+            _recover()
+        _open_segment()
+    elif _slot >= SEGMENT_RECORDS:
+        _file.close()
+        _open_segment()
+    _seq += 1
+    struct.pack_into(RECORD_FORMAT, _record, 0, _seq, utime.time(),
+                     NAN if temp is None else temp,
+                     NAN if max_temp is None else max_temp,
+                     NAN if min_temp is None else min_temp,
+                     min(count, 0xFFFF), 0)
+    check = _checksum(_record)
+    _record[CHECKED_SIZE] = check & 0xFF
+    _record[CHECKED_SIZE + 1] = check >> 8
+    _file.seek(_slot * RECORD_SIZE)
+    _file.write(_record)
+    _file.flush()
+    _slot += 1
+    stats.save_temps.stop()
+
+
+def history():
+    """Generator of the records in the journal, oldest first, as
+    (timestamp, temp, max temp, min temp, count) with None for a missing
+    temperature. Records are read from flash one at a time into a buffer of
+    its own, so the journal can be written while this is in use."""
+    if _seq == 0:
+        _recover()
+    buf = bytearray(RECORD_SIZE)
+    for index in (_segment + 1, _segment):
+        name = SEGMENT_FILES[index % len(SEGMENT_FILES)]
+        with open(name, "rb") as segment:
+            for _ in range(SEGMENT_RECORDS):
+                if segment.readinto(buf) != RECORD_SIZE:
+                    break
+                if not _valid(buf):
+                    continue
+                _, timestamp, temp, max_temp, min_temp, count, _ = \
+                    struct.unpack(RECORD_FORMAT, buf)
+                yield (timestamp, None if temp != temp else temp,
+                       None if max_temp != max_temp else max_temp,
+                       None if min_temp != min_temp else min_temp, count)
@@ -0,0 +1,154 @@
+import network
+import socket
+import utime
+import uasyncio as asyncio
+import stats
+
+connect_timeout = 15  # time allowed for each connection attempt in seconds
+min_backoff = 5  # wait after the first failed attempt in seconds
+max_backoff = 600  # longest wait between attempts in seconds
+reinit_after = 3  # failed attempts in a row before the radio is restarted
+check_interval = 1  # how often the link is checked in seconds
+dns_ttl = 3600  # how long a resolved server address is reused in seconds
+
+# The WLAN and the network joined. 'static' is (ip, netmask, gateway, dns)
+# to set the address without waiting for DHCP, or None to use DHCP.
+wlan = None
+_ssid = None
+_password = None
+_static = None
+
+_ready = False
+_down_ticks = None  # ticks_ms when the link was found to be down
+_addresses = {}  # (host, port) -> (address, time resolved)
+
+# Connection counters. The time taken to (re)connect is timed by
+# stats.wifi, from the link going down to it being ready again.
+connects = 0  # connections made, including the first
+reconnects = 0  # connections made after the link was lost
+failures = 0  # connection attempts that failed or timed out
+dns_lookups = 0  # getaddrinfo calls
+dns_hits = 0  # addresses answered from the cache
+
+
+def start(ssid, password, static=None):
+    """Switch the WiFi on and start connecting to 'ssid'. run() then keeps
+    the connection up."""
+    global wlan, _ssid, _password, _static, _down_ticks
+    _ssid, _password, _static = ssid, password, static
+    wlan = network.WLAN(network.STA_IF)
+    wlan.active(True)
+    wlan.config(pm=0xa11140)
+    _down_ticks = utime.ticks_ms()
+    _connect()
+
+
+def _connect():
+    if _static is not None:
+        # Setting the address before connecting skips DHCP
+        wlan.ifconfig(_static)
+    wlan.connect(_ssid, _password)
+
+
+def ready():
+    """True while the WiFi is connected. This only reads a flag kept up to
+    date by run(), so it can be called as often as needed."""
+    return _ready
+
+
+async def wait_ready(timeout=None):
+    """Wait up to 'timeout' seconds (None for as long as it takes) for the
+    WiFi to be connected. Returns True if it is."""
+    waited = 0
+    while not _ready and (timeout is None or waited < timeout):
+        await asyncio.sleep(check_interval)
+        waited += check_interval
+    return _ready
+
+
+def _status():
+    # 3 is connected, a negative status is a failure
+    status = wlan.status()
+    return 1 if status == 3 else (-1 if status < 0 else 0)
+
+
+async def _attempt():
+    """Wait for the connection in progress. Returns True if connected."""
+    waited = 0
+    while waited < connect_timeout:
+        status = _status()
+        if status:
+            return status > 0
+        await asyncio.sleep(check_interval)
+        waited += check_interval
+    return False
+
+
+async def run():
+    """Background task keeping the WiFi connected. The link status is
+    checked every 'check_interval' seconds and a lost connection is
+    reconnected, backing off exponentially from 'min_backoff' to
+    'max_backoff' seconds between failed attempts. After 'reinit_after'
+    failed attempts in a row the radio is switched off and on again."""
+    global _ready, _down_ticks, connects, reconnects, failures
+    backoff = min_backoff
+    failed = 0
+    reconnecting = False  # False for the connection started by start()
+    while True:
+        if _status() > 0:
+            if not _ready:
+                _ready = True
+                stats.wifi.add(utime.ticks_diff(utime.ticks_ms(),
+                                                _down_ticks) * 1000)
+                if connects:
+                    reconnects += 1
+                connects += 1
+                print('WiFi connected, ip = ' + wlan.ifconfig()[0])
+                backoff = min_backoff
+                failed = 0
+            await asyncio.sleep(check_interval)
+            continue
+        if _ready:
+            _ready = False
+            _down_ticks = utime.ticks_ms()
+            print('WiFi connection lost...')
+        if reconnecting:
+            if failed and failed % reinit_after == 0:
+                print('Restarting WiFi...')
+                wlan.active(False)
+                wlan.active(True)
+                wlan.config(pm=0xa11140)
+            else:
+                wlan.disconnect()
+            _connect()
+        reconnecting = True
+        if await _attempt():
+            continue
+        failures += 1
+        failed += 1
+        print('WiFi connection failed, retrying in ' + str(backoff) + 's')
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, max_backoff)
+
+
+def resolve(host, port, socktype=0):
+    """The address of 'host' from socket.getaddrinfo(), reused for
+    'dns_ttl' seconds. getaddrinfo blocks, so this saves a wait on every
+    report and time sync. Raises OSError if the host can't be resolved."""
+    global dns_lookups, dns_hits
+    key = (host, port)
+    cached = _addresses.get(key)
+    now = utime.time()
+    if cached is not None and 0 <= now - cached[1] <= dns_ttl:
+        dns_hits += 1
+        return cached[0]
+    dns_lookups += 1
+    address = socket.getaddrinfo(host, port, 0, socktype)[0][-1]
+    _addresses[key] = (address, now)
+    return address
+
+
+def forget(host, port):
+    """Drop the cached address of 'host', e.g. after failing to connect to
+    it, so the next resolve() looks it up again."""
+    _addresses.pop((host, port), None)
@@ -0,0 +1,142 @@
+import struct
+import utime
+import uasyncio as asyncio
+import metoffice_wow
+import wifi_manager
+
+QUEUE_FILE = "wow_queue.bin"
+MAX_RECORDS = 256  # Maximum number of queued observations kept on flash
+MIN_INTERVAL = 300  # Minimum time between WoW transmissions in seconds
+RETRY_WAIT = 600  # Time to wait after a failed transmission in seconds
+POLL_INTERVAL = 5  # How often the drainer checks the queue in seconds
+
+# Header: index of the oldest record and number of records queued.
+# Each record: observation time (epoch seconds), temp, max temp and min
+# temp. A temperature that isn't part of the report is stored as NaN.
+HEADER_FORMAT = "<II"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+RECORD_FORMAT = "<Ifff"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+NAN = float('nan')
+
+head = 0
+count = 0
+evicted = 0  # Number of observations dropped because the queue was full
+_loaded = False
+_last_sent = None  # ticks_ms of the last transmission
+_record = bytearray(RECORD_SIZE)
+
+
+def _load():
+    """Read the queue header from flash, creating a pre-sized queue file if
+    there isn't a valid one."""
+    global head, count, _loaded
+    try:
+        with open(QUEUE_FILE, "rb") as queue:
+            head, count = struct.unpack(HEADER_FORMAT,
+                                        queue.read(HEADER_SIZE))
+        if head >= MAX_RECORDS or count > MAX_RECORDS:
+            raise ValueError
+    except (OSError, ValueError):
+        head, count = 0, 0
+        with open(QUEUE_FILE, "wb") as queue:
+            queue.write(struct.pack(HEADER_FORMAT, head, count))
+            queue.write(bytearray(RECORD_SIZE * MAX_RECORDS))
+    _loaded = True
+
+
+def _write_header(queue):
+    queue.seek(0)
+    queue.write(struct.pack(HEADER_FORMAT, head, count))
+
+
+def enqueue(obs_time, tempc, max_tempc=None, min_tempc=None):
+    """Add an observation to the end of the queue. This is a single record
+    write plus a header update and never waits on the network. If the queue
+    is full the oldest observation is dropped to make room."""
+    global head, count, evicted
+    if not _loaded:
+        _load()
+    slot = (head + count) % MAX_RECORDS
+    if count == MAX_RECORDS:
+        head = (head + 1) % MAX_RECORDS
+        evicted += 1
+        print('WoW queue full - dropped oldest observation')
+    else:
+        count += 1
+    struct.pack_into(RECORD_FORMAT, _record, 0, obs_time, tempc,
+                     NAN if max_tempc is None else max_tempc,
+                     NAN if min_tempc is None else min_tempc)
+    with open(QUEUE_FILE, "r+b") as queue:
+        queue.seek(HEADER_SIZE + slot * RECORD_SIZE)
+        queue.write(_record)
+        _write_header(queue)
+    return count
+
+
+def peek():
+    """Return the oldest queued observation as (obs_time, temp, max temp,
+    min temp) with None for any temperature not in the report, or None if
+    the queue is empty."""
+    if not _loaded:
+        _load()
+    if count == 0:
+        return None
+    with open(QUEUE_FILE, "rb") as queue:
+        queue.seek(HEADER_SIZE + head * RECORD_SIZE)
+        queue.readinto(_record)
+    obs_time, tempc, max_tempc, min_tempc = struct.unpack(RECORD_FORMAT,
+                                                          _record)
+    # NaN is the only value not equal to itself
+    return (obs_time, tempc,
+            None if max_tempc != max_tempc else max_tempc,
+            None if min_tempc != min_tempc else min_tempc)
+
+
+def pop():
+    """Remove the oldest observation from the queue."""
+    global head, count
+    if not _loaded:
+        _load()
+    if count == 0:
+        return
+    head = (head + 1) % MAX_RECORDS
+    count -= 1
+    with open(QUEUE_FILE, "r+b") as queue:
+        _write_header(queue)
+
+
+async def send_next(wow_site_id, wow_auth_key):
+    """Send the oldest queued observation to WoW if the WiFi is connected
+    and MIN_INTERVAL seconds have passed since the last transmission.
+    The observation stays queued until WoW accepts it, or rejects it as
+    malformed (400). Returns the WoW result, or None if nothing was sent."""
+    global _last_sent
+    if not wifi_manager.ready() or (
+            _last_sent is not None and utime.ticks_diff(
+                utime.ticks_ms(), _last_sent) < MIN_INTERVAL * 1000):
+        return None
+    observation = peek()
+    if observation is None:
+        return None
+    obs_time, tempc, max_tempc, min_tempc = observation
+    # A single POST: drain() waits RETRY_WAIT before trying again
+    result = await metoffice_wow.send_wow(wow_site_id, wow_auth_key, tempc,
+                                          max_tempc, min_tempc, obs_time, 0)
+    _last_sent = utime.ticks_ms()
+    print('WoW result (201 = success): ' + result)
+    if result == '201' or result == '400':
+        pop()
+    return result
+
+
+async def drain(wow_site_id, wow_auth_key):
+    """Background task that sends queued observations to WoW, oldest first,
+    whenever the WiFi is connected, spaced at least MIN_INTERVAL seconds
+    apart as required by the WoW API."""
+    while True:
+        result = await send_next(wow_site_id, wow_auth_key)
+        if result is None or result == '201' or result == '400':
+            await asyncio.sleep(POLL_INTERVAL)
+        else:
+            await asyncio.sleep(RETRY_WAIT)